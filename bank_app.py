@@ -1,153 +1,3380 @@
 # bank_app.py
-import tkinter as tk
-from tkinter import ttk, messagebox, simpledialog
+import time
+_IMPORT_STARTED = time.perf_counter()
+
 import csv
+import functools
+import io
 import os
 import hashlib
+import hmac
+import mmap
+import sqlite3
+import struct
+import sys
+import threading
+import queue
+import zlib
+from array import array
+from collections import OrderedDict, deque
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from itertools import compress
 from math import isfinite
+from operator import attrgetter
+
+try:
+    import fcntl
+except ImportError:  # Windows: ProcessLock then only excludes this process's threads
+    fcntl = None
+
+# tkinter and NumPy are imported on first use (_load_tk / _require_numpy) so
+# headless runs start quickly and don't need a display
+tk = ttk = messagebox = simpledialog = None
+np = None
+
+# -----------------------------
+# Configuration & constants
+# -----------------------------
+USERS_FILE = "users.csv"
+LOANS_FILE = "loan_records.csv"
+# status changes are appended here and folded into LOANS_FILE in the background once the
+# log passes STATUS_LOG_COMPACT_BYTES (or at once by compact_loans())
+LOAN_STATUS_LOG_FILE = "loan_status_log.csv"
+STATUS_LOG_COMPACT_BYTES = 256 * 1024
+# high-water mark of handed-out loan ids; rebuilt from LOANS_FILE if missing
+LOAN_ID_SEQ_FILE = "loan_id.seq"
+# with a StorageWriter, ids are reserved this many at a time on the writer thread, ahead of use
+LOAN_ID_BLOCK = 64
+# lists temp -> target renames of an in-flight batch commit; rolled forward on startup
+COMMIT_MANIFEST_FILE = "commit.manifest"
+# several processes may share one data directory: writers take an flock() on LOCK_FILE,
+# and STORE_EPOCH_FILE counts compactions so other processes know to reload
+LOCK_FILE = "bank.lock"
+STORE_EPOCH_FILE = "store.epoch"
+# times LoanService syncs and retries a write that lost a race with another process
+CONFLICT_RETRIES = 5
+# per-user changes are appended here and replayed over USERS_FILE (the snapshot);
+# past USER_JOURNAL_COMPACT_BYTES the journal is folded into a new snapshot in the background
+USER_JOURNAL_FILE = "users_journal.csv"
+USER_JOURNAL_COMPACT_BYTES = 256 * 1024
+# binary column snapshots of the loans and users written next to the CSVs, so startup
+# memory-maps them instead of parsing every row; ignored once the CSVs no longer match
+LOAN_SNAPSHOT_FILE = "loan_records.snap"
+USER_SNAPSHOT_FILE = "users.snap"
+SNAPSHOT_MAGIC = b"BANKSNP1"
+SNAPSHOTS_ENABLED = os.environ.get("BANK_SNAPSHOT", "1") != "0"
+SNAPSHOT_USER_SCANS = 16  # per-user scans of a loaded snapshot before indexing every user at once
+# rows replayed on top of a snapshot (appended since it was written) past which the load rewrites it:
+# this many, or a tenth of the snapshot's rows if that is more
+SNAPSHOT_REFRESH_ROWS = 10_000
+
+# when appends reach the disk: "always" (fsync every write, no coalescing),
+# "batch" (fsync once per coalesced StorageWriter flush) or "never" (leave it to the OS)
+FSYNC_POLICY = os.environ.get("BANK_FSYNC", "batch")
+
+# password KDF: "pbkdf2_sha256" (cost = iterations) or "scrypt" (cost = N, a power of two).
+# Hashes made with an older scheme/cost, or legacy unsalted SHA-256, are upgraded on login.
+PASSWORD_SCHEME = os.environ.get("BANK_PASSWORD_SCHEME", "pbkdf2_sha256")
+DEFAULT_PASSWORD_COSTS = {"pbkdf2_sha256": 200_000, "scrypt": 2 ** 14}
+PASSWORD_COST = int(os.environ.get("BANK_PASSWORD_COST", 0)) or DEFAULT_PASSWORD_COSTS.get(PASSWORD_SCHEME, 0)
+HASH_WORKERS = 2
+
+# Opt-in instrumentation: timing spans + row counters exported on exit (.json, else
+# Prometheus text), and a cProfile dump of the whole session (see enable_metrics)
+METRICS_FILE = os.environ.get("BANK_METRICS")
+PROFILE_FILE = os.environ.get("BANK_PROFILE")
+
+# storage engine: "csv" (default, the files above) or "sqlite" (SQLITE_FILE)
+STORAGE_BACKEND = os.environ.get("BANK_STORAGE", "csv")
+SQLITE_FILE = os.environ.get("BANK_SQLITE_FILE", "bank.db")
+
+USER_FIELDS = ["username", "password_hash", "email", "income", "user_type", "balance"]
+LOAN_FIELDS = ["id","username","loan_type","amount","interest_rate","term_years","monthly_payment","total_interest","status"]
+# bulk application imports (CSV or JSON Lines); income falls back to the user's stored income
+IMPORT_FIELDS = ["username", "loan_type", "amount", "term_years", "income"]
+IMPORT_CHUNK_SIZE = 5000
+# rule-based pre-screening of pending loans (see compile_rules)
+SCREENING_AUDIT_FILE = "screening_audit.csv"
+SCREENING_AUDIT_FIELDS = ["screened_at", "loan_id", "username", "rule", "outcome", "applied"]
+DEFAULT_SCREENING_RULES = [
+    {"name": "term-over-product-max", "when": [["term_years", ">", "max_term"]], "outcome": "reject"},
+    {"name": "payment-over-half-income", "when": [["payment_ratio", ">", 0.5]], "outcome": "reject"},
+    {"name": "large-amount", "when": [["amount", ">", 250000]], "outcome": "manual"},
+    {"name": "large-existing-balance", "when": [["existing_balance", ">", 500000]], "outcome": "manual"},
+    {"name": "affordable", "when": [["payment_ratio", "<=", 0.35], ["amount", "<=", 100000]], "outcome": "approve"},
+]
+# auto-approvals that would take an applicant's approved payments (earlier loans in the same
+# run included) past this share of income are held for manual review under this rule name
+SCREENING_MAX_PAYMENT_RATIO = 0.5
+SCREENING_EXPOSURE_RULE = "over-limit-within-run"
+# local HTTP/JSON API (see LoanApiServer)
+API_HOST = "127.0.0.1"
+API_PORT = int(os.environ.get("BANK_API_PORT", 8080))
+API_MAX_BATCH = 512      # mutations applied per group commit
+API_SYNC_SECONDS = 1.0   # idle interval for picking up other processes' writes
+API_SESSION_SECONDS = 8 * 3600  # a login token unused this long expires
+API_MAX_SESSIONS = 10_000       # beyond this the least recently used tokens are dropped
+# rate-shock stress test (see stress_test)
+STRESS_CHUNK_SIZE = 20000
+DEFAULT_STRESS_SCENARIOS = ["+100bp", "+200bp", "+300bp"]
+
+# rows per page in the admin pending-loans table
+ADMIN_PAGE_SIZE = 200
+# how often (ms) the Tk loop runs callbacks that background threads posted to it
+GUI_POLL_MS = 20
+
+LOAN_OPTIONS = {
+    "Housing Loan": {"rate": 5.2, "max_term": 25},
+    "Auto Loan": {"rate": 7.5, "max_term": 6},
+    "Personal Loan": {"rate": 9.6, "max_term": 10},
+}
+
+# -----------------------------
+# Utility & Data Layer
+# -----------------------------
+def _legacy_sha256(password: str) -> str:
+    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+
+def _kdf(password, scheme, cost, salt):
+    data = password.encode("utf-8")
+    if scheme == "pbkdf2_sha256":
+        return hashlib.pbkdf2_hmac("sha256", data, salt, cost)
+    if scheme == "scrypt":
+        # r=8, p=1; scrypt needs ~128 * N * r bytes of memory
+        return hashlib.scrypt(data, salt=salt, n=cost, r=8, p=1, maxmem=256 * cost * 8 + (1 << 20), dklen=32)
+    raise ValueError(f"Unknown password scheme {scheme!r}")
+
+def hash_password(password: str, scheme=None, cost=None) -> str:
+    """Salted KDF hash stored as "scheme$cost$salt_hex$hash_hex" (PASSWORD_SCHEME / PASSWORD_COST by default)."""
+    scheme = scheme or PASSWORD_SCHEME
+    cost = cost or PASSWORD_COST
+    salt = os.urandom(16)
+    return f"{scheme}${cost}${salt.hex()}${_kdf(password, scheme, cost, salt).hex()}"
+
+def verify_password(password: str, stored: str) -> bool:
+    """Check a password against a KDF hash or a legacy unsalted SHA-256 hex digest."""
+    if "$" not in stored:
+        return hmac.compare_digest(_legacy_sha256(password), stored)
+    try:
+        scheme, cost, salt, digest = stored.split("$")
+        candidate = _kdf(password, scheme, int(cost), bytes.fromhex(salt))
+    except ValueError:
+        return False
+    return hmac.compare_digest(candidate.hex(), digest)
+
+def password_needs_upgrade(stored: str) -> bool:
+    """True for legacy SHA-256 hashes and hashes made with another scheme or cost."""
+    return not stored.startswith(f"{PASSWORD_SCHEME}${PASSWORD_COST}$")
+
+class PasswordHasher:
+    """Runs password hashing on a small thread pool so the caller (the Tk loop) never blocks.
+
+    hashlib releases the GIL inside pbkdf2_hmac and scrypt, so the pool
+    really runs in parallel. Results are passed to `dispatch` (BankApp.dispatch
+    in the GUI) as on_done(result) or on_error(exception).
+    """
+    def __init__(self, workers=None, dispatch=None):
+        self._pool = ThreadPoolExecutor(max_workers=workers or HASH_WORKERS, thread_name_prefix="hasher")
+        self._dispatch = dispatch or (lambda fn, *args: fn(*args))
+
+    def submit(self, fn, *args, on_done=None, on_error=None):
+        def finished(future):
+            error = future.exception()
+            if error is None:
+                if on_done is not None:
+                    self._dispatch(on_done, future.result())
+            elif on_error is not None:
+                self._dispatch(on_error, error)
+        future = self._pool.submit(fn, *args)
+        future.add_done_callback(finished)
+        return future
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+
+def benchmark_password_costs(costs, scheme=None, seconds=1.0, workers=None):
+    """Measure successful logins (verify_password calls) per second for each cost.
+
+    Returns one dict per cost with the single-thread rate and the rate with
+    `workers` hashing threads.
+    """
+    scheme = scheme or PASSWORD_SCHEME
+    workers = workers or HASH_WORKERS
+    results = []
+    for cost in costs:
+        stored = hash_password("correct horse", scheme, cost)
+        rates = []
+        for threads in (1, workers):
+            done = [0] * threads
+            deadline = time.perf_counter() + seconds
+            def run(slot):
+                while time.perf_counter() < deadline:
+                    verify_password("correct horse", stored)
+                    done[slot] += 1
+            started = time.perf_counter()
+            pool = [threading.Thread(target=run, args=(i,)) for i in range(threads)]
+            for t in pool:
+                t.start()
+            for t in pool:
+                t.join()
+            rates.append(sum(done) / (time.perf_counter() - started))
+        results.append({"scheme": scheme, "cost": cost, "logins_per_sec": rates[0],
+                        "workers": workers, "logins_per_sec_pool": rates[1]})
+    return results
+
+
+def ensure_files_exist(prompt_admin=True):
+    """Create missing data files; on a fresh install optionally prompt for the first admin."""
+    storage = get_storage()
+    if storage.create_if_missing() and prompt_admin:
+        print("No admin account found. Please create one now.")
+        admin_user = input("Enter admin username: ").strip()
+        admin_pw = input("Enter admin password: ").strip()
+        admin_email = input("Enter admin email: ").strip()
+        storage.write_users({
+            admin_user: {
+                "password_hash": hash_password(admin_pw),
+                "email": admin_email,
+                "income": 0.0,
+                "user_type": "admin",
+                "balance": 0.0,
+            }
+        })
+        print(f"Admin account '{admin_user}' created successfully.")
+
+# -----------------------------
+# Compact records
+# -----------------------------
+class CodeTable:
+    """Small-int codes for a low-cardinality string column; unseen values get the next code."""
+
+    def __init__(self, values=()):
+        self.values = []
+        self.codes = {}
+        for value in values:
+            self.code(value)
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            value = sys.intern(str(value))
+            self.values.append(value)
+            code = self.codes.setdefault(value, len(self.values) - 1)
+        return code
+
+LOAN_STATUS_CODES = CodeTable(["pending", "approved", "rejected"])
+LOAN_TYPE_CODES = CodeTable(LOAN_OPTIONS)
+USER_TYPE_CODES = CodeTable(["client", "admin"])
+
+class LoanRecord(MutableMapping):
+    """One loan held in __slots__, with status and loan_type stored as CodeTable codes.
+
+    Reads and writes like the {field: value} dict it replaces (rec["status"],
+    rec.get(...), dict(rec), csv.DictWriter) at a fraction of the memory.
+    The keys are exactly LOAN_FIELDS; the version stamp is an attribute only.
+    """
+    __slots__ = ("id", "username", "_loan_type", "amount", "interest_rate", "term_years",
+                 "monthly_payment", "total_interest", "_status", "version")
+    _KEYS = frozenset(LOAN_FIELDS)
+
+    def __init__(self, id, username, loan_type, amount, interest_rate, term_years, monthly_payment,
+                 total_interest, status, version=0):
+        self.id = str(id)
+        self.username = sys.intern(username)  # shared by all of a user's loans
+        self._loan_type = LOAN_TYPE_CODES.code(loan_type)
+        self.amount = float(amount)
+        self.interest_rate = float(interest_rate)
+        self.term_years = float(term_years)
+        self.monthly_payment = float(monthly_payment)
+        self.total_interest = float(total_interest)
+        self._status = LOAN_STATUS_CODES.code(status)
+        self.version = int(version)  # bumped by every status change; see StaleWriteError
+
+    @classmethod
+    def from_mapping(cls, record):
+        return cls(*[record[k] for k in LOAN_FIELDS], version=getattr(record, "version", 0))
+
+    @classmethod
+    def snapshot_loader(cls, snapshot):
+        """load(row) for a loans ColumnSnapshot that fills the slots straight from the columns."""
+        strings = snapshot.strings
+        ids, users, types, amounts, rates, terms, monthly, interest, statuses, versions = (
+            snapshot.view(name) for name, _ in _LOAN_SNAPSHOT_COLUMNS)
+        # string-table index -> CodeTable code, for the few distinct types and statuses
+        type_codes = {i: LOAN_TYPE_CODES.code(strings[i]) for i in set(types)}
+        status_codes = {i: LOAN_STATUS_CODES.code(strings[i]) for i in set(statuses)}
+        new = object.__new__
+
+        def load(row):
+            rec = new(cls)
+            rec.id = strings[ids[row]]
+            rec.username = sys.intern(strings[users[row]])
+            rec._loan_type = type_codes[types[row]]
+            rec.amount = amounts[row]
+            rec.interest_rate = rates[row]
+            rec.term_years = terms[row]
+            rec.monthly_payment = monthly[row]
+            rec.total_interest = interest[row]
+            rec._status = status_codes[statuses[row]]
+            rec.version = versions[row]
+            return rec
+        return load
+
+    @property
+    def loan_type(self):
+        return LOAN_TYPE_CODES.values[self._loan_type]
+
+    @loan_type.setter
+    def loan_type(self, value):
+        self._loan_type = LOAN_TYPE_CODES.code(value)
+
+    @property
+    def status(self):
+        return LOAN_STATUS_CODES.values[self._status]
+
+    @status.setter
+    def status(self, value):
+        self._status = LOAN_STATUS_CODES.code(value)
+
+    def __getitem__(self, key):
+        if key not in self._KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self._KEYS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        raise TypeError("loan fields can't be removed")
+
+    def __iter__(self):
+        return iter(LOAN_FIELDS)
+
+    def __len__(self):
+        return len(LOAN_FIELDS)
+
+    def __repr__(self):
+        return f"LoanRecord({dict(self)!r})"
+
+class UserRecord(MutableMapping):
+    """A user's fields (everything in USER_FIELDS but the username key) in __slots__.
+
+    Like LoanRecord it stands in for the old per-user dict; user_type is a
+    CodeTable code. Journal replay swaps in updated copies (see
+    apply_user_entry), so treat instances handed out by UserStore as read-only.
+    """
+    __slots__ = ("password_hash", "email", "income", "_user_type", "balance", "version")
+    _FIELDS = USER_FIELDS[1:]
+    _KEYS = frozenset(_FIELDS)
+
+    def __init__(self, password_hash, email, income, user_type, balance, version=0):
+        self.password_hash = password_hash
+        self.email = email
+        self.income = float(income) if income != "" else 0.0
+        self._user_type = USER_TYPE_CODES.code(user_type)
+        self.balance = float(balance)
+        self.version = int(version)
+
+    @classmethod
+    def from_mapping(cls, meta, version=None, **changes):
+        return cls(*[changes[k] if k in changes else meta[k] for k in cls._FIELDS],
+                   version=getattr(meta, "version", 0) if version is None else version)
+
+    @property
+    def user_type(self):
+        return USER_TYPE_CODES.values[self._user_type]
+
+    @user_type.setter
+    def user_type(self, value):
+        self._user_type = USER_TYPE_CODES.code(value)
+
+    __getitem__ = LoanRecord.__getitem__
+    __setitem__ = LoanRecord.__setitem__
+
+    def __delitem__(self, key):
+        raise TypeError("user fields can't be removed")
+
+    def __iter__(self):
+        return iter(self._FIELDS)
+
+    def __len__(self):
+        return len(self._FIELDS)
+
+    def __repr__(self):
+        return f"UserRecord({dict(self)!r})"
+
+# -----------------------------
+# Binary snapshots
+# -----------------------------
+def _file_state(path):
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return 0, 0
+    return st.st_size, st.st_mtime_ns
+
+def _complete_length(path):
+    """Bytes of `path` up to and including its last newline (0 if missing).
+
+    Rows are appended whole and newline-terminated, so anything after that
+    is a row torn by a crash mid-append.
+    """
+    try:
+        with open(path, "rb") as f:
+            pos = f.seek(0, os.SEEK_END)
+            while pos:
+                start = max(0, pos - 4096)
+                f.seek(start)
+                cut = f.read(pos - start).rfind(b"\n")
+                if cut >= 0:
+                    return start + cut + 1
+                pos = start
+    except FileNotFoundError:
+        pass
+    return 0
+
+def _lines_upto(f, end):
+    """Decoded lines of binary file `f` up to byte `end`, which must be a line boundary."""
+    for line in f:
+        end -= len(line)
+        if end < 0:
+            return
+        yield line.decode()
+
+def _boundary_crc(path, size):
+    """CRC of the (up to) 4 KiB ending at byte `size`: tells a file that was only appended to from a rewritten one."""
+    if size == 0:
+        return 0
+    start = max(0, size - 4096)
+    try:
+        with open(path, "rb") as f:
+            f.seek(start)
+            return zlib.crc32(f.read(size - start))
+    except FileNotFoundError:
+        return None
+
+class ColumnSnapshot:
+    """A table written by write_column_snapshot(), memory-mapped for reading.
+
+    Layout: SNAPSHOT_MAGIC, a uint32 header length and a JSON header (row
+    count, column layout, the source files the table was built from), then,
+    8-byte aligned, one fixed-width array per column: "d" doubles, "i"
+    int32s, and "s" int32 indexes into the NUL-separated UTF-8 string
+    table, then any named blobs. Numeric columns are views on the map, so a
+    row costs nothing until row(i) reads it.
+    """
+
+    def __init__(self, path):
+        import json
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start = len(SNAPSHOT_MAGIC) + 4
+        if len(self._map) < start or self._map[:len(SNAPSHOT_MAGIC)] != SNAPSHOT_MAGIC:
+            raise ValueError(f"{path} is not a snapshot")
+        (header_len,) = struct.unpack_from("<I", self._map, len(SNAPSHOT_MAGIC))
+        self.header = json.loads(self._map[start:start + header_len])
+        base = start + header_len
+        base += -base % 8
+        if self.header["byteorder"] != sys.byteorder or len(self._map) != base + self.header["end"]:
+            raise ValueError(f"{path} is truncated or from another platform")
+        self.rows = self.header["rows"]
+        view = memoryview(self._map)
+        self.names = []
+        self._columns = []
+        for name, kind, offset, itemsize in self.header["columns"]:
+            self.names.append(name)
+            data = view[base + offset:base + offset + itemsize * self.rows]
+            self._columns.append((data.cast("d" if kind == "d" else "i"), kind == "s"))
+        start, end = self.header["strings"]
+        self.strings = self._map[base + start:base + end].decode().split("\0")
+        self._base = base
+
+    @property
+    def sources(self):
+        return self.header["sources"]
+
+    @property
+    def extra(self):
+        return self.header["extra"]
+
+    def blob(self, name):
+        start, end = self.header["blobs"][name]
+        return self._map[self._base + start:self._base + end]
+
+    def view(self, name):
+        """A column as stored: doubles, int32s, or string-table indexes for "s" columns."""
+        return self._columns[self.names.index(name)][0]
+
+    def column(self, name):
+        """One whole column as a list (string columns resolved through the table)."""
+        values, is_text = self._columns[self.names.index(name)]
+        if is_text:
+            strings = self.strings
+            return [strings[i] for i in values]
+        return values.tolist()
+
+    def row(self, i):
+        strings = self.strings
+        return [strings[values[i]] if is_text else values[i] for values, is_text in self._columns]
+
+def write_column_snapshot(path, columns, sources, extra=None, blobs=None):
+    """Write {name: (kind, values)} as a ColumnSnapshot, replacing `path` atomically.
+
+    `sources` records the files the table was read from (see
+    CsvStorage.snapshot_sources), `extra` is any JSON kept in the header and
+    `blobs` {name: bytes} are stored raw, for data only read on demand.
+    Raises ValueError for strings the table can't hold (containing NUL).
+    """
+    import json
+    strings = {}
+    arrays = []
+    for name, (kind, values) in columns.items():
+        if kind == "s":
+            values = [strings.setdefault(v, len(strings)) for v in values]
+        arrays.append((name, kind, array("d" if kind == "d" else "i", values)))
+    text = "\0".join(strings).encode()
+    if strings and text.count(b"\0") != len(strings) - 1:
+        raise ValueError("snapshot strings may not contain NUL")
+    blobs = blobs or {}
+    chunks = [values for _, _, values in arrays] + [text] + list(blobs.values())
+    spans = []
+    offset = 0
+    for chunk in chunks:
+        offset += -offset % 8
+        size = len(chunk) * (chunk.itemsize if isinstance(chunk, array) else 1)
+        spans.append([offset, offset + size])
+        offset += size
+    header = json.dumps({
+        "rows": len(arrays[0][2]) if arrays else 0,
+        "byteorder": sys.byteorder,
+        "columns": [[name, kind, span[0], values.itemsize] for (name, kind, values), span in zip(arrays, spans)],
+        "strings": spans[len(arrays)],
+        "blobs": dict(zip(blobs, spans[len(arrays) + 1:])),
+        "end": offset,
+        "sources": sources,
+        "extra": extra or {},
+    }).encode()
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(SNAPSHOT_MAGIC + struct.pack("<I", len(header)) + header)
+        for chunk in chunks:
+            f.write(b"\0" * (-f.tell() % 8))
+            f.write(chunk)
+    os.replace(tmp, path)
+
+# column kinds per record attribute, in constructor order (see ColumnSnapshot)
+_LOAN_SNAPSHOT_COLUMNS = [("id", "s"), ("username", "s"), ("loan_type", "s"), ("amount", "d"),
+                          ("interest_rate", "d"), ("term_years", "d"), ("monthly_payment", "d"),
+                          ("total_interest", "d"), ("status", "s"), ("version", "i")]
+_USER_SNAPSHOT_COLUMNS = [("password_hash", "s"), ("email", "s"), ("income", "d"), ("user_type", "s"),
+                          ("balance", "d"), ("version", "i")]
+
+class LazyRecords(dict):
+    """{key: record} whose values start out as snapshot row numbers.
+
+    A value is turned into a record by load(row) the first time it is read
+    through [], get(), values() or items(), so loading a snapshot only costs
+    the keys. Other dict methods (pop, setdefault, dict(...)) see row numbers.
+    """
+    __slots__ = ("_load",)
+
+    def __init__(self, rows, load):
+        super().__init__(rows)
+        self._load = load
+
+    def __getitem__(self, key):
+        value = dict.__getitem__(self, key)
+        if type(value) is int:
+            value = self._load(value)
+            dict.__setitem__(self, key, value)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def values(self):
+        return (self[key] for key in self)
+
+    def items(self):
+        return ((key, self[key]) for key in self)
+
+def _snapshot_outgrown(snapshot, replayed):
+    """True once `replayed` tail rows cost enough that the snapshot should be rewritten."""
+    return replayed > max(SNAPSHOT_REFRESH_ROWS, snapshot.rows // 10)
+
+def _refreshed_columns(records, snapshot, kinds, key=None):
+    """Snapshot columns for LazyRecords `records` loaded from `snapshot` and changed since.
+
+    Rows never read are copied as stored; records that were built (read,
+    changed or added since) are read off their attributes, so nothing new is
+    built. `key` names a column holding the dict's keys.
+    """
+    values = list(dict.values(records))
+    columns = {key: ("s", list(records))} if key else {}
+    for name, kind in kinds:
+        stored, read = snapshot.column(name), attrgetter(name)
+        columns[name] = (kind, [stored[v] if type(v) is int else read(v) for v in values])
+    return columns
+
+# -----------------------------
+# Storage backends
+# -----------------------------
+class StaleWriteError(RuntimeError):
+    """A write was based on a record another process has changed since we read it.
+
+    Every loan and user carries a version that each status change, password
+    change or balance change bumps by one. Writes name the version they create,
+    and the backend refuses them unless the stored record is still one behind.
+    Nothing is written or applied in memory when this is raised. Call
+    LoanService.sync() and retry; LoanService retries its own writes this way.
+    """
+
+class ProcessLock:
+    """Re-entrant lock that also excludes other processes, via flock() on `path`.
+
+    The lock file is opened per outermost acquire, relative to the current
+    directory like the data files. Without fcntl only threads are excluded.
+    on_acquire() runs after each outermost acquire, with the lock held.
+    """
+
+    def __init__(self, path, on_acquire=None):
+        self.path = path
+        self.on_acquire = on_acquire
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._fd = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            try:
+                self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                if self._fd is not None:
+                    os.close(self._fd)
+                    self._fd = None
+                self._lock.release()
+                raise
+        self._depth += 1
+        if self._depth == 1 and self.on_acquire is not None:
+            try:
+                self.on_acquire()
+            except BaseException:
+                self.__exit__(None, None, None)
+                raise
+        return self
+
+    def __exit__(self, *exc):
+        self._depth -= 1
+        if self._depth == 0 and self._fd is not None:
+            os.close(self._fd)  # drops the flock
+            self._fd = None
+        self._lock.release()
+
+class CsvStorage:
+    """Default backend: USERS_FILE / LOANS_FILE plus the status log and id sidecar.
+
+    Safe to share between processes: every write holds ProcessLock(LOCK_FILE)
+    and status/journal rows carry versions that are checked against the rows
+    other processes appended since our load (see StaleWriteError).
+    """
+    name = "csv"
+    USER_COLUMNS = USER_FIELDS + ["version"]
+    LOAN_COLUMNS = LOAN_FIELDS + ["version"]
+
+    def __init__(self):
+        # serializes appends, id reservation, log compaction, journal rotation and snapshot
+        # writes, between this process's threads and (flock) with other processes. Whoever
+        # takes it first finishes a batch commit that crashed after its manifest (recover),
+        # before reading or writing anything it touched.
+        self._write_lock = ProcessLock(LOCK_FILE, on_acquire=self.recover)
+        # per-thread {path: [rows]} buffered by batch()
+        self._local = threading.local()
+        self._compactor = None  # users; the loans one is _loans_compactor
+        self._loans_compactor = None
+        # versions logged since the in-memory view was loaded, by us or anyone else:
+        # {loan_id: version}, {username: version}, and how far into each log we have read
+        self._stamps = {LOAN_STATUS_LOG_FILE: {}, USER_JOURNAL_FILE: {}}
+        self._read_to = {LOAN_STATUS_LOG_FILE: 0, USER_JOURNAL_FILE: 0}
+        # store epochs (loans, users) the view belongs to; None until loading() or first write
+        self._view = {LOAN_STATUS_LOG_FILE: None, USER_JOURNAL_FILE: None}
+
+    def _write_temp(self, path, write_rows, tmp=None):
+        """Write a sibling temp file via write_rows(file) and fsync it; returns the temp path.
+
+        The name is unique to this process, so a temp another process left
+        behind for recover() to roll forward is never overwritten.
+        """
+        tmp = tmp or f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", newline="") as f:
+            write_rows(f)
+            f.flush()
+            os.fsync(f.fileno())
+        return tmp
+
+    def _write_users_rows(self, users):
+        def write_rows(f):
+            writer = csv.writer(f)
+            writer.writerow(self.USER_COLUMNS)
+            for u, meta in users.items():
+                writer.writerow([u, meta["password_hash"], meta["email"], meta["income"], meta["user_type"],
+                                 meta["balance"], getattr(meta, "version", 0)])
+        return write_rows
+
+    # --- store epochs: bumped whenever a log is folded away or USERS_FILE replaced ---
+    _EPOCH_INDEX = {LOAN_STATUS_LOG_FILE: 0, USER_JOURNAL_FILE: 1}
+
+    def _read_epochs(self):
+        try:
+            with open(STORE_EPOCH_FILE) as f:
+                loans, users = f.read().split()
+                return [int(loans), int(users)]
+        except (OSError, ValueError):
+            return [0, 0]
+
+    def _bump_epoch(self, log):
+        """Record that `log` was folded away; views of it older than this must reload."""
+        epochs = self._read_epochs()
+        current = epochs[self._EPOCH_INDEX[log]]
+        epochs[self._EPOCH_INDEX[log]] += 1
+        tmp = self._write_temp(STORE_EPOCH_FILE, lambda f: f.write(f"{epochs[0]} {epochs[1]}\n"))
+        os.replace(tmp, STORE_EPOCH_FILE)
+        if self._view[log] == current:
+            # our stamps already cover every row that was folded, so the view stays valid
+            self._view[log] = current + 1
+        self._read_to[log] = 0
+
+    # --- optimistic concurrency ---
+    @staticmethod
+    def _read_tail(path, offset):
+        """Complete rows appended to `path` after byte `offset`, and the new offset."""
+        try:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], 0
+        end = data.rfind(b"\n") + 1  # leave a half-written last row for next time
+        return list(csv.reader(io.StringIO(data[:end].decode(), newline=""))), offset + end
+
+    @staticmethod
+    def _complete_rows(path, end=None):
+        """Rows of `path` up to its last newline (or byte `end`); a row torn by a crash mid-append is left out.
+
+        A torn row can still parse as a valid shorter one ("12,rej"), so it
+        has to be dropped by where it ends, not by its field count.
+        """
+        end = _complete_length(path) if end is None else end
+        if not end:
+            return
+        with open(path, newline="") as f:
+            if end == os.fstat(f.fileno()).st_size:
+                yield from csv.reader(f)
+                return
+        with open(path, "rb") as f:
+            yield from csv.reader(_lines_upto(f, end))
+
+    @staticmethod
+    def _drop_torn_row(path):
+        """Truncate `path` to its last complete row, so the next append starts on a line of its own (lock held)."""
+        end = _complete_length(path)
+        if os.path.exists(path) and os.path.getsize(path) != end:
+            os.truncate(path, end)
+
+    def _refresh_stamps(self):
+        """Pick up versions other processes logged since we last looked (lock held)."""
+        epochs = self._read_epochs()
+        for log, index in self._EPOCH_INDEX.items():
+            if self._view[log] is None:
+                self._view[log] = epochs[index]  # nothing loaded through loading(); trust the caller
+            size = os.path.getsize(log) if os.path.exists(log) else 0
+            if size < self._read_to[log]:
+                self._read_to[log] = 0  # folded away and restarted by another process
+            if size == self._read_to[log]:
+                continue
+            rows, self._read_to[log] = self._read_tail(log, self._read_to[log])
+            stamps = self._stamps[log]
+            for row in rows:
+                version = _row_version(log, row)
+                if version is not None:
+                    stamps[row[0] if log == LOAN_STATUS_LOG_FILE else row[1]] = version
+        return epochs
+
+    def _check_versions(self, log, changes):
+        """Raise StaleWriteError unless every (key, new_version) is one ahead of the store."""
+        epochs = self._refresh_stamps()
+        changes = [(key, version) for key, version in changes if version is not None]
+        if not changes:
+            return
+        what = "loan" if log == LOAN_STATUS_LOG_FILE else "user"
+        if epochs[self._EPOCH_INDEX[log]] != self._view[log]:
+            raise StaleWriteError(f"{what}s were compacted by another process since they were loaded")
+        stamps = self._stamps[log]
+        for key, version in changes:
+            if stamps.get(key, version - 1) != version - 1:
+                raise StaleWriteError(f"{what} {key} was changed by another process")
+
+    def _stamp(self, log, rows):
+        stamps = self._stamps[log]
+        for row in rows:
+            version = _row_version(log, row)
+            if version is not None:
+                stamps[str(row[0]) if log == LOAN_STATUS_LOG_FILE else row[1]] = version
+
+    @contextmanager
+    def loading(self, part):
+        """Hold the lock while the caller loads "loans" or "users" into memory.
+
+        Resets the version stamps for that part: from here on a write is
+        checked against what was on disk at this load. One in-memory view per
+        process (LoanService's) should be loaded this way.
+        """
+        log = LOAN_STATUS_LOG_FILE if part == "loans" else USER_JOURNAL_FILE
+        with self._write_lock:
+            self._flush_pending()
+            yield
+            self._view[log] = self._read_epochs()[self._EPOCH_INDEX[log]]
+            self._stamps[log].clear()
+            self._read_to[log] = os.path.getsize(log) if os.path.exists(log) else 0
+
+    def sync_cursor(self):
+        """Position in the store that changes_since() reports changes after."""
+        with self._write_lock:
+            self._flush_pending()
+            return {"epochs": self._read_epochs(),
+                    **{path: os.path.getsize(path) if os.path.exists(path) else 0
+                       for path in (LOANS_FILE, LOAN_STATUS_LOG_FILE, USER_JOURNAL_FILE)}}
+
+    def changes_since(self, cursor):
+        """Return (new cursor, changes) for what was written after `cursor`.
+
+        changes has "loans" (new LoanRecords), "statuses" ((id, status,
+        version) rows), "user_entries" (journal entries) and "reload", the
+        parts ("loans"/"users") that were compacted meanwhile and must be
+        reloaded instead.
+        """
+        with self._write_lock:
+            new = self.sync_cursor()
+            changes = {"loans": [], "statuses": [], "user_entries": [], "reload": set()}
+            if new["epochs"][0] != cursor["epochs"][0]:
+                changes["reload"].add("loans")
+            else:
+                changes["loans"] = self._loans_after(cursor[LOANS_FILE])
+                changes["statuses"] = self._statuses_after(cursor[LOAN_STATUS_LOG_FILE])
+            if new["epochs"][1] != cursor["epochs"][1]:
+                changes["reload"].add("users")
+            else:
+                changes["user_entries"], _ = self._read_tail(USER_JOURNAL_FILE, cursor[USER_JOURNAL_FILE])
+            return new, changes
+
+    def _loans_after(self, offset):
+        """LoanRecords for the complete rows appended to LOANS_FILE after byte `offset` (past the header)."""
+        rows, _ = self._read_tail(LOANS_FILE, offset)
+        if not rows:
+            return []
+        with open(LOANS_FILE, newline="") as f:
+            header = next(csv.reader(f))
+        columns = [header.index(k) for k in LOAN_FIELDS]
+        version_col = header.index("version") if "version" in header else None
+        return [LoanRecord(*[row[i] for i in columns], version=row[version_col] if version_col else 0)
+                for row in rows if len(row) >= len(header)]
+
+    def _statuses_after(self, offset):
+        rows, _ = self._read_tail(LOAN_STATUS_LOG_FILE, offset)
+        return [(row[0], row[1], _row_version(LOAN_STATUS_LOG_FILE, row)) for row in rows if len(row) >= 2]
+
+    # --- binary snapshots (see ColumnSnapshot) ---
+    # part -> (snapshot file, [(source file, may have been appended to since)], store epoch index)
+    _SNAPSHOT_PARTS = {
+        "loans": (LOAN_SNAPSHOT_FILE, [(LOANS_FILE, True), (LOAN_STATUS_LOG_FILE, True)], 0),
+        "users": (USER_SNAPSHOT_FILE, [(USERS_FILE, False), (USER_JOURNAL_FILE + ".1", False),
+                                       (USER_JOURNAL_FILE, True)], 1),
+    }
+
+    def snapshot_sources(self, part):
+        """Size, mtime and boundary CRC of the files behind "loans" or "users", taken with the lock held."""
+        _, files, index = self._SNAPSHOT_PARTS[part]
+        with self._write_lock:
+            sources = {"epoch": self._read_epochs()[index]}
+            for path, _ in files:
+                size, mtime = _file_state(path)
+                sources[path] = [size, mtime, _boundary_crc(path, size)]
+        return sources
+
+    def open_snapshot(self, part):
+        """Memory-map the snapshot of "loans" or "users" if it still matches the CSVs.
+
+        Returns (snapshot, tail) or None. A source may have been appended to
+        since (same bytes up to the recorded size, same store epoch) but not
+        rewritten; tail is what was appended: (new LoanRecords, status rows)
+        for "loans", journal entries for "users".
+        """
+        path, files, index = self._SNAPSHOT_PARTS[part]
+        if not SNAPSHOTS_ENABLED or not os.path.exists(path):
+            return None
+        with self._write_lock:
+            try:
+                snapshot = ColumnSnapshot(path)
+            except (OSError, ValueError, KeyError):
+                return None
+            sources = snapshot.sources
+            if sources.get("epoch") != self._read_epochs()[index]:
+                return None
+            offsets = {}
+            for source, appendable in files:
+                if source not in sources:
+                    return None
+                size, mtime, crc = sources[source]
+                now_size, now_mtime = _file_state(source)
+                if (now_size, now_mtime) != (size, mtime) and not (
+                        appendable and now_size > size and _boundary_crc(source, size) == crc):
+                    return None
+                offsets[source] = size
+            if part == "loans":
+                return snapshot, (self._loans_after(offsets[LOANS_FILE]),
+                                  self._statuses_after(offsets[LOAN_STATUS_LOG_FILE]))
+            entries, _ = self._read_tail(USER_JOURNAL_FILE, offsets[USER_JOURNAL_FILE])
+            return snapshot, entries
+
+    def write_snapshot(self, part, records, sources, aggregates=None, columns=None):
+        """Snapshot `records` (loaded while `sources` was taken) for the next open_snapshot().
+
+        `records` is the list of LoanRecords or the {username: UserRecord}
+        dict, or None with `columns` built already (see _refreshed_columns);
+        loans also keep their PortfolioAggregates.tables(). The snapshot is
+        only a cache, so failing to write it is ignored.
+        """
+        if not SNAPSHOTS_ENABLED:
+            return
+        if columns is None and part == "loans":
+            columns = {k: (kind, list(map(attrgetter(k), records))) for k, kind in _LOAN_SNAPSHOT_COLUMNS}
+        elif columns is None:
+            users = list(records.values())
+            columns = {"username": ("s", list(records))}
+            columns.update((k, (kind, list(map(attrgetter(k), users)))) for k, kind in _USER_SNAPSHOT_COLUMNS)
+        extra, blobs = {}, {}
+        if aggregates is not None:
+            import json
+            extra["by_product"] = aggregates["by_product"]
+            blobs["by_user"] = json.dumps(aggregates["by_user"]).encode()
+        try:
+            write_column_snapshot(self._SNAPSHOT_PARTS[part][0], columns, sources, extra, blobs)
+        except (OSError, ValueError):
+            pass
+
+    # --- appends ---
+    def _write_rows(self, path, rows):
+        with self._write_lock:
+            self._drop_torn_row(path)
+            with open(path, "a", newline="") as f:
+                csv.writer(f).writerows(rows)
+                if FSYNC_POLICY != "never":
+                    f.flush()
+                    os.fsync(f.fileno())
+                if path in self._read_to:
+                    self._read_to[path] = f.tell()  # our own rows are stamped already
+
+    def _append_rows(self, path, rows):
+        pending = getattr(self._local, "pending", None)
+        if pending is not None:
+            pending.setdefault(path, []).extend(rows)
+        else:
+            self._write_rows(path, rows)
+            self._maybe_compact()
+
+    def _append_versioned(self, log, rows):
+        """Check, stamp and append status-log or journal rows under the lock."""
+        with self._write_lock:
+            key = 0 if log == LOAN_STATUS_LOG_FILE else 1
+            self._check_versions(log, [(str(row[key]), _row_version(log, row)) for row in rows])
+            self._stamp(log, rows)
+            self._append_rows(log, rows)
+
+    def _flush_pending(self):
+        pending = getattr(self._local, "pending", None)
+        if pending:
+            for path, rows in pending.items():
+                self._write_rows(path, rows)
+            pending.clear()
+
+    @contextmanager
+    def batch(self):
+        """Buffer this thread's appends and write each file once (one fsync) on exit.
+
+        The lock is held throughout, so other processes can't slip rows in
+        between the version checks and the flush.
+        """
+        if getattr(self._local, "pending", None) is not None:
+            yield  # already batching
+            return
+        with self._write_lock:
+            self._local.pending = {}
+            try:
+                yield
+            finally:
+                try:
+                    self._flush_pending()
+                finally:
+                    self._local.pending = None
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        """Start compacting whichever log is due, after a write and on the thread that made it (with a
+        StorageWriter, its thread), so callers that only queue writes never wait for the lock."""
+        compactor = self._loans_compactor
+        if compactor is None or not compactor.is_alive():
+            try:
+                due = os.path.getsize(LOAN_STATUS_LOG_FILE) >= STATUS_LOG_COMPACT_BYTES
+            except OSError:
+                due = False
+            if due:
+                self._loans_compactor = threading.Thread(target=self._compact_loans, name="loans-compactor",
+                                                         daemon=True)
+                self._loans_compactor.start()
+        self.maybe_compact_users()
+
+    def _append_step(self, path, rows):
+        """Manifest step appending `rows` to `path` in place: (temp holding just the rows, path, size now).
+
+        Only the new rows are written out, however long `path` has grown;
+        a torn last row is cut off first so the size is a row boundary.
+        """
+        self._drop_torn_row(path)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        return self._write_temp(path, lambda f: csv.writer(f).writerows(rows)), path, size
+
+    def _commit_manifest(self, steps):
+        """Apply (temp, target) renames atomically; a temp of "-" deletes the target.
+
+        A (temp, target, size) step appends the temp's bytes to the target,
+        first cutting it back to `size`, so redoing it is harmless. The
+        fsynced manifest is the commit point: a crash before it leaves the
+        old files untouched, one after it is finished by recover(), which
+        runs whenever the lock is taken, so before any other commit starts.
+        """
+        manifest_tmp = self._write_temp(COMMIT_MANIFEST_FILE,
+                                        lambda f: f.writelines("\t".join(map(str, step)) + "\n" for step in steps))
+        os.replace(manifest_tmp, COMMIT_MANIFEST_FILE)
+        self.recover()
+
+    def recover(self):
+        """Roll forward a batch commit interrupted after its manifest was written.
+
+        Without a manifest any leftover temp files belong to a batch that never
+        committed, and the targets still hold the previous consistent state.
+        Runs with the lock held (see _write_lock).
+        """
+        if not os.path.exists(COMMIT_MANIFEST_FILE):
+            return
+        with open(COMMIT_MANIFEST_FILE) as f:
+            steps = [line.rstrip("\n").split("\t") for line in f if line.strip()]
+        for tmp, target, *size in steps:
+            if tmp == "-":
+                if os.path.exists(target):
+                    os.remove(target)
+            elif not os.path.exists(tmp):
+                continue  # this step finished before the crash
+            elif size:
+                with open(tmp, "rb") as src, open(target, "a+b") as f:
+                    f.truncate(int(size[0]))
+                    f.write(src.read())
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.remove(tmp)
+            else:
+                os.replace(tmp, target)
+        os.remove(COMMIT_MANIFEST_FILE)
+
+    def commit_decisions(self, status_changes, user_entries, audit=None):
+        """Append a batch of loan status changes and user journal entries as one atomic unit.
+
+        status_changes are (loan_id, status, version) triples. `audit` is an
+        optional (path, rows) of SCREENING_AUDIT_FIELDS rows appended to that
+        CSV in the same commit.
+        """
+        status_rows = [[str(loan_id), status, *version] for loan_id, status, *version in status_changes]
+        with self._write_lock:
+            self._flush_pending()  # keep earlier buffered rows ahead of these
+            self._check_versions(LOAN_STATUS_LOG_FILE, [(row[0], _row_version(LOAN_STATUS_LOG_FILE, row))
+                                                        for row in status_rows])
+            self._check_versions(USER_JOURNAL_FILE, [(entry[1], _row_version(USER_JOURNAL_FILE, entry))
+                                                     for entry in user_entries])
+            appends = [(USER_JOURNAL_FILE, user_entries), (LOAN_STATUS_LOG_FILE, status_rows)]
+            if audit is not None:
+                path, rows = audit
+                if rows and not _complete_length(path):
+                    rows = [SCREENING_AUDIT_FIELDS, *rows]
+                appends.append((path, rows))
+            steps = [self._append_step(path, rows) for path, rows in appends if rows]
+            if steps:
+                self._commit_manifest(steps)
+            self._stamp(LOAN_STATUS_LOG_FILE, status_rows)
+            self._stamp(USER_JOURNAL_FILE, user_entries)
+            for log in self._read_to:
+                self._read_to[log] = os.path.getsize(log) if os.path.exists(log) else 0
+        if getattr(self._local, "pending", None) is None:
+            self._maybe_compact()
+
+    def record_user_changes(self, entries):
+        """Append journal entries (see apply_user_entry) instead of rewriting USERS_FILE."""
+        self._append_versioned(USER_JOURNAL_FILE, entries)
+
+    def maybe_compact_users(self):
+        """Start a background snapshot once the journal passes USER_JOURNAL_COMPACT_BYTES.
+
+        The live journal is rotated to USER_JOURNAL_FILE + ".1" so new entries
+        keep appending while the snapshot (USERS_FILE plus the rotated journal,
+        read back from disk since other processes journal too) is written;
+        loads replay both, so the result is the same either way. A rotated
+        journal left by another process is compacted again, which is harmless.
+        Cheap when nothing is due: the lock is only taken to rotate.
+        """
+        compactor = self._compactor
+        if compactor is not None and compactor.is_alive():
+            return
+        try:
+            if os.path.getsize(USER_JOURNAL_FILE) < USER_JOURNAL_COMPACT_BYTES:
+                return
+        except OSError:
+            return
+        with self._write_lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            if not os.path.exists(USER_JOURNAL_FILE) or os.path.getsize(USER_JOURNAL_FILE) < USER_JOURNAL_COMPACT_BYTES:
+                return
+            rotated = USER_JOURNAL_FILE + ".1"
+            if not os.path.exists(rotated):
+                self._refresh_stamps()
+                # bump before rotating, so a crash in between costs other processes a reload at worst
+                self._bump_epoch(USER_JOURNAL_FILE)
+                os.replace(USER_JOURNAL_FILE, rotated)
+            epoch = self._read_epochs()[1]
+            self._compactor = threading.Thread(target=self._compact_users, args=(epoch, rotated),
+                                               name="users-compactor", daemon=True)
+            self._compactor.start()
+
+    def _compact_users(self, epoch, rotated):
+        snapshot = self._read_users((rotated,))
+        tmp = self._write_temp(USERS_FILE, self._write_users_rows(snapshot), tmp=f"{USERS_FILE}.{os.getpid()}.compact.tmp")
+        with self._write_lock:
+            if epoch != self._read_epochs()[1] or not os.path.exists(rotated):
+                # write_users() replaced the snapshot meanwhile, or another process
+                # finished this compaction first; either way ours may be stale
+                os.remove(tmp)
+                return 0
+            os.replace(tmp, USERS_FILE)
+            os.remove(rotated)
+        return len(snapshot)
+
+    def wait_for_compaction(self):
+        for compactor in (self._loans_compactor, self._compactor):
+            if compactor is not None:
+                compactor.join()
+
+    def create_if_missing(self):
+        """Create missing files; return True if the user store was created empty."""
+        created = False
+        with self._write_lock:
+            if not os.path.exists(USERS_FILE):
+                with open(USERS_FILE, "w", newline="") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(self.USER_COLUMNS)
+                created = True
+            # loan_records.csv header: id,username,loan_type,amount,interest_rate,term_years,monthly_payment,total_interest,status,version
+            if not os.path.exists(LOANS_FILE):
+                with open(LOANS_FILE, "w", newline="") as f:
+                    writer = csv.writer(f)
+                    writer.writerow(self.LOAN_COLUMNS)
+        return created
+
+    def _read_users(self, journals=(USER_JOURNAL_FILE + ".1", USER_JOURNAL_FILE)):
+        users = {}
+        if not os.path.exists(USERS_FILE):
+            return users
+        with open(USERS_FILE, newline="") as f:
+            reader = csv.DictReader(f)
+            for r in reader:
+                users[r["username"]] = UserRecord(r["password_hash"], r["email"], r["income"], r["user_type"],
+                                                  r.get("balance") or 0.0, r.get("version") or 0)
+        for journal in journals:
+            for entry in self._complete_rows(journal):
+                apply_user_entry(users, entry)
+        return users
+
+    def load_users(self):
+        """Snapshot (USERS_FILE) plus a replay of the rotated and live journals."""
+        with self._write_lock:
+            return self._read_users()
+
+    def write_users(self, users):
+        """Full rewrite of the snapshot; the journals it supersedes are dropped in the same commit."""
+        with self._write_lock:
+            self._flush_pending()
+            self._bump_epoch(USER_JOURNAL_FILE)
+            self._commit_manifest([
+                (self._write_temp(USERS_FILE, self._write_users_rows(users)), USERS_FILE),
+                ("-", USER_JOURNAL_FILE + ".1"),
+                ("-", USER_JOURNAL_FILE),
+            ])
+            # `users` is now the store, so it is the view too
+            self._view[USER_JOURNAL_FILE] = self._read_epochs()[1]
+            self._stamps[USER_JOURNAL_FILE].clear()
+
+    def append_loan(self, record):
+        self._append_rows(LOANS_FILE, [[record[k] for k in LOAN_FIELDS] + [getattr(record, "version", 0)]])
+
+    def _load_status_log(self, end=None):
+        """Return {loan_id: (latest status, its version or None)} from the append-only status log."""
+        statuses = {}
+        for row in self._complete_rows(LOAN_STATUS_LOG_FILE, end):
+            if len(row) in (2, 3):
+                statuses[row[0]] = (row[1], _row_version(LOAN_STATUS_LOG_FILE, row))
+        return statuses
+
+    def _read_loans(self):
+        loans = []
+        if not os.path.exists(LOANS_FILE):
+            return loans
+        statuses = self._load_status_log()
+        with open(LOANS_FILE, newline="") as f:
+            reader = csv.reader(f)
+            header = next(reader, None)
+            if header is None:
+                return loans
+            columns = [header.index(k) for k in LOAN_FIELDS]
+            version_col = header.index("version") if "version" in header else None
+            for row in reader:
+                if len(row) < len(header):
+                    continue  # blank, or torn by a crash mid-append
+                # LoanRecord converts the numeric fields
+                rec = LoanRecord(*[row[i] for i in columns], version=row[version_col] if version_col else 0)
+                logged = statuses.get(rec.id)
+                if logged is not None and (logged[1] is None or logged[1] > rec.version):
+                    rec.status = logged[0]
+                    rec.version = logged[1] or rec.version
+                loans.append(rec)
+        return loans
+
+    def load_loans(self):
+        with self._write_lock:
+            return self._read_loans()
+
+    def update_loan_status(self, loan_id, status, version=None):
+        """Append one event row to the status log (O(1), independent of loan count).
+
+        load_loans() replays the log over LOANS_FILE; once the log grows past
+        STATUS_LOG_COMPACT_BYTES it is folded back in by compact().
+        """
+        self._append_versioned(LOAN_STATUS_LOG_FILE,
+                               [[str(loan_id), status] + ([version] if version is not None else [])])
+
+    def compact(self):
+        """Fold the status log into LOANS_FILE and drop the log, now (see _compact_loans)."""
+        with self._write_lock:
+            self._flush_pending()
+            if os.path.exists(LOAN_STATUS_LOG_FILE):
+                self._compact_loans()
+
+    def _compact_loans(self):
+        """Fold the status log into LOANS_FILE, taking the lock only at the start and the end.
+
+        LOANS_FILE and the log are read up to where they end when we start,
+        streaming rows as text (no records are built) into a temp file.
+        Loans appended meanwhile are then copied over as they are, and log
+        rows written meanwhile start the new log, in one manifest commit.
+        If another process compacted first, the result is thrown away.
+        """
+        with self._write_lock:
+            epoch = self._read_epochs()[0]
+            loans_end = _complete_length(LOANS_FILE)
+            log_end = _complete_length(LOAN_STATUS_LOG_FILE)
+        if not log_end or not loans_end:
+            return
+        statuses = self._load_status_log(log_end)
+
+        def write_rows(f):
+            writer = csv.writer(f)
+            writer.writerow(self.LOAN_COLUMNS)
+            reader = self._complete_rows(LOANS_FILE, loans_end)
+            header = next(reader)
+            columns = [header.index(k) for k in LOAN_FIELDS]
+            version_col = header.index("version") if "version" in header else None
+            status = LOAN_FIELDS.index("status")
+            for row in reader:
+                if len(row) < len(header):
+                    continue  # blank
+                out = [row[i] for i in columns] + [row[version_col] if version_col else 0]
+                logged = statuses.get(out[0])
+                if logged is not None and (logged[1] is None or logged[1] > int(out[-1] or 0)):
+                    out[status] = logged[0]
+                    out[-1] = logged[1] or out[-1]
+                writer.writerow(out)
+
+        def rows_since(path, start):
+            with open(path, "rb") as f:
+                f.seek(start)
+                return f.read(_complete_length(path) - start)
+
+        tmp = self._write_temp(LOANS_FILE, write_rows,
+                               tmp=f"{LOANS_FILE}.{os.getpid()}.{threading.get_ident()}.compact.tmp")
+        with self._write_lock:
+            if epoch != self._read_epochs()[0]:
+                os.remove(tmp)  # compacted by another process (or thread) meanwhile
+                return
+            with open(tmp, "ab") as f:
+                f.write(rows_since(LOANS_FILE, loans_end))
+                f.flush()
+                os.fsync(f.fileno())
+            log_tail = rows_since(LOAN_STATUS_LOG_FILE, log_end).decode()
+            log_step = (self._write_temp(LOAN_STATUS_LOG_FILE, lambda f: f.write(log_tail)) if log_tail else "-",
+                        LOAN_STATUS_LOG_FILE)
+            self._refresh_stamps()
+            # bump first, so a crash before the commit costs other processes a reload at worst
+            self._bump_epoch(LOAN_STATUS_LOG_FILE)
+            self._commit_manifest([(tmp, LOANS_FILE), log_step])
+
+    def _read_loan_id_seq(self):
+        try:
+            with open(LOAN_ID_SEQ_FILE) as f:
+                return int(f.read().strip())
+        except (OSError, ValueError):
+            return None
+
+    def _write_loan_id_seq(self, high_water):
+        # temp file + fsync + rename: the sidecar is either the old or the new value, never torn
+        tmp = f"{LOAN_ID_SEQ_FILE}.{os.getpid()}.tmp"
+        with open(tmp, "w") as f:
+            f.write(str(high_water))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, LOAN_ID_SEQ_FILE)
+
+    def recover_loan_id_sequence(self):
+        """Re-seed the id sidecar from the highest id in LOANS_FILE (one O(N) scan).
+
+        Only needed when the sidecar is missing or corrupt; reserve_loan_ids()
+        calls it automatically in that case. Never moves the mark backwards:
+        the lock is held throughout, so no other process can reserve ids
+        between the read and the write.
+        """
+        with self._write_lock:
+            high_water = self._read_loan_id_seq() or 0
+            if os.path.exists(LOANS_FILE):
+                with open(LOANS_FILE, newline="") as f:
+                    reader = csv.reader(f)
+                    next(reader, None)  # header
+                    for row in reader:
+                        if row and row[0].isdigit():
+                            high_water = max(high_water, int(row[0]))
+            self._write_loan_id_seq(high_water)
+        return high_water
+
+    def reserve_loan_ids(self, count):
+        with self._write_lock:
+            high_water = self._read_loan_id_seq()
+            if high_water is None:
+                high_water = self.recover_loan_id_sequence()
+            self._write_loan_id_seq(high_water + count)
+        return range(high_water + 1, high_water + count + 1)
+
+class SqliteStorage:
+    """Embedded SQLite backend: one reused connection in WAL mode, indexed on username/status.
+
+    All statements are constant SQL strings with ? placeholders, so sqlite3's
+    statement cache prepares each one once per connection. Writes take the
+    database write lock up front (BEGIN IMMEDIATE) and only update a row whose
+    version is still the one the caller read (see StaleWriteError); every write
+    stamps the rows it touches with a new change sequence for changes_since().
+    """
+    name = "sqlite"
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password_hash TEXT NOT NULL,
+            email TEXT,
+            income REAL NOT NULL DEFAULT 0,
+            user_type TEXT NOT NULL,
+            balance REAL NOT NULL DEFAULT 0,
+            version INTEGER NOT NULL DEFAULT 0,
+            seq INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS loans (
+            id TEXT PRIMARY KEY,
+            username TEXT NOT NULL,
+            loan_type TEXT NOT NULL,
+            amount REAL NOT NULL,
+            interest_rate REAL NOT NULL,
+            term_years REAL NOT NULL,
+            monthly_payment REAL NOT NULL,
+            total_interest REAL NOT NULL,
+            status TEXT NOT NULL,
+            version INTEGER NOT NULL DEFAULT 0,
+            seq INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS loans_username ON loans(username);
+        CREATE INDEX IF NOT EXISTS loans_status ON loans(status);
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS screening_audit (
+            screened_at TEXT NOT NULL,
+            loan_id TEXT NOT NULL,
+            username TEXT NOT NULL,
+            rule TEXT NOT NULL,
+            outcome TEXT NOT NULL,
+            applied INTEGER NOT NULL
+        );
+    """
+    # added after the first release; _migrate() adds them to older databases
+    _VERSION_COLUMNS = ("version INTEGER NOT NULL DEFAULT 0", "seq INTEGER NOT NULL DEFAULT 0")
+    _USER_COLUMNS = "username, password_hash, email, income, user_type, balance, version"
+    _UPSERT_USER = ("INSERT OR REPLACE INTO users (username, password_hash, email, income, user_type, balance, "
+                    "version, seq) VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+    _CREATE_USER = _UPSERT_USER.replace("INSERT OR REPLACE", "INSERT OR IGNORE", 1)
+    # per journal op: (unversioned, versioned) update
+    _SET_USER = {
+        "password": ("UPDATE users SET password_hash = ?, version = version + 1, seq = ? WHERE username = ?",
+                     "UPDATE users SET password_hash = ?, version = ?, seq = ? WHERE username = ? AND version = ?"),
+        "balance": ("UPDATE users SET balance = ?, version = version + 1, seq = ? WHERE username = ?",
+                    "UPDATE users SET balance = ?, version = ?, seq = ? WHERE username = ? AND version = ?"),
+    }
+    _INSERT_LOAN = ("INSERT INTO loans (id, username, loan_type, amount, interest_rate, term_years, "
+                    "monthly_payment, total_interest, status, version, seq) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)")
+    _UPSERT_LOAN = _INSERT_LOAN.replace("INSERT", "INSERT OR REPLACE", 1)
+    _INSERT_AUDIT = ("INSERT INTO screening_audit (screened_at, loan_id, username, rule, outcome, applied) "
+                     "VALUES (?, ?, ?, ?, ?, ?)")
+
+    _SYNCHRONOUS = {"always": "FULL", "batch": "NORMAL", "never": "OFF"}
+
+    def __init__(self, path=None):
+        self.path = path or SQLITE_FILE
+        self._conn = None
+        # the connection is shared by every thread, so serialize use of it
+        self._lock = threading.RLock()
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            # other processes may hold the write lock; wait for them rather than fail
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self._SYNCHRONOUS.get(FSYNC_POLICY, 'NORMAL')}")
+            conn.executescript(self._SCHEMA)
+            self._migrate(conn)
+            self._conn = conn
+        return self._conn
+
+    def _migrate(self, conn):
+        for table in ("users", "loans"):
+            have = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+            for column in self._VERSION_COLUMNS:
+                if column.split()[0] not in have:
+                    conn.execute(f"ALTER TABLE {table} ADD COLUMN {column}")
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_seq ON {table}(seq)")
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+    @contextmanager
+    def _transaction(self, begin="BEGIN IMMEDIATE"):
+        """One transaction, or a savepoint inside the one already open (e.g. inside batch()).
+
+        The savepoint makes a nested write all-or-nothing: if it raises, only
+        its own changes are rolled back and the enclosing batch carries on.
+        """
+        with self._lock:
+            conn = self.conn
+            if conn.in_transaction:
+                conn.execute("SAVEPOINT nested")
+                try:
+                    yield conn
+                except BaseException:
+                    conn.execute("ROLLBACK TO nested")
+                    conn.execute("RELEASE nested")
+                    raise
+                conn.execute("RELEASE nested")
+                return
+            conn.execute(begin)
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def _next_seq(self, conn):
+        conn.execute("INSERT INTO meta (key, value) VALUES ('change_seq', 1) "
+                     "ON CONFLICT(key) DO UPDATE SET value = value + 1")
+        return conn.execute("SELECT value FROM meta WHERE key = 'change_seq'").fetchone()[0]
+
+    def batch(self):
+        """Run several writes as a single transaction (one commit)."""
+        return self._transaction()
+
+    @contextmanager
+    def loading(self, part):
+        yield  # versions are checked against the rows themselves; no per-load state
+
+    def sync_cursor(self):
+        with self._lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'change_seq'").fetchone()
+        return row[0] if row else 0
+
+    def changes_since(self, cursor):
+        """Rows written after `cursor`, in the same shape as CsvStorage.changes_since()."""
+        with self._transaction("BEGIN") as conn:  # one read snapshot
+            seq = self.sync_cursor()
+            loans = [LoanRecord(*r) for r in conn.execute(
+                "SELECT " + ", ".join(LOAN_FIELDS) + ", version FROM loans WHERE seq > ? ORDER BY rowid", (cursor,))]
+            entries = [("create", *r) for r in conn.execute(
+                f"SELECT {self._USER_COLUMNS} FROM users WHERE seq > ?", (cursor,))]
+        return seq, {"loans": loans, "statuses": [], "user_entries": entries, "reload": set()}
+
+    def snapshot_sources(self, part):
+        return None
+
+    def open_snapshot(self, part):
+        return None  # the database is already a fast binary format
+
+    def write_snapshot(self, part, records, sources, aggregates=None, columns=None):
+        pass
+
+    def create_if_missing(self):
+        with self._lock:
+            return self.conn.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None
+
+    def load_users(self):
+        with self._lock:
+            rows = self.conn.execute(f"SELECT {self._USER_COLUMNS} FROM users").fetchall()
+        return {r[0]: UserRecord(*r[1:]) for r in rows}
+
+    def write_users(self, users):
+        # upserts every user in one transaction; the app never deletes accounts
+        with self._transaction() as conn:
+            seq = self._next_seq(conn)
+            conn.executemany(self._UPSERT_USER, [
+                (u, m["password_hash"], m["email"], float(m["income"]), m["user_type"], float(m["balance"]),
+                 getattr(m, "version", 0), seq) for u, m in users.items()])
+
+    def _apply_user_entries(self, conn, entries):
+        seq = self._next_seq(conn)
+        for entry in entries:
+            op, username = entry[0], entry[1]
+            version = _entry_version(entry)
+            if op == "create":
+                cur = conn.execute(self._UPSERT_USER if version is None else self._CREATE_USER,
+                                   (username, entry[2], entry[3], float(entry[4]), entry[5], float(entry[6]),
+                                    version or 0, seq))
+            elif op in self._SET_USER:
+                value = entry[2] if op == "password" else float(entry[3])
+                if version is None:
+                    cur = conn.execute(self._SET_USER[op][0], (value, seq, username))
+                else:
+                    cur = conn.execute(self._SET_USER[op][1], (value, version, seq, username, version - 1))
+            else:
+                continue
+            if version is not None and cur.rowcount == 0:
+                raise StaleWriteError(f"user {username} was changed by another process")
+
+    def record_user_changes(self, entries):
+        with self._transaction() as conn:
+            self._apply_user_entries(conn, entries)
+
+    def maybe_compact_users(self):
+        pass  # rows are updated in place; nothing to compact
+
+    def wait_for_compaction(self):
+        pass
+
+    def _update_status(self, conn, seq, loan_id, status, version):
+        if version is None:
+            conn.execute("UPDATE loans SET status = ?, version = version + 1, seq = ? WHERE id = ?",
+                         (status, seq, str(loan_id)))
+        elif conn.execute("UPDATE loans SET status = ?, version = ?, seq = ? WHERE id = ? AND version = ?",
+                          (status, version, seq, str(loan_id), version - 1)).rowcount == 0:
+            raise StaleWriteError(f"loan {loan_id} was changed by another process")
+
+    def commit_decisions(self, status_changes, user_entries, audit=None):
+        """Status updates and balance changes in a single transaction.
+
+        Audit rows go to the screening_audit table in the same transaction;
+        the audit path is only used by the CSV backend.
+        """
+        with self._transaction() as conn:
+            seq = self._next_seq(conn)
+            for loan_id, status, *version in status_changes:
+                self._update_status(conn, seq, loan_id, status, version[0] if version else None)
+            self._apply_user_entries(conn, user_entries)
+            if audit is not None:
+                conn.executemany(self._INSERT_AUDIT, audit[1])
+
+    def _loan_row(self, record, seq=0):
+        return (str(record["id"]), record["username"], record["loan_type"], float(record["amount"]),
+                float(record["interest_rate"]), float(record["term_years"]), float(record["monthly_payment"]),
+                float(record["total_interest"]), record["status"], getattr(record, "version", 0), seq)
+
+    def append_loan(self, record):
+        with self._transaction() as conn:
+            conn.execute(self._INSERT_LOAN, self._loan_row(record, self._next_seq(conn)))
+
+    def load_loans(self):
+        with self._lock:
+            cur = self.conn.execute("SELECT " + ", ".join(LOAN_FIELDS) + ", version FROM loans ORDER BY rowid")
+            return [LoanRecord(*r) for r in cur]
+
+    def update_loan_status(self, loan_id, status, version=None):
+        with self._transaction() as conn:
+            self._update_status(conn, self._next_seq(conn), loan_id, status, version)
+
+    def compact(self):
+        with self._lock:
+            self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def reserve_loan_ids(self, count):
+        with self._transaction() as conn:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'loan_id_high_water'").fetchone()
+            if row is None:
+                # seed from existing numeric ids (first use, or a db built by hand)
+                row = conn.execute(
+                    "SELECT COALESCE(MAX(CAST(id AS INTEGER)), 0) FROM loans WHERE id GLOB '[0-9]*'").fetchone()
+            high_water = row[0]
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('loan_id_high_water', ?)",
+                         (high_water + count,))
+        return range(high_water + 1, high_water + count + 1)
+
+    def import_from_csv(self, csv_storage=None):
+        """Bulk-load users and loans (status log applied) from the CSV backend in one transaction."""
+        csv_storage = csv_storage or CsvStorage()
+        users = csv_storage.load_users()
+        loans = csv_storage.load_loans()
+        high_water = csv_storage._read_loan_id_seq() or 0
+        with self._transaction() as conn:
+            seq = self._next_seq(conn)
+            conn.executemany(self._UPSERT_USER, [
+                (u, m["password_hash"], m["email"], m["income"], m["user_type"], m["balance"], m.version, seq)
+                for u, m in users.items()])
+            conn.executemany(self._UPSERT_LOAN, (self._loan_row(r, seq) for r in loans))
+            for r in loans:
+                if r["id"].isdigit():
+                    high_water = max(high_water, int(r["id"]))
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('loan_id_high_water', "
+                         "MAX(?, COALESCE((SELECT value FROM meta WHERE key = 'loan_id_high_water'), 0)))",
+                         (high_water,))
+        return len(users), len(loans)
+
+STORAGE_BACKENDS = {"csv": CsvStorage, "sqlite": SqliteStorage}
+_storage = None
+
+def get_storage():
+    """Return the process-wide storage backend selected by STORAGE_BACKEND."""
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND not in STORAGE_BACKENDS:
+            raise ValueError(f"Unknown storage backend {STORAGE_BACKEND!r}; choose from {sorted(STORAGE_BACKENDS)}")
+        _storage = STORAGE_BACKENDS[STORAGE_BACKEND]()
+    return _storage
+
+def import_csv_to_sqlite(db_path=None):
+    """One-pass migration of USERS_FILE / LOANS_FILE into a SQLite database."""
+    target = SqliteStorage(db_path)
+    try:
+        return target.import_from_csv(CsvStorage())
+    finally:
+        target.close()
+
+def load_users_to_dict():
+    """Load users into dict for O(1) lookup: {username: {fields...}}"""
+    return get_storage().load_users()
+
+def write_users_from_dict(users):
+    get_storage().write_users(users)
+
+def append_loan_record(record: dict):
+    # record keys: id,username,loan_type,amount,interest_rate,term_years,monthly_payment,total_interest,status
+    get_storage().append_loan(record)
+
+def append_loan_records(records):
+    """Append many loans as one storage batch (one write/fsync per file on CSV, one SQLite transaction)."""
+    storage = get_storage()
+    with storage.batch():
+        for record in records:
+            storage.append_loan(record)
+
+def load_loans():
+    return get_storage().load_loans()
+
+def update_loan_status(loan_id, status, version=None):
+    """Persist a status change without rewriting the loan store (see CsvStorage.update_loan_status).
+
+    With `version` (the loan's version after this change) it fails with
+    StaleWriteError if another process changed the loan first.
+    """
+    get_storage().update_loan_status(loan_id, status, version)
+
+def compact_loans():
+    get_storage().compact()
+
+def recover_loan_id_sequence():
+    """Re-seed the CSV backend's id sidecar from LOANS_FILE."""
+    return CsvStorage().recover_loan_id_sequence()
+
+def reserve_loan_ids(count=1):
+    """Reserve `count` consecutive loan ids in O(1) and return them as a range of ints.
+
+    The high-water mark is persisted before any id is used, so a crash can
+    leave a gap in the sequence but never hands the same id out twice.
+    """
+    if count < 1:
+        raise ValueError("count must be at least 1")
+    return get_storage().reserve_loan_ids(count)
+
+def next_loan_id():
+    return str(reserve_loan_ids(1)[0])
+
+class StorageWriter:
+    """A single background thread that performs data-layer writes in FIFO order.
+
+    Jobs that queue up while a flush is running are coalesced into the next
+    one and run inside the backend's batch() (one write + fsync per file on
+    CSV, one transaction on SQLite). A job that raises leaves no trace in
+    the batch: CSV writes check versions before buffering anything and
+    SQLite runs each write in its own savepoint. With FSYNC_POLICY "always"
+    each job is flushed on its own. Callbacks are passed to `dispatch`; the GUI
+    queues them for the Tk thread (BankApp.dispatch).
+    """
+    def __init__(self, dispatch=None, on_error=None):
+        self._queue = queue.Queue()
+        self._dispatch = dispatch or (lambda fn, *args: fn(*args))
+        self._on_error = on_error
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self.flushes = 0
+        self.jobs = 0
+
+    def submit(self, fn, *args, on_done=None, on_error=None):
+        """Queue fn(*args); on_done() or on_error(exc) is dispatched once it has run."""
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="storage-writer", daemon=True)
+                self._thread.start()
+        self._queue.put((fn, args, on_done, on_error or self._on_error))
+
+    def flush(self, timeout=None):
+        """Block until everything queued so far is on disk; returns False on timeout."""
+        if self._thread is None:
+            return True
+        done = threading.Event()
+        self._queue.put((None, (), done, None))
+        return done.wait(timeout)
+
+    def _run(self):
+        while True:
+            jobs = [self._queue.get()]
+            if FSYNC_POLICY != "always":
+                while True:
+                    try:
+                        jobs.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+            # flush() markers carry an Event that is set only once the whole batch is written
+            # and its callbacks dispatched, so nothing is dispatched after flush() returns
+            markers = [on_done for fn, _, on_done, _ in jobs if fn is None]
+            jobs = [job for job in jobs if job[0] is not None]
+            results = []
+            try:
+                with get_storage().batch():
+                    for fn, args, on_done, on_error in jobs:
+                        try:
+                            fn(*args)
+                        except Exception as e:
+                            results.append((on_error, e))
+                        else:
+                            results.append((on_done, None))
+            except Exception as e:
+                # the coalesced flush itself failed: report it against every job
+                results = [(on_error, e) for _, _, _, on_error in jobs]
+            if jobs:
+                self.flushes += 1
+                self.jobs += len(jobs)
+            for callback, error in results:
+                if callback is None:
+                    if error is not None:
+                        print(f"storage write failed: {error!r}", file=sys.stderr)
+                elif error is None:
+                    self._dispatch(callback)
+                else:
+                    self._dispatch(callback, error)
+            for marker in markers:
+                marker.set()
+
+def _persist(writer, fn, *args, on_done=None):
+    """Run a write now, or hand it to `writer` (a StorageWriter) when there is one."""
+    if writer is None:
+        fn(*args)
+        if on_done is not None:
+            on_done()
+    else:
+        writer.submit(fn, *args, on_done=on_done)
+
+# journal entry length per op, not counting the trailing version
+# (entries written before versioning don't have one)
+_ENTRY_LENGTHS = {"create": 7, "password": 3, "balance": 4}
+
+def _entry_version(entry):
+    """Version a journal entry gives its user, or None for an unversioned entry."""
+    base = _ENTRY_LENGTHS.get(entry[0]) if entry else None
+    if base is None or len(entry) != base + 1:
+        return None
+    try:
+        return int(entry[base])
+    except ValueError:
+        return None
+
+def _row_version(log, row):
+    """Version on a status-log row (id, status, version) or a journal entry; None if unversioned."""
+    if log != LOAN_STATUS_LOG_FILE:
+        return _entry_version(row)
+    try:
+        return int(row[2]) if len(row) == 3 else None
+    except ValueError:
+        return None
+
+def apply_user_entry(users, entry):
+    """Apply one user journal entry to a {username: UserRecord} dict.
+
+    Entries are flat rows so they serialize straight to CSV:
+      ("create", username, password_hash, email, income, user_type, balance, version)
+      ("password", username, password_hash, version)
+      ("balance", username, delta, new_balance, version)
+    Balance entries carry the resulting balance and replay sets it, and an
+    entry is skipped if the user already has its version, so replaying a
+    journal twice gives the same state. Entries from before versioning have
+    no version. Rows of another length are ignored; a row torn by a crash
+    can look like a complete shorter entry, so callers only pass rows that
+    were newline-terminated (see CsvStorage._complete_rows).
+    """
+    base = _ENTRY_LENGTHS.get(entry[0]) if entry else None
+    if base is None or len(entry) not in (base, base + 1):
+        return
+    op, username = entry[0], entry[1]
+    version = _entry_version(entry)
+    current = users.get(username)
+    if current is not None and version is not None and version <= current.version:
+        return
+    if op == "create":
+        users[username] = UserRecord(*entry[2:7], version=version or 0)
+    elif current is None:
+        return
+    elif op == "password":
+        users[username] = UserRecord.from_mapping(current, version, password_hash=entry[2])
+    else:
+        users[username] = UserRecord.from_mapping(current, version, balance=float(entry[3]))
+
+class UserStore:
+    """Users kept in memory as {username: UserRecord} with dict-style O(1) lookups.
+
+    Changes go through create / set_password / credit, which persist just
+    that change (a journal row on CSV, one row on SQLite) rather than
+    rewriting every user. Treat the returned records as read-only.
+    With a StorageWriter the in-memory state changes at once and the write
+    happens in the background (on_done fires once it is on disk).
+    """
+    def __init__(self, writer=None):
+        self.writer = writer
+        self._users = {}
+        self.reload()
+
+    def reload(self):
+        """Load from the binary snapshot when it still matches the files (records built on first
+        access), else parse the CSVs and write a fresh snapshot for next time. A snapshot with
+        many journal entries replayed on top is rewritten too (see SNAPSHOT_REFRESH_ROWS)."""
+        storage = get_storage()
+        with storage.loading("users"):
+            sources = storage.snapshot_sources("users")
+            opened = storage.open_snapshot("users")
+            if opened is None:
+                self._users = load_users_to_dict()
+        if opened is None:
+            storage.write_snapshot("users", self._users, sources)
+            return
+        snapshot, entries = opened
+        self._users = LazyRecords(zip(snapshot.column("username"), range(snapshot.rows)),
+                                  lambda row: UserRecord(*snapshot.row(row)[1:]))
+        self.apply_remote(entries)
+        if _snapshot_outgrown(snapshot, len(entries)):
+            storage.write_snapshot("users", None, sources, columns=_refreshed_columns(
+                self._users, snapshot, _USER_SNAPSHOT_COLUMNS, key="username"))
+
+    def __contains__(self, username):
+        return username in self._users
+
+    def __getitem__(self, username):
+        return self._users[username]
+
+    def __iter__(self):
+        return iter(self._users)
+
+    def __len__(self):
+        return len(self._users)
+
+    def get(self, username, default=None):
+        return self._users.get(username, default)
+
+    def items(self):
+        return self._users.items()
+
+    def create(self, username, password_hash, email, income, user_type, balance=0.0, on_done=None):
+        self.commit([("create", username, password_hash, email, float(income), user_type, float(balance), 1)],
+                    on_done)
+
+    def set_password(self, username, password_hash, on_done=None):
+        self.commit([("password", username, password_hash, self._users[username].version + 1)], on_done)
+
+    def balance_entry(self, username, amount):
+        """Journal entry crediting `amount` (negative to debit); not yet persisted."""
+        meta = self._users[username]
+        return ("balance", username, amount, float(meta.get("balance", 0.0)) + amount, meta.version + 1)
+
+    def credit(self, username, amount, on_done=None):
+        self.commit([self.balance_entry(username, amount)], on_done)
+
+    def commit(self, entries, on_done=None):
+        _persist(self.writer, get_storage().record_user_changes, entries, on_done=on_done)
+        self.apply(entries)
+
+    def apply(self, entries):
+        """Apply persisted (or queued) entries in memory (the storage compacts its journal itself)."""
+        for entry in entries:
+            apply_user_entry(self._users, entry)
+
+    def apply_remote(self, entries):
+        """Apply entries another process wrote (see LoanService.sync); already-seen versions are skipped."""
+        for entry in entries:
+            apply_user_entry(self._users, entry)
+
+class PortfolioAggregates:
+    """Running loan totals per user and per product, split by status.
+
+    LoanRepository feeds every indexed loan and status change through
+    add/remove, so a user's approved obligations or the admin summary are
+    O(1) reads instead of a scan. Money is summed in integer cents so the
+    incremental totals always match a rebuild exactly.
+    """
+    def __init__(self, loans=()):
+        self._by_user = {}
+        self._load_by_user = None  # set by load_tables() until by_user is first read
+        self.by_product = {}  # loan_type -> {status: [count, amount cents, monthly cents]}
+        for rec in loans:
+            self.add(rec)
+
+    @property
+    def by_user(self):
+        """username -> {status: [count, amount cents, monthly cents]}"""
+        if self._load_by_user is not None:
+            load, self._load_by_user = self._load_by_user, None
+            self._by_user = load()
+        return self._by_user
+
+    def clear(self):
+        self._by_user, self._load_by_user = {}, None
+        self.by_product.clear()
+
+    def add(self, rec, sign=1):
+        """Count a LoanRecord in (sign=-1 takes it back out)."""
+        status = rec.status.lower()
+        amount = sign * round(rec.amount * 100)
+        monthly = sign * round(rec.monthly_payment * 100)
+        for table, key in ((self.by_user, rec.username), (self.by_product, rec.loan_type)):
+            by_status = table.setdefault(key, {})
+            totals = by_status.get(status)
+            if totals is None:
+                totals = by_status[status] = [0, 0, 0]
+            totals[0] += sign
+            totals[1] += amount
+            totals[2] += monthly
+
+    def remove(self, rec):
+        self.add(rec, -1)
+
+    def move(self, recs, old, new):
+        """Move many LoanRecords from status `old` to `new` (both lower-case), one bucket update per key."""
+        if old == new:
+            return
+        cents = [(rec.username, rec.loan_type, round(rec.amount * 100), round(rec.monthly_payment * 100))
+                 for rec in recs]
+        for table, field in ((self.by_user, 0), (self.by_product, 1)):
+            sums = {}
+            for row in cents:
+                totals = sums.get(row[field])
+                if totals is None:
+                    totals = sums[row[field]] = [0, 0, 0]
+                totals[0] += 1
+                totals[1] += row[2]
+                totals[2] += row[3]
+            for key, (count, amount, monthly) in sums.items():
+                by_status = table.setdefault(key, {})
+                for status, sign in ((old, -1), (new, 1)):
+                    totals = by_status.get(status)
+                    if totals is None:
+                        totals = by_status[status] = [0, 0, 0]
+                    totals[0] += sign * count
+                    totals[1] += sign * amount
+                    totals[2] += sign * monthly
+
+    @staticmethod
+    def _totals(table, key, status):
+        count, amount, monthly = table.get(key, {}).get(status, (0, 0, 0))
+        return {"count": count, "amount": amount / 100, "monthly": monthly / 100}
+
+    def user(self, username, status="approved"):
+        """{"count", "amount", "monthly"} for one user's loans in `status`.
+
+        For "approved" that is the outstanding principal and the monthly
+        obligations the affordability check adds to a new quote.
+        """
+        return self._totals(self.by_user, username, status)
+
+    def product(self, loan_type, status):
+        return self._totals(self.by_product, loan_type, status)
+
+    def summary(self):
+        """{(status, loan_type): totals} for every product/status pair seen."""
+        return {(status, loan_type): self._totals(self.by_product, loan_type, status)
+                for loan_type, by_status in self.by_product.items()
+                for status, totals in by_status.items() if totals[0]}
+
+    def tables(self):
+        """The raw totals as JSON-ready dicts (kept in the loans snapshot)."""
+        return {"by_user": self.by_user, "by_product": self.by_product}
+
+    def load_tables(self, by_product, by_user):
+        """Install saved tables; `by_user` may be a callable, run on first use."""
+        self.by_product = by_product
+        if callable(by_user):
+            self._by_user, self._load_by_user = {}, by_user
+        else:
+            self._by_user, self._load_by_user = by_user, None
+
+    def state(self):
+        """Comparable copy of the raw totals with emptied buckets dropped."""
+        return {name: {key: {status: tuple(t) for status, t in by_status.items() if t[0]}
+                       for key, by_status in table.items() if any(t[0] for t in by_status.values())}
+                for name, table in (("by_user", self.by_user), ("by_product", self.by_product))}
+
+class LoanRepository:
+    """Loans loaded once and kept in memory with hash indexes on id, username and status.
+
+    All appends and status changes should go through the repository so the
+    indexes (and `aggregates`, the running portfolio totals) stay in step
+    with the files; lookups never re-read LOANS_FILE.
+    Writes go through `writer` (a StorageWriter) when one is given.
+    """
+    def __init__(self, writer=None):
+        self.writer = writer
+        self._by_id = {}        # loan_id -> record (LazyRecords when loaded from a snapshot)
+        self._by_username = {}  # username -> [loan_id, ...] in insertion order
+        self._by_status = {}    # status -> {loan_id: None}, an insertion-ordered set
+        self._unindexed = None  # snapshot usernames not yet in _by_username; see _user_ids
+        self.aggregates = PortfolioAggregates()
+        self.reload()
+
+    def reload(self):
+        """Load from the binary snapshot when it still matches the files, else parse the CSVs
+        and write a fresh snapshot for next time. A snapshot with many appended rows replayed
+        on top is rewritten too (see SNAPSHOT_REFRESH_ROWS)."""
+        storage = get_storage()
+        self._by_id = {}
+        self._by_username.clear()
+        self._by_status.clear()
+        self._unindexed = None
+        self.aggregates.clear()
+        with storage.loading("loans"):
+            sources = storage.snapshot_sources("loans")
+            opened = storage.open_snapshot("loans")
+            if opened is None:
+                loans = load_loans()
+        if opened is None:
+            for r in loans:
+                self._index(r)
+            storage.write_snapshot("loans", loans, sources, self.aggregates.tables())
+            return
+        snapshot, (loans, statuses) = opened
+        self._load_snapshot(snapshot)
+        self.apply_remote(loans, statuses)
+        if _snapshot_outgrown(snapshot, len(loans) + len(statuses)):
+            storage.write_snapshot("loans", None, sources, self.aggregates.tables(),
+                                   columns=_refreshed_columns(self._by_id, snapshot, _LOAN_SNAPSHOT_COLUMNS))
+
+    def _load_snapshot(self, snapshot):
+        """Index a ColumnSnapshot from its id and status columns.
+
+        Records are built on first access, each user's id list on the first
+        lookup for that user (see _user_ids) and the per-user totals on
+        first use, so startup only pays for the id and status indexes.
+        """
+        import json
+        ids = snapshot.column("id")
+        self._by_id = LazyRecords(zip(ids, range(snapshot.rows)), LoanRecord.snapshot_loader(snapshot))
+        strings = snapshot.strings
+        statuses = snapshot.view("status")
+        for code in set(statuses):
+            status = strings[code].lower()
+            self._by_status.setdefault(status, {}).update(
+                dict.fromkeys(compress(ids, map(code.__eq__, statuses))))
+        users = snapshot.view("username")
+        self._unindexed = ({strings[code]: code for code in set(users)}, users, ids, 0)
+        self.aggregates.load_tables(snapshot.extra["by_product"], lambda: json.loads(snapshot.blob("by_user")))
+
+    def _user_ids(self, username):
+        """username's id list, first filling it from the snapshot when it hasn't been yet.
+
+        Each such lookup is one C-speed scan of the username column; after
+        SNAPSHOT_USER_SCANS of them every remaining user is indexed in a
+        single pass instead.
+        """
+        ids = self._by_username.get(username)
+        if ids is not None or self._unindexed is None:
+            return ids
+        lookup, users, loan_ids, scans = self._unindexed
+        if scans >= SNAPSHOT_USER_SCANS:
+            self._index_snapshot_users()
+            return self._by_username.get(username)
+        self._unindexed = (lookup, users, loan_ids, scans + 1)
+        code = lookup.get(username)
+        if code is None:
+            return None
+        ids = self._by_username[username] = list(compress(loan_ids, map(code.__eq__, users)))
+        return ids
+
+    def _index_snapshot_users(self):
+        lookup, users, loan_ids, _ = self._unindexed
+        self._unindexed = None
+        names = dict(zip(lookup.values(), lookup))
+        by_code = {}
+        for loan_id, code in zip(loan_ids, users):
+            user_ids = by_code.get(code)
+            if user_ids is None:
+                by_code[code] = [loan_id]
+            else:
+                user_ids.append(loan_id)
+        for code, user_ids in by_code.items():
+            # users already scanned have their snapshot ids (and any newer ones) in place
+            self._by_username.setdefault(names[code], user_ids)
+
+    def _index(self, rec):
+        loan_id = str(rec["id"])
+        self._by_id[loan_id] = rec
+        user_ids = self._user_ids(rec["username"])
+        if user_ids is None:
+            user_ids = self._by_username[rec["username"]] = []
+        user_ids.append(loan_id)
+        self._by_status.setdefault(rec["status"].lower(), {})[loan_id] = None
+        self.aggregates.add(rec)
+
+    def rebuild_aggregates(self):
+        self.aggregates = PortfolioAggregates(self._by_id.values())
+
+    def verify_aggregates(self, from_storage=False):
+        """Recompute the totals from scratch (from the store itself with from_storage=True).
+
+        Returns the users/products whose running totals disagree; empty when consistent.
+        """
+        fresh = PortfolioAggregates(load_loans() if from_storage else self._by_id.values()).state()
+        live = self.aggregates.state()
+        return [(table, key) for table in live
+                for key in sorted(set(live[table]) | set(fresh[table]))
+                if live[table].get(key) != fresh[table].get(key)]
+
+    def __len__(self):
+        return len(self._by_id)
+
+    def __iter__(self):
+        return iter(self._by_id.values())
+
+    def get(self, loan_id):
+        return self._by_id.get(str(loan_id))
+
+    def for_user(self, username, last=None):
+        """Loans for one user, oldest first; `last` keeps only the most recent N."""
+        ids = self._user_ids(username) or []
+        if last is not None:
+            ids = ids[-last:] if last > 0 else []
+        return [self._by_id[i] for i in ids]
+
+    def with_status(self, status):
+        return [self._by_id[i] for i in self._by_status.get(status.lower(), ())]
+
+    def append(self, record: dict, on_done=None):
+        rec = LoanRecord.from_mapping(record)
+        _persist(self.writer, append_loan_record, dict(rec), on_done=on_done)
+        self._index(rec)
+        return rec
+
+    def append_many(self, records, index=True, on_done=None):
+        """Persist a chunk of new loans in one batch.
+
+        index=False skips the in-memory indexes, for one-shot bulk loads
+        that shouldn't keep every imported row in memory; reload() brings
+        them back in step.
+        """
+        records = [LoanRecord.from_mapping(r) for r in records]
+        # the writer gets its own copies when the indexed records stay live here
+        _persist(self.writer, append_loan_records, [dict(r) for r in records] if index else records,
+                 on_done=on_done)
+        if index:
+            for rec in records:
+                self._index(rec)
+        return records
+
+    def _restatus(self, rec, status):
+        self._restatus_many([(rec, status)])
+
+    def _restatus_many(self, changes):
+        """Apply (record, new status) pairs to the indexes and aggregates, grouped by (old, new) status."""
+        groups = {}
+        for rec, status in changes:
+            groups.setdefault((rec.status.lower(), status), []).append(rec)
+        for (old, status), recs in groups.items():
+            old_ids = self._by_status.get(old, {})
+            new_ids = self._by_status.setdefault(status.lower(), {})
+            for rec in recs:
+                old_ids.pop(rec.id, None)
+                rec.status = status
+                new_ids[rec.id] = None
+            self.aggregates.move(recs, old, status.lower())
+
+    def set_status(self, loan_id, status, on_done=None):
+        rec = self._by_id[str(loan_id)]
+        _persist(self.writer, update_loan_status, rec["id"], status, rec.version + 1, on_done=on_done)
+        self._restatus(rec, status)
+        rec.version += 1
+        return rec
+
+    def apply_remote(self, loans=(), statuses=()):
+        """Fold in loans and (id, status, version) rows other processes wrote (see LoanService.sync)."""
+        for rec in loans:
+            mine = self._by_id.get(str(rec["id"]))
+            if mine is None:
+                self._index(rec)
+            elif rec.version > mine.version:
+                self._restatus(mine, rec["status"])
+                mine.version = rec.version
+        for loan_id, status, version in statuses:
+            mine = self._by_id.get(loan_id)
+            if mine is not None and (version is None or version > mine.version):
+                self._restatus(mine, status)
+                mine.version = version or mine.version
+
+    def decide(self, decisions, users, on_done=None, versions=None, audit=None):
+        """Approve/reject many loans with one atomic write of loans and users.
+
+        `decisions` maps loan id -> "approved" or "rejected". Approved amounts
+        are credited through `users` (a UserStore). Without a writer memory is
+        only touched once the commit has succeeded. Loans that are unknown or
+        no longer pending are skipped; returns the records that changed.
+        With `versions` ({loan id: version read}) a loan changed since then
+        raises StaleWriteError before anything is written. `audit` is passed
+        to commit_decisions() and written even if no loan changes.
+        """
+        changes = []
+        credits = {}
+        for loan_id, status in decisions.items():
+            if status not in ("approved", "rejected"):
+                raise ValueError(f"Unsupported loan decision {status!r}")
+            rec = self.get(loan_id)
+            if versions is not None and (rec is None or rec.version != versions[loan_id]):
+                raise StaleWriteError(f"loan {loan_id} has changed since it was read")
+            if rec is None or rec.status.lower() != "pending":
+                continue
+            changes.append((rec, status))
+            if status == "approved" and rec.username in users:
+                credits[rec.username] = credits.get(rec.username, 0.0) + rec.amount
+        if not changes and audit is None:
+            return []
+        entries = [users.balance_entry(username, amount) for username, amount in credits.items()]
+        _persist(self.writer, get_storage().commit_decisions,
+                 [(rec.id, status, rec.version + 1) for rec, status in changes], entries, audit, on_done=on_done)
+        users.apply(entries)
+        self._restatus_many(changes)
+        for rec, _ in changes:
+            rec.version += 1
+        return [rec for rec, _ in changes]
+
+# -----------------------------
+# Loan Calculation Logic
+# -----------------------------
+def annuity_factor(annual_rate, term_years):
+    """Payment per unit of principal: M = principal * factor. None if undefined."""
+    r = annual_rate / 100.0 / 12.0
+    n = term_years * 12
+    if r == 0:
+        return 1.0 / n
+    # formula:
+    growth = (1 + r) ** n
+    denominator = growth - 1
+    if denominator == 0:
+        return None
+    return r * growth / denominator
+
+class AnnuityFactorCache:
+    """Memoized annuity factors keyed by (annual rate, term in months).
+
+    Every whole-month term of every LOAN_OPTIONS product is computed up front
+    and never evicted; any other (rate, term) pair goes into a bounded LRU.
+    Hits on the table are counted per thread, so that path takes no lock.
+    """
+    def __init__(self, options=None, lru_size=4096):
+        self.lru_size = lru_size
+        self._table = {}
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._table_hits = []  # one [count] per thread that hit the table
+        self.hits = 0  # LRU hits; stats() adds the table hits
+        self.misses = 0
+        self.evictions = 0
+        for opt in (options if options is not None else LOAN_OPTIONS).values():
+            for months in range(1, int(opt["max_term"] * 12) + 1):
+                self._table[(float(opt["rate"]), float(months))] = annuity_factor(opt["rate"], months / 12.0)
+
+    def get(self, annual_rate, term_years):
+        key = (float(annual_rate), float(term_years * 12))
+        factor = self._table.get(key, self)  # self as a miss sentinel; None is a valid factor
+        if factor is not self:
+            try:
+                self._local.hits[0] += 1
+            except AttributeError:
+                self._local.hits = [1]
+                with self._lock:
+                    self._table_hits.append(self._local.hits)
+            return factor
+        with self._lock:
+            if key in self._lru:
+                self.hits += 1
+                self._lru.move_to_end(key)
+                return self._lru[key]
+            self.misses += 1
+            factor = annuity_factor(annual_rate, term_years)
+            self._lru[key] = factor
+            if len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+                self.evictions += 1
+            return factor
+
+    def stats(self):
+        with self._lock:
+            hits = self.hits + sum(count for count, in self._table_hits)
+            lookups = hits + self.misses
+            return {
+                "hits": hits,
+                "misses": self.misses,
+                "hit_rate": hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "precomputed": len(self._table),
+                "lru_entries": len(self._lru),
+            }
+
+ANNUITY_FACTORS = AnnuityFactorCache()
+
+def calculate_monthly_payment(principal, annual_rate, term_years):
+    """Return monthly payment using standard formula (factor looked up in ANNUITY_FACTORS)."""
+    if term_years <= 0 or principal <= 0:
+        return None
+    factor = ANNUITY_FACTORS.get(annual_rate, term_years)
+    if factor is None:
+        return None
+    return principal * factor
+
+def total_interest_paid(monthly_payment, principal, term_years):
+    n = term_years * 12
+    return monthly_payment * n - principal
+
+# -----------------------------
+# Batch Amortization (NumPy)
+# -----------------------------
+def _require_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            raise ImportError("NumPy is required for batch amortization and screening (pip install numpy)") from None
+        np = numpy
+
+def _batch_inputs(principals, annual_rates, term_years):
+    _require_numpy()
+    P, rate, T = np.broadcast_arrays(
+        np.asarray(principals, dtype=np.float64),
+        np.asarray(annual_rates, dtype=np.float64),
+        np.asarray(term_years, dtype=np.float64),
+    )
+    return P, rate / 100.0 / 12.0, T * 12.0
+
+def batch_monthly_payment(principals, annual_rates, term_years):
+    """Vectorized calculate_monthly_payment over arrays (scalars broadcast).
+
+    Entries where the scalar function returns None come back as NaN.
+    """
+    P, r, n = _batch_inputs(principals, annual_rates, term_years)
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        growth = np.power(1.0 + r, n)
+        denominator = growth - 1.0
+        M = np.where(r == 0, P / n, P * r * growth / denominator)
+    invalid = ~((n > 0) & (P > 0)) | ((r != 0) & (denominator == 0))
+    M[invalid] = np.nan
+    return M
+
+def batch_total_interest(monthly_payments, principals, term_years):
+    _require_numpy()
+    return (np.asarray(monthly_payments, dtype=np.float64) * np.asarray(term_years, dtype=np.float64) * 12.0
+            - np.asarray(principals, dtype=np.float64))
+
+def batch_quote(principals, annual_rates, term_years):
+    """Return (monthly_payments, total_interest) arrays for a batch of loans."""
+    M = batch_monthly_payment(principals, annual_rates, term_years)
+    P, _, n = _batch_inputs(principals, annual_rates, term_years)
+    return M, M * n - P
+
+def requote_loans(loans):
+    """Re-price loan records (as returned by load_loans) in one vectorized pass."""
+    _require_numpy()
+    count = len(loans)
+    P = np.fromiter((l["amount"] for l in loans), dtype=np.float64, count=count)
+    rate = np.fromiter((l["interest_rate"] for l in loans), dtype=np.float64, count=count)
+    T = np.fromiter((l["term_years"] for l in loans), dtype=np.float64, count=count)
+    return batch_quote(P, rate, T)
+
+def batch_amortization_schedule(principals, annual_rates, term_years):
+    """Month-by-month schedules as 2-D arrays of shape (loans, months).
+
+    Returns a dict with "payment", "interest", "principal" and "balance";
+    columns past a loan's term are zero, and invalid loans are all NaN. A
+    fractional last month pays off whatever balance remains. Memory is
+    loans x longest term x 32 bytes, so chunk very large books.
+    """
+    M = batch_monthly_payment(principals, annual_rates, term_years)
+    P, r, n = _batch_inputs(principals, annual_rates, term_years)
+    P, r, n, M = P.ravel(), r.ravel(), n.ravel(), M.ravel()
+    valid = ~np.isnan(M)
+    months = np.zeros(P.shape, dtype=np.int64)
+    months[valid] = np.ceil(n[valid] - 1e-9).astype(np.int64)
+    width = int(months.max()) if months.size else 0
+
+    k = np.arange(1, width + 1, dtype=np.float64)[None, :]
+    r2, P2, M2 = r[:, None], P[:, None], M[:, None]
+    with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+        growth = np.power(1.0 + r2, k)
+        # closed form for the balance after k payments; r == 0 is straight-line
+        balance = np.where(r2 == 0, P2 - M2 * k, P2 * growth - M2 * (growth - 1.0) / r2)
+    prev_balance = np.concatenate([P2, balance[:, :-1]], axis=1)
+    interest = prev_balance * r2
+    payment = np.broadcast_to(M2, balance.shape).copy()
+
+    last = k == months[:, None]
+    payment = np.where(last, prev_balance + interest, payment)
+    balance = np.where(last, 0.0, balance)
+    active = k <= months[:, None]
+    payment = np.where(active, payment, 0.0)
+    interest = np.where(active, interest, 0.0)
+    balance = np.where(active, balance, 0.0)
+    schedule = {"payment": payment, "interest": interest, "principal": payment - interest, "balance": balance}
+    for arr in schedule.values():
+        arr[~valid] = np.nan
+    return schedule
+
+# -----------------------------
+# Rate-shock stress testing
+# -----------------------------
+def parse_scenario(spec):
+    """Parse "[NAME=]SHOCK[,SHOCK...]" into a stress scenario.
+
+    A SHOCK is "+200bp" (rate change in basis points) or "term+5" (years
+    added to the term), optionally for one product only: "Housing Loan:+200bp".
+    A product-specific shock replaces the all-products one. Example:
+    "housing-up=Housing Loan:+200bp,+50bp".
+    """
+    name, _, body = spec.rpartition("=")
+    scenario = {"name": name.strip() or body.strip(), "rate_bp": {}, "term_years": {}}
+    for part in body.split(","):
+        loan_type, _, shock = part.rpartition(":")
+        loan_type = loan_type.strip() or "*"
+        if loan_type != "*" and loan_type not in LOAN_OPTIONS:
+            raise ValidationError(f"Unknown loan type {loan_type!r} in scenario {spec!r}.")
+        shock = shock.strip().lower()
+        try:
+            if shock.startswith("term"):
+                scenario["term_years"][loan_type] = float(shock[4:])
+            elif shock.endswith("bp"):
+                scenario["rate_bp"][loan_type] = float(shock[:-2])
+            else:
+                raise ValueError
+        except ValueError:
+            raise ValidationError(f"Can't read shock {part.strip()!r}; use e.g. +200bp or term+5.") from None
+    return scenario
+
+def _scenario_shift(scenario, loan_type):
+    """(rate change in percentage points, term change in years) for one product."""
+    rate_bp, term_years = scenario["rate_bp"], scenario["term_years"]
+    return (rate_bp.get(loan_type, rate_bp.get("*", 0.0)) / 100.0,
+            term_years.get(loan_type, term_years.get("*", 0.0)))
+
+def _stress_chunk(task):
+    """Reprice one chunk of loans under every scenario, writing one CSV row per loan.
+
+    Runs in a stress_test pool worker. Returns the chunk's approved-loan
+    totals per (scenario index, loan type) as [count, monthly cents, total
+    interest cents], each borrower's approved monthly cents (stored, then
+    one per scenario) and the number of loans a scenario couldn't price.
+    """
+    path, scenarios, rows = task
+    shifts = {}
+    totals = {}
+    obligations = {}
+    unpriced = [0] * len(scenarios)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        for loan_id, username, loan_type, amount, rate, term, monthly, interest, status in rows:
+            shift = shifts.get(loan_type)
+            if shift is None:
+                shift = shifts[loan_type] = [_scenario_shift(s, loan_type) for s in scenarios]
+            approved = status == "approved"
+            if approved:
+                owed = obligations.get(username)
+                if owed is None:
+                    owed = obligations[username] = [0] * (len(scenarios) + 1)
+                owed[0] += round(monthly * 100)
+            out = [loan_id, username, loan_type, status, amount, monthly, interest]
+            for i, (rate_change, term_change) in enumerate(shift):
+                new_term = term + term_change
+                new_monthly = calculate_monthly_payment(amount, rate + rate_change, new_term)
+                if new_monthly is None or not isfinite(new_monthly):
+                    unpriced[i] += 1
+                    out += ["", ""]
+                    continue
+                new_interest = round(total_interest_paid(new_monthly, amount, new_term), 2)
+                new_monthly = round(new_monthly, 2)
+                out += [new_monthly, new_interest]
+                if approved:
+                    owed[i + 1] += round(new_monthly * 100)
+                    t = totals.get((i, loan_type))
+                    if t is None:
+                        t = totals[(i, loan_type)] = [0, 0, 0]
+                    t[0] += 1
+                    t[1] += round(new_monthly * 100)
+                    t[2] += round(new_interest * 100)
+            if approved:
+                t = totals.get((None, loan_type))
+                if t is None:
+                    t = totals[(None, loan_type)] = [0, 0, 0]
+                t[0] += 1
+                t[1] += round(monthly * 100)
+                t[2] += round(interest * 100)
+            writer.writerow(out)
+    return totals, obligations, unpriced
+
+def _stress_rows(loans, size):
+    """Loans as chunks of plain tuples, which pickle far faster than records."""
+    rows = []
+    for l in loans:
+        rows.append((str(l["id"]), l["username"], l["loan_type"], float(l["amount"]), float(l["interest_rate"]),
+                     float(l["term_years"]), float(l["monthly_payment"]), float(l["total_interest"]),
+                     l["status"].lower()))
+        if len(rows) >= size:
+            yield rows
+            rows = []
+    if rows:
+        yield rows
+
+def _stress_totals(t):
+    count, monthly, interest = t
+    return {"count": count, "monthly": monthly / 100, "total_interest": interest / 100}
+
+def stress_test(scenarios, out_dir, loans=None, users=None, workers=None, chunk_size=STRESS_CHUNK_SIZE):
+    """Reprice every loan under each scenario (see parse_scenario) on a process pool.
+
+    `loans` defaults to load_loans() and `users` (for incomes) to
+    load_users_to_dict(). Chunks of chunk_size loans go to `workers`
+    processes (default: one per CPU; 1 runs in this process), at most two
+    per worker in flight, and each writes its rows straight to disk. The
+    results end up in out_dir:
+
+    - loans.csv: each loan's stored payment and interest, then its monthly
+      payment and total interest under every scenario;
+    - borrowers.csv: borrowers whose approved monthly payments go above 50%
+      of income in any scenario, with the ratio before and under each.
 
-# -----------------------------
-# Configuration & constants
-# -----------------------------
-USERS_FILE = "users.csv"
-LOANS_FILE = "loan_records.csv"
+    Loans a scenario can't price (a term shock down to zero, say) are left
+    blank and counted as unpriced. Returns the per-scenario totals for
+    approved loans by product, the number of borrowers over the limit and
+    newly pushed over it, and timings.
+    """
+    import shutil
+    started = time.perf_counter()
+    loans = load_loans() if loans is None else loans
+    users = load_users_to_dict() if users is None else users
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(out_dir, exist_ok=True)
+    names = [s["name"] for s in scenarios]
+    totals = {}
+    obligations = {}
+    unpriced = [0] * len(scenarios)
+    count = 0
+    loans_path = os.path.join(out_dir, "loans.csv")
+    with open(loans_path, "w", newline="") as out:
+        csv.writer(out).writerow(["id", "username", "loan_type", "status", "amount", "monthly_payment",
+                                  "total_interest"]
+                                 + [f"{name} {field}" for name in names for field in ("monthly_payment",
+                                                                                       "total_interest")])
 
-LOAN_OPTIONS = {
-    "Housing Loan": {"rate": 5.2, "max_term": 25},
-    "Auto Loan": {"rate": 7.5, "max_term": 6},
-    "Personal Loan": {"rate": 9.6, "max_term": 10},
-}
+        def collect(path, result):
+            chunk_totals, chunk_obligations, chunk_unpriced = result
+            with open(path, newline="") as part:
+                shutil.copyfileobj(part, out)
+            os.remove(path)
+            for key, t in chunk_totals.items():
+                mine = totals.setdefault(key, [0, 0, 0])
+                for i, v in enumerate(t):
+                    mine[i] += v
+            for username, owed in chunk_obligations.items():
+                mine = obligations.get(username)
+                if mine is None:
+                    obligations[username] = owed
+                else:
+                    for i, v in enumerate(owed):
+                        mine[i] += v
+            for i, n in enumerate(chunk_unpriced):
+                unpriced[i] += n
+
+        tasks = ((os.path.join(out_dir, f"loans.part{n:05d}.csv"), scenarios, rows)
+                 for n, rows in enumerate(_stress_rows(loans, chunk_size)))
+        if workers == 1:
+            for task in tasks:
+                count += len(task[2])
+                collect(task[0], _stress_chunk(task))
+        else:
+            from concurrent.futures import ProcessPoolExecutor
+            with ProcessPoolExecutor(workers) as pool:
+                in_flight = deque()  # oldest first, so parts are copied in loan order
+                for task in tasks:
+                    count += len(task[2])
+                    in_flight.append((task[0], pool.submit(_stress_chunk, task)))
+                    if len(in_flight) >= 2 * workers:
+                        path, future = in_flight.popleft()
+                        collect(path, future.result())
+                while in_flight:
+                    path, future = in_flight.popleft()
+                    collect(path, future.result())
+
+    over = [0] * len(scenarios)
+    pushed = [0] * len(scenarios)
+    borrowers_path = os.path.join(out_dir, "borrowers.csv")
+    with open(borrowers_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["username", "income", "monthly_payments", "ratio"]
+                        + [f"{name} {field}" for name in names for field in ("monthly_payments", "ratio")])
+        for username, owed in obligations.items():
+            meta = users.get(username)
+            income = float(meta["income"]) if meta is not None else 0.0
+            limit = round(0.5 * income * 100)
+            flagged = [cents > limit for cents in owed[1:]]
+            if not any(flagged):
+                continue
+            for i, is_over in enumerate(flagged):
+                if is_over:
+                    over[i] += 1
+                    pushed[i] += owed[0] <= limit
+            writer.writerow([username, income] + [v for cents in owed
+                                                  for v in (cents / 100, round(cents / 100 / income, 4)
+                                                            if income > 0 else "")])
+    seconds = time.perf_counter() - started
+    return {
+        "loans": count,
+        "workers": workers,
+        "seconds": seconds,
+        "loans_per_s": count / seconds if seconds else 0.0,
+        "files": {"loans": loans_path, "borrowers": borrowers_path},
+        "current": {loan_type: _stress_totals(t) for (i, loan_type), t in totals.items() if i is None},
+        "scenarios": [{"name": name,
+                       "by_type": {loan_type: _stress_totals(t) for (j, loan_type), t in totals.items() if j == i},
+                       "borrowers_over": over[i], "borrowers_pushed_over": pushed[i], "unpriced": unpriced[i]}
+                      for i, name in enumerate(names)],
+    }
 
 # -----------------------------
-# Utility & Data Layer
+# Rule-based pre-screening (NumPy)
 # -----------------------------
-def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode("utf-8")).hexdigest()
+SCREENING_OUTCOMES = ["manual", "approve", "reject"]  # codes used by evaluate_rules; 0 = no rule fired
+SCREENING_FIELDS = ["loan_type", "amount", "term_years", "interest_rate", "monthly_payment", "total_interest",
+                    "income", "existing_monthly", "existing_balance", "max_term", "payment_ratio"]
+_SCREENING_OPS = {"==": "equal", "!=": "not_equal", "<": "less", "<=": "less_equal", ">": "greater",
+                  ">=": "greater_equal"}
 
-def ensure_files_exist():
-    if not os.path.exists(USERS_FILE):
-        with open(USERS_FILE, "w", newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow(["username", "password_hash", "email", "income", "user_type", "balance"])
-        print("No admin account found. Please create one now.")
-        admin_user = input("Enter admin username: ").strip()
-        admin_pw = input("Enter admin password: ").strip()
-        admin_email = input("Enter admin email: ").strip()
-        with open(USERS_FILE, "a", newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                admin_user,
-                hash_password(admin_pw),
-                admin_email,
-                "0",
-                "admin",
-                "0.0"
-            ])
-        print(f"Admin account '{admin_user}' created successfully.")
+def compile_rules(rules):
+    """Check declarative screening rules and compile them into array predicates, once.
 
-    # loan_records.csv header: id,username,loan_type,amount,interest_rate,term_years,monthly_payment,total_interest,status
-    if not os.path.exists(LOANS_FILE):
-        with open(LOANS_FILE, "w", newline="") as f:
-            writer = csv.writer(f)
-            writer.writerow(["id","username","loan_type","amount","interest_rate","term_years","monthly_payment","total_interest","status"])
+    A rule is {"name", "when": [[field, op, value], ...], "outcome"} (see
+    DEFAULT_SCREENING_RULES); it fires when all its conditions hold, and
+    the first rule to fire decides. Fields are SCREENING_FIELDS (existing_*
+    are the applicant's approved loans; payment_ratio is new plus existing
+    monthly payments over income). `op` is a comparison or "in"/"not in".
+    `value` is a number, another field, or for loan_type a product name
+    (a list with "in"). Outcomes are SCREENING_OUTCOMES. Raises
+    ValidationError for anything it can't compile.
+    """
+    _require_numpy()
+    if not isinstance(rules, (list, tuple)):
+        raise ValidationError("Screening rules must be a list of rules.")
+    compiled = []
+    for rule in rules:
+        if not isinstance(rule, dict):
+            raise ValidationError(f"Rule {len(compiled) + 1}: expected an object with name, when and outcome.")
+        name = str(rule.get("name") or f"rule-{len(compiled) + 1}")
+        if rule.get("outcome") not in SCREENING_OUTCOMES:
+            raise ValidationError(f"Rule {name!r}: outcome must be one of {', '.join(SCREENING_OUTCOMES)}.")
+        when = rule.get("when") or ()
+        if not isinstance(when, (list, tuple)):
+            raise ValidationError(f"Rule {name!r}: when must be a list of [field, op, value] conditions.")
+        tests = []
+        for condition in when:
+            if not isinstance(condition, (list, tuple)) or len(condition) != 3:
+                raise ValidationError(f"Rule {name!r}: condition {condition!r} is not [field, op, value].")
+            try:
+                tests.append(_compile_condition(*condition))
+            except (TypeError, ValueError) as e:
+                raise ValidationError(f"Rule {name!r}: {e}") from None
+        compiled.append((name, rule["outcome"], tests))
+    return compiled
 
-def load_users_to_dict():
-    """Load users into dict for O(1) lookup: {username: {fields...}}"""
-    users = {}
-    if not os.path.exists(USERS_FILE):
-        return users
-    with open(USERS_FILE, newline="") as f:
-        reader = csv.DictReader(f)
-        for r in reader:
-            users[r["username"]] = {
-                "password_hash": r["password_hash"],
-                "email": r["email"],
-                "income": float(r["income"]) if r["income"] else 0.0,
-                "user_type": r["user_type"],
-                "balance": float(r.get("balance", 0.0)),
-            }
-    return users
+def _compile_condition(field, op, value):
+    if not isinstance(field, str) or field not in SCREENING_FIELDS:
+        raise ValueError(f"unknown field {field!r}")
+    if not isinstance(op, str) or op not in _SCREENING_OPS and op not in ("in", "not in"):
+        raise ValueError(f"unknown operator {op!r}")
+    if op in ("in", "not in") and not isinstance(value, (list, tuple)):
+        raise ValueError(f"{op!r} needs a list of values, not {value!r}")
+    if field == "loan_type":
+        values = value if op in ("in", "not in") else [value]
+        unknown = [v for v in values if not isinstance(v, str) or v not in LOAN_OPTIONS]
+        if unknown:
+            raise ValueError(f"unknown loan type {unknown[0]!r}")
+        if op not in ("==", "!=", "in", "not in"):
+            raise ValueError("loan_type only supports ==, !=, in and not in")
+        value = [LOAN_TYPE_CODES.code(v) for v in values]
+        op = {"==": "in", "!=": "not in"}.get(op, op)
+    elif op in ("in", "not in"):
+        value = [_rule_number(v) for v in value]
+    elif isinstance(value, str):
+        if value not in SCREENING_FIELDS or value == "loan_type":
+            raise ValueError(f"can't compare {field} with {value!r}")
+        compare = getattr(np, _SCREENING_OPS[op])
+        return lambda columns: compare(columns[field], columns[value])
+    else:
+        value = _rule_number(value)
+    if op in ("in", "not in"):
+        return lambda columns: np.isin(columns[field], value, invert=op == "not in")
+    compare = getattr(np, _SCREENING_OPS[op])
+    return lambda columns: compare(columns[field], value)
 
-def write_users_from_dict(users):
-    with open(USERS_FILE, "w", newline="") as f:
-        fieldnames = ["username", "password_hash", "email", "income", "user_type", "balance"]
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        writer.writeheader()
-        for u, meta in users.items():
-            writer.writerow({
-                "username": u,
-                "password_hash": meta["password_hash"],
-                "email": meta["email"],
-                "income": meta["income"],
-                "user_type": meta["user_type"],
-                "balance": meta["balance"],
-            })
+def _rule_number(value):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise ValueError(f"{value!r} is not a number")
+    return float(value)
 
-def append_loan_record(record: dict):
-    # record keys: id,username,loan_type,amount,interest_rate,term_years,monthly_payment,total_interest,status
-    with open(LOANS_FILE, "a", newline="") as f:
-        writer = csv.writer(f)
-        writer.writerow([record[k] for k in ["id","username","loan_type","amount","interest_rate","term_years","monthly_payment","total_interest","status"]])
+def screening_columns(loans, users, aggregates):
+    """The SCREENING_FIELDS of LoanRecords `loans` as NumPy arrays, with income from `users`
+    (a UserStore) and approved obligations from `aggregates` (PortfolioAggregates).
+    "applicant" numbers the distinct usernames, for limit_run_exposure()."""
+    _require_numpy()
+    count = len(loans)
 
-def load_loans():
-    loans = []
-    if not os.path.exists(LOANS_FILE):
-        return loans
-    with open(LOANS_FILE, newline="") as f:
-        reader = csv.DictReader(f)
-        for r in reader:
-            # convert numeric fields
-            r["amount"] = float(r["amount"])
-            r["interest_rate"] = float(r["interest_rate"])
-            r["term_years"] = float(r["term_years"])
-            r["monthly_payment"] = float(r["monthly_payment"])
-            r["total_interest"] = float(r["total_interest"])
-            loans.append(r)
-    return loans
+    def column(values, dtype=np.float64):
+        return np.fromiter(values, dtype=dtype, count=count)
 
-def next_loan_id():
-    # simple id generator by counting rows in file
-    if not os.path.exists(LOANS_FILE):
-        return "1"
-    with open(LOANS_FILE, newline="") as f:
-        reader = csv.reader(f)
-        rows = list(reader)
-        # subtract header
-        return str(max(1, len(rows)))  # not perfect but simple for prototype
+    columns = {name: column(map(attrgetter(name), loans))
+               for name in ("amount", "term_years", "interest_rate", "monthly_payment", "total_interest")}
+    columns["loan_type"] = column(map(attrgetter("_loan_type"), loans), np.int32)  # the LOAN_TYPE_CODES code
+    max_terms = np.array([LOAN_OPTIONS[v]["max_term"] if v in LOAN_OPTIONS else np.nan
+                          for v in LOAN_TYPE_CODES.values], dtype=np.float64)
+    columns["max_term"] = max_terms[columns["loan_type"]]
+    # one lookup per applicant, then gathered out to their loans by position
+    positions = {}
+    applicant = column((positions.setdefault(u, len(positions)) for u in map(attrgetter("username"), loans)),
+                       np.int64)
+    per_applicant = []
+    for username in positions:
+        meta = users.get(username)
+        approved = aggregates.user(username)
+        per_applicant.append((float(meta["income"]) if meta is not None else 0.0, approved["monthly"],
+                              approved["amount"]))
+    per_applicant = np.array(per_applicant, dtype=np.float64).reshape(-1, 3)
+    for i, name in enumerate(("income", "existing_monthly", "existing_balance")):
+        columns[name] = per_applicant[applicant, i]
+    columns["applicant"] = applicant
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = (columns["monthly_payment"] + columns["existing_monthly"]) / columns["income"]
+    columns["payment_ratio"] = np.where(columns["income"] > 0, ratio, np.inf)
+    return columns
+
+def evaluate_rules(compiled, columns, count):
+    """Run compile_rules() output over `count` rows of screening_columns().
+
+    Returns (outcome, fired): per row the SCREENING_OUTCOMES index and the
+    index of the rule that decided it (-1, and "manual", when none did).
+    """
+    outcome = np.zeros(count, dtype=np.int8)
+    fired = np.full(count, -1, dtype=np.int32)
+    undecided = np.ones(count, dtype=bool)
+    for i, (_, result, tests) in enumerate(compiled):
+        match = undecided.copy()
+        for test in tests:
+            match &= test(columns)
+        fired[match] = i
+        outcome[match] = SCREENING_OUTCOMES.index(result)
+        undecided &= ~match
+    return outcome, fired
+
+def limit_run_exposure(outcome, columns, limit=SCREENING_MAX_PAYMENT_RATIO):
+    """Turn auto-approvals that would take an applicant past `limit` of income into manual review.
+
+    The rules see each applicant's approved loans as they were before the
+    run, so on their own they could approve several loans that only fit
+    one at a time. Rows must be in loan-id order, and the result is that of
+    approving them one by one: each approval adds its payment to a running
+    sum per applicant, and a loan whose payment would take that sum plus
+    the existing payments over the limit is held (and not counted). Changes
+    `outcome` in place and returns the mask of held rows.
+    """
+    held = np.zeros(len(outcome), dtype=bool)
+    rows = np.flatnonzero(outcome == SCREENING_OUTCOMES.index("approve"))
+    applicant = columns["applicant"]
+    rows = rows[np.argsort(applicant[rows], kind="stable")]  # grouped by applicant, still in id order
+    # each pass holds the first loan over the limit per applicant; only those applicants go round again
+    while len(rows):
+        owner = applicant[rows]
+        cents = np.rint(columns["monthly_payment"][rows] * 100).astype(np.int64)
+        starts = np.r_[True, owner[1:] != owner[:-1]]
+        group = np.cumsum(starts) - 1
+        running = np.cumsum(cents)
+        running -= (running - cents)[starts][group]  # restart the sum at each applicant
+        over = np.flatnonzero(~(columns["existing_monthly"][rows] + running / 100.0
+                                <= limit * columns["income"][rows]))
+        if not len(over):
+            break
+        first = over[np.r_[True, group[over][1:] != group[over][:-1]]]
+        held[rows[first]] = True
+        again = np.zeros(group[-1] + 1, dtype=bool)
+        again[group[first]] = True
+        keep = again[group]
+        keep[first] = False
+        rows = rows[keep]
+    outcome[held] = SCREENING_OUTCOMES.index("manual")
+    return held
 
 # -----------------------------
-# Loan Calculation Logic
+# Service Layer (no GUI)
 # -----------------------------
-def calculate_monthly_payment(principal, annual_rate, term_years):
-    """Return monthly payment using standard formula."""
-    if term_years <= 0 or principal <= 0:
-        return None
-    r = annual_rate / 100.0 / 12.0
-    n = term_years * 12
-    if r == 0:
-        return principal / n
-    # formula:
-    numerator = principal * r * (1 + r) ** n
-    denominator = (1 + r) ** n - 1
-    if denominator == 0:
-        return None
-    M = numerator / denominator
-    return M
+def read_applications(path):
+    """Yield (line_no, record) from a CSV or JSON Lines (.jsonl/.ndjson) file, one row at a time.
 
-def total_interest_paid(monthly_payment, principal, term_years):
-    n = term_years * 12
-    return monthly_payment * n - principal
+    A JSON line that doesn't parse yields its error in place of the record,
+    so the importer can reject it and carry on.
+    """
+    if path.endswith((".jsonl", ".ndjson")):
+        import json
+        with open(path) as f:
+            for line_no, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    record = e
+                yield line_no, record
+    else:
+        with open(path, newline="") as f:
+            yield from enumerate(csv.DictReader(f), start=2)
+
+class ValidationError(ValueError):
+    """A request rejected by a business rule; the message is meant for the end user."""
+
+def _loan_id_sort_key(loan):
+    loan_id = loan["id"]
+    return (0, int(loan_id), "") if loan_id.isdigit() else (1, 0, loan_id)
+
+class LoanService:
+    """Account, login, loan and approval rules shared by the GUI and the CLI.
+
+    The *_async variants run the password KDF on `hasher` and report back
+    through its dispatch; everything else runs on the caller's thread.
+    With a writer, loan ids come from a block reserved ahead of time on the
+    writer thread, so submit() doesn't touch the disk.
+    Other processes may write to the same store: sync() picks up their
+    changes, and writes that lost a race with them (StaleWriteError) are
+    synced and retried up to CONFLICT_RETRIES times; `conflicts` counts them.
+    """
+    def __init__(self, users=None, loans=None, writer=None, hasher=None):
+        self._cursor = get_storage().sync_cursor()
+        self.users = users if users is not None else UserStore(writer)
+        self.loans = loans if loans is not None else LoanRepository(writer)
+        self.hasher = hasher if hasher is not None else PasswordHasher()
+        self.conflicts = 0
+        self._loan_ids = deque()
+        self._reserving_ids = False
+        if writer is not None:
+            self._reserve_loan_ids()
+
+    # other processes
+    def sync(self):
+        """Apply what other processes wrote since the last load or sync (cheap when nothing did)."""
+        if self.users.writer is not None:
+            self.users.writer.flush()  # our own queued writes go first
+        self._cursor, changes = get_storage().changes_since(self._cursor)
+        self._apply_changes(changes)
+
+    def read_changes(self):
+        """The disk half of sync(), safe to run on another thread: (cursor, new cursor, changes)."""
+        cursor = self._cursor
+        return (cursor, *get_storage().changes_since(cursor))
+
+    def apply_read(self, read):
+        """The in-memory half: apply a read_changes() result, unless a sync() ran since it was taken."""
+        cursor, new_cursor, changes = read
+        if self._cursor is cursor:
+            self._cursor = new_cursor
+            self._apply_changes(changes)
+
+    def sync_async(self, on_done=None):
+        """sync() without waiting on the disk: the store is read on the writer thread, after our
+        queued writes, and the changes are applied (then on_done runs) through its dispatch."""
+        writer = self.users.writer
+        if writer is None:
+            self.sync()
+            if on_done is not None:
+                on_done()
+            return
+        read = []
+
+        def apply():
+            cursor, _, changes = read[0]
+            if self._cursor is cursor and changes["reload"]:
+                # rare (another process compacted); writes queued since the read must go out first
+                self.sync()
+            else:
+                self.apply_read(read[0])
+            if on_done is not None:
+                on_done()
+        writer.submit(lambda: read.append(self.read_changes()), on_done=apply)
+
+    def _apply_changes(self, changes):
+        if "users" in changes["reload"]:
+            self.users.reload()
+        else:
+            self.users.apply_remote(changes["user_entries"])
+        if "loans" in changes["reload"]:
+            self.loans.reload()
+        else:
+            self.loans.apply_remote(changes["loans"], changes["statuses"])
+
+    def reload(self):
+        """Drop the in-memory state and load it again, e.g. after a background write failed."""
+        if self.users.writer is not None:
+            self.users.writer.flush()
+        self._cursor = get_storage().sync_cursor()
+        self.users.reload()
+        self.loans.reload()
+
+    def _retrying(self, write):
+        """Run write(); on StaleWriteError sync and run it again, so its checks see the other write."""
+        for attempt in range(CONFLICT_RETRIES):
+            try:
+                return write()
+            except StaleWriteError:
+                self.conflicts += 1
+                if attempt == CONFLICT_RETRIES - 1:
+                    raise
+                self.sync()
+
+    # accounts
+    def _check_new_account(self, username, password, user_type):
+        if not username or not password:
+            raise ValidationError("Username and password required")
+        if user_type not in ("admin", "client"):
+            raise ValidationError("Please enter 'admin' or 'client'.")
+        if username in self.users:
+            raise ValidationError("Username already exists")
+
+    def create_account(self, username, password, email="", income=0.0, user_type="client", on_done=None):
+        self._check_new_account(username, password, user_type)
+        self.create_hashed_account(username, hash_password(password), email, income, user_type, on_done)
+
+    def create_account_async(self, username, password, email="", income=0.0, user_type="client",
+                             on_done=None, on_error=None):
+        self._check_new_account(username, password, user_type)
+        def hashed(password_hash):
+            try:
+                self.create_hashed_account(username, password_hash, email, income, user_type, on_done)
+            except (ValidationError, StaleWriteError) as e:
+                if on_error is not None:
+                    on_error(e)
+        self.hasher.submit(hash_password, password, on_done=hashed, on_error=on_error)
+
+    def create_hashed_account(self, username, password_hash, email="", income=0.0, user_type="client",
+                              on_done=None):
+        """Second half of create_account, once hash_password() has run (possibly on another thread)."""
+        def create():
+            self._check_new_account(username, password_hash, user_type)  # the name may have been taken meanwhile
+            self.users.create(username, password_hash, email, float(income), user_type, on_done=on_done)
+        self._retrying(create)
+
+    def _login_account(self, username):
+        if username not in self.users:
+            raise ValidationError("No such user.")
+        return self.users[username]
+
+    def _finish_login(self, username, password, user_type, stored, verified, asynchronous, upgrade=None):
+        if not verified:
+            raise ValidationError("Incorrect password.")
+        if stored["user_type"] != user_type:
+            raise ValidationError(f"User type mismatch. You tried to login as {user_type}.")
+        if password_needs_upgrade(stored["password_hash"]):
+            # transparently move legacy / weaker hashes to the current KDF settings
+            if asynchronous:
+                self.hasher.submit(hash_password, password, on_done=upgrade or functools.partial(
+                    self.set_password_hash, username))
+            else:
+                self.set_password_hash(username, hash_password(password))
+
+    def check_login(self, username, password, user_type):
+        """Raise ValidationError unless the credentials match an account of `user_type`."""
+        stored = self._login_account(username)
+        verified = verify_password(password, stored["password_hash"])
+        self._finish_login(username, password, user_type, stored, verified, asynchronous=False)
+
+    def check_login_async(self, username, password, user_type, on_done, on_error, upgrade=None):
+        """check_login with verification on the hasher; on_done() or on_error(exc) follows.
+
+        A hash that needs upgrading is redone on the hasher too and stored
+        with set_password_hash(), or handed to upgrade(password_hash) if given.
+        """
+        stored = self._login_account(username)
+        def verified(ok):
+            try:
+                self._finish_login(username, password, user_type, stored, ok, asynchronous=True, upgrade=upgrade)
+            except ValidationError as e:
+                on_error(e)
+                return
+            on_done()
+        self.hasher.submit(verify_password, password, stored["password_hash"], on_done=verified, on_error=on_error)
+
+    def _check_reset(self, username, user_type):
+        if username not in self.users or self.users[username]["user_type"] != user_type:
+            raise ValidationError("No matching account found.")
+
+    def reset_password(self, username, user_type, new_password, on_done=None):
+        self._check_reset(username, user_type)
+        self.set_password_hash(username, hash_password(new_password), on_done)
+
+    def reset_password_async(self, username, user_type, new_password, on_done=None, on_error=None):
+        self._check_reset(username, user_type)
+        self.hasher.submit(hash_password, new_password, on_error=on_error,
+                           on_done=lambda password_hash: self.set_password_hash(username, password_hash, on_done))
+
+    def set_password_hash(self, username, password_hash, on_done=None):
+        """Store a hash_password() result (possibly computed on another thread)."""
+        self._retrying(lambda: self.users.set_password(username, password_hash, on_done=on_done))
+
+    # loans
+    def quote(self, loan_type, amount, term, income, username=None):
+        """Validate an application against LOAN_OPTIONS and price it.
+
+        Returns a dict with rate, monthly_payment, total_interest,
+        existing_monthly (the monthly payments on `username`'s approved
+        loans, 0 without a username) and over_debt_ratio (new plus existing
+        payments above 50% of income, which the caller may still choose to
+        accept).
+        """
+        if loan_type not in LOAN_OPTIONS:
+            raise ValidationError(f"Unknown loan type {loan_type!r}.")
+        opt = LOAN_OPTIONS[loan_type]
+        if not term > 0 or term > opt["max_term"]:
+            raise ValidationError(f"Term must be >0 and <= {opt['max_term']} years for {loan_type}.")
+        if not amount > 0:
+            raise ValidationError("Amount must be positive.")
+        monthly = calculate_monthly_payment(amount, opt["rate"], term)
+        if monthly is None or not isfinite(monthly):
+            raise ValidationError("Could not compute monthly payment.")
+        existing = self.loans.aggregates.user(username)["monthly"] if username is not None else 0.0
+        return {
+            "loan_type": loan_type,
+            "amount": amount,
+            "term_years": term,
+            "rate": opt["rate"],
+            "monthly_payment": monthly,
+            "total_interest": total_interest_paid(monthly, amount, term),
+            "existing_monthly": existing,
+            "over_debt_ratio": monthly + existing > 0.5 * income,
+        }
+
+    def _pending_record(self, loan_id, username, quote):
+        return {
+            "id": loan_id,
+            "username": username,
+            "loan_type": quote["loan_type"],
+            "amount": quote["amount"],
+            "interest_rate": quote["rate"],
+            "term_years": quote["term_years"],
+            "monthly_payment": round(quote["monthly_payment"],2),
+            "total_interest": round(quote["total_interest"],2),
+            "status": "pending"
+        }
+
+    def submit(self, username, quote, on_done=None):
+        """Record a quoted application as a pending loan and return the stored record."""
+        if username not in self.users:
+            raise ValidationError("No such user.")
+        return self.loans.append(self._pending_record(self._next_loan_id(), username, quote), on_done=on_done)
+
+    def _next_loan_id(self):
+        if self.loans.writer is None:
+            return next_loan_id()
+        if len(self._loan_ids) <= LOAN_ID_BLOCK // 2:
+            self._reserve_loan_ids()
+        if not self._loan_ids:
+            return next_loan_id()  # a burst used up the block before the next one arrived
+        return str(self._loan_ids.popleft())
+
+    def _reserve_loan_ids(self):
+        """Queue the reservation of the next LOAN_ID_BLOCK ids; they are used once it is on disk."""
+        if self._reserving_ids:
+            return
+        self._reserving_ids = True
+        block = []
+
+        def reserved():
+            self._loan_ids.extend(block)
+            self._reserving_ids = False
+
+        def failed(error):
+            self._reserving_ids = False
+        self.loans.writer.submit(lambda: block.extend(reserve_loan_ids(LOAN_ID_BLOCK)), on_done=reserved,
+                                 on_error=failed)
+
+    # bulk import
+    def screen_applications(self, applications, allow_over_ratio=False):
+        """Validate and price (line_no, record) pairs lazily (see read_applications).
+
+        Yields (line_no, record, quote, None) for accepted rows, with the
+        username added to the quote, and (line_no, record, None, reason) for
+        rejected ones.
+        """
+        for line_no, record in applications:
+            try:
+                if isinstance(record, Exception):
+                    raise ValidationError(f"Malformed line: {record}")
+                if not isinstance(record, dict):
+                    raise ValidationError("Expected an object with application fields.")
+                username = record["username"]
+                user = self.users.get(username)
+                if user is None:
+                    raise ValidationError("No such user.")
+                income = float(record.get("income") or user["income"])
+                quote = self.quote(record["loan_type"], float(record["amount"]), float(record["term_years"]), income,
+                                   username)
+                if quote["over_debt_ratio"] and not allow_over_ratio:
+                    raise ValidationError("Monthly payments (with existing approved loans) exceed 50% of income.")
+            except KeyError as e:
+                yield line_no, record, None, f"Missing field {e}."
+                continue
+            except (TypeError, ValueError) as e:
+                yield line_no, record, None, str(e)
+                continue
+            quote["username"] = username
+            yield line_no, record, quote, None
+
+    def import_applications(self, applications, allow_over_ratio=False, on_reject=None,
+                            chunk_size=IMPORT_CHUNK_SIZE, index=True):
+        """Stream applications into pending loans, chunk_size rows per write.
+
+        Each chunk takes one reserve_loan_ids block and one storage batch, so
+        memory stays flat however long the input is (pass index=False to keep
+        the imported rows out of self.loans as well). Rejected rows go to
+        on_reject(line_no, record, reason). Returns read/imported/rejected
+        counts, elapsed seconds and rows_per_s.
+        """
+        started = time.perf_counter()
+        stats = {"read": 0, "imported": 0, "rejected": 0}
+        chunk = []
+
+        def write_chunk():
+            ids = reserve_loan_ids(len(chunk))
+            self.loans.append_many([self._pending_record(loan_id, q["username"], q) for loan_id, q in zip(ids, chunk)],
+                                   index=index)
+            stats["imported"] += len(chunk)
+            chunk.clear()
+
+        for line_no, record, quote, reason in self.screen_applications(applications, allow_over_ratio):
+            stats["read"] += 1
+            if reason is None:
+                chunk.append(quote)
+                if len(chunk) >= chunk_size:
+                    write_chunk()
+            else:
+                stats["rejected"] += 1
+                if on_reject is not None:
+                    on_reject(line_no, record, reason)
+        if chunk:
+            write_chunk()
+        stats["seconds"] = time.perf_counter() - started
+        stats["rows_per_s"] = stats["read"] / stats["seconds"] if stats["seconds"] else 0.0
+        return stats
+
+    def find_loans(self, status=None, username=None, loan_type=None, min_amount=None, max_amount=None,
+                   sort_by=None, descending=False):
+        """Loans matching every given filter; narrows through the username/status indexes first.
+
+        `sort_by` names a loan field; ids sort numerically. Unsorted results
+        keep insertion order.
+        """
+        if username is not None:
+            candidates = self.loans.for_user(username)
+            if status is not None:
+                candidates = [l for l in candidates if l["status"].lower() == status.lower()]
+        elif status is not None:
+            candidates = self.loans.with_status(status)
+        else:
+            candidates = list(self.loans)
+        matched = [
+            l for l in candidates
+            if (loan_type is None or l["loan_type"] == loan_type)
+            and (min_amount is None or l["amount"] >= min_amount)
+            and (max_amount is None or l["amount"] <= max_amount)
+        ]
+        if sort_by == "id":
+            matched.sort(key=_loan_id_sort_key, reverse=descending)
+        elif sort_by is not None:
+            matched.sort(key=lambda l: l[sort_by], reverse=descending)
+        return matched
+
+    def decide(self, loan_ids, status, on_done=None):
+        """Approve or reject pending loans in one commit; returns the records changed.
+
+        Loans another process decided first are skipped, as if already decided here.
+        """
+        return self.decide_all({str(loan_id): status for loan_id in loan_ids}, on_done)
+
+    def decide_all(self, decisions, on_done=None, versions=None, audit=None):
+        """decide() for a {loan id: "approved" or "rejected"} mapping, still as one commit
+        (see LoanRepository.decide for `versions` and `audit`).
+
+        With `versions` a conflict is not retried, since it would only fail
+        the same way: we sync, so whatever the caller reads next is current,
+        and raise StaleWriteError.
+        """
+        def decide():
+            return self.loans.decide(decisions, self.users, on_done=on_done, versions=versions, audit=audit)
+        if versions is None:
+            return self._retrying(decide)
+        try:
+            return decide()
+        except StaleWriteError:
+            self.sync()
+            raise
+
+    def screen_pending(self, rules=None, apply=False, audit_path=SCREENING_AUDIT_FILE, pending=None):
+        """Tag every pending loan auto-approve, auto-reject or manual review by the screening rules.
+
+        `rules` is compile_rules() output (DEFAULT_SCREENING_RULES when None).
+        The rules run over all pending loans at once as arrays, in loan-id
+        order; an approval that would take its applicant past
+        SCREENING_MAX_PAYMENT_RATIO together with the run's earlier approvals
+        is held for review instead (see limit_run_exposure). Returns counts
+        per outcome and per rule, timings, and under "plan" what
+        apply_screening() needs to commit exactly this result later. With
+        apply=True it is committed at once and "applied" says how many loans
+        were decided. `pending` is the list of pending loans to screen, for
+        a caller that runs this off the thread that changes the repository.
+        """
+        started = time.perf_counter()
+        compiled = compile_rules(DEFAULT_SCREENING_RULES) if rules is None else rules
+        loans = sorted(self.loans.with_status("pending") if pending is None else pending, key=_loan_id_sort_key)
+        # versions before anything else is read, so apply_screening() can tell if a loan changed after this
+        versions = list(map(attrgetter("version"), loans))
+        columns = screening_columns(loans, self.users, self.loans.aggregates)
+        outcome, fired = evaluate_rules(compiled, columns, len(loans))
+        fired[limit_run_exposure(outcome, columns)] = len(compiled)
+        evaluated = time.perf_counter()
+        names = [name for name, _, _ in compiled] + [SCREENING_EXPOSURE_RULE]
+        result = {name: int(n) for name, n in zip(SCREENING_OUTCOMES, np.bincount(outcome, minlength=3))}
+        result["screened"] = len(loans)
+        result["by_rule"] = {name: int(n) for name, n in
+                             zip(names, np.bincount(fired + 1, minlength=len(names) + 1)[1:])}
+        result["plan"] = (loans, versions, outcome, fired, names)
+        result["applied"] = self.apply_screening(result, audit_path) if apply else 0
+        result["evaluate_s"] = evaluated - started
+        result["seconds"] = time.perf_counter() - started
+        return result
+
+    def apply_screening(self, screening, audit_path=SCREENING_AUDIT_FILE, on_done=None):
+        """Commit the decisions of a screen_pending() result, with their audit rows, as one write.
+
+        Exactly the screened outcomes are applied: if a loan to be decided has
+        changed since (decided here or by another process), StaleWriteError
+        is raised and nothing is written; screen again. Every screened loan
+        (manual ones included) gets an audit row with the rule that fired, in
+        `audit_path` on CSV and the screening_audit table on SQLite, in the
+        same commit as the decisions. Returns the number of loans decided.
+        """
+        loans, versions, outcome, fired, names = screening["plan"]
+        statuses = {"approve": "approved", "reject": "rejected"}
+        decided = np.flatnonzero(outcome).tolist()
+        decisions = {loans[i].id: statuses[SCREENING_OUTCOMES[outcome[i]]] for i in decided}
+        names = [""] + names
+        screened_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+        rows = [(screened_at, l.id, l.username, names[rule + 1], SCREENING_OUTCOMES[code], int(code != 0))
+                for l, rule, code in zip(loans, fired.tolist(), outcome.tolist())]
+        return len(self.decide_all(decisions, on_done, versions={loans[i].id: versions[i] for i in decided},
+                                   audit=(audit_path, rows)))
+
+    def portfolio_summary(self):
+        """{status: {"count", "amount", "monthly"}} across all products, from the running aggregates."""
+        totals = {}
+        for (status, _), t in sorted(self.loans.aggregates.summary().items()):
+            acc = totals.setdefault(status, {"count": 0, "amount": 0.0, "monthly": 0.0})
+            for k in acc:
+                acc[k] += t[k]
+        return totals
 
 # -----------------------------
 # GUI Application
 # -----------------------------
+def _load_tk():
+    global tk, ttk, messagebox, simpledialog
+    if tk is None:
+        import tkinter
+        from tkinter import ttk as _ttk, messagebox as _messagebox, simpledialog as _simpledialog
+        tk, ttk, messagebox, simpledialog = tkinter, _ttk, _messagebox, _simpledialog
+
 class BankApp:
     def __init__(self, root):
+        _load_tk()
         ensure_files_exist()
         self.root = root
         self.root.title("Bank Loan System - Prototype")
-        self.users = load_users_to_dict()
-        self.loans = load_loans()
+        # file writes (and other slow work) run on background threads; their callbacks come back through dispatch
+        self._callbacks = queue.Queue()
+        self.root.after(GUI_POLL_MS, self._run_callbacks)
+        self.writer = StorageWriter(dispatch=self.dispatch, on_error=self.show_write_error)
+        self.service = LoanService(writer=self.writer, hasher=PasswordHasher(dispatch=self.dispatch))
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        self.users = self.service.users
+        self.loans = self.service.loans
         self.current_user = None  # username
         self.create_welcome_screen()
 
@@ -224,24 +3451,29 @@ class BankApp:
         def attempt_login():
             username = user_entry.get().strip()
             pw = pw_entry.get().strip()
-            if username not in self.users:
-                messagebox.showerror("Login failed", "No such user.")
-                return
-            stored = self.users[username]
-            if stored["password_hash"] != hash_password(pw):
-                messagebox.showerror("Login failed", "Incorrect password.")
-                return
-            if stored["user_type"] != role_choice:
-                messagebox.showerror("Login failed", f"User type mismatch. You tried to login as {role_choice}.")
+
+            def logged_in():
+                self.current_user = username
+                dialog.destroy()
+                if role_choice == "admin":
+                    self.open_admin_dashboard()
+                else:
+                    self.open_client_dashboard()
+
+            def failed(e):
+                login_btn.state(["!disabled"])
+                messagebox.showerror("Login failed", str(e))
+
+            # the password check runs on the hasher pool; the button stays disabled meanwhile
+            try:
+                self.service.check_login_async(username, pw, role_choice, on_done=logged_in, on_error=failed)
+            except ValidationError as e:
+                failed(e)
                 return
-            self.current_user = username
-            dialog.destroy()
-            if role_choice == "admin":
-                self.open_admin_dashboard()
-            else:
-                self.open_client_dashboard()
+            login_btn.state(["disabled"])
 
-        ttk.Button(dialog, text="Login", command=attempt_login).grid(row=3, column=0, columnspan=2, pady=10)
+        login_btn = ttk.Button(dialog, text="Login", command=attempt_login)
+        login_btn.grid(row=3, column=0, columnspan=2, pady=10)
 
     def open_create_account_dropdown(self, role_choice=None):
         if role_choice is None:
@@ -280,21 +3512,13 @@ class BankApp:
             except:
                 messagebox.showerror("Error", "Please enter a valid income")
                 return
-            if not username or not pw:
-                messagebox.showerror("Error", "Username and password required")
-                return
-            if username in self.users:
-                messagebox.showerror("Error", "Username already exists")
+            try:
+                self.service.create_account_async(username, pw, email, income, role_choice,
+                    on_done=lambda: messagebox.showinfo("Success", f"Account '{username}' created as {role_choice}"),
+                    on_error=lambda e: messagebox.showerror("Error", str(e)))
+            except ValidationError as e:
+                messagebox.showerror("Error", str(e))
                 return
-            self.users[username] = {
-                "password_hash": hash_password(pw),
-                "email": email,
-                "income": income,
-                "user_type": role_choice,
-                "balance": 0.0
-            }
-            write_users_from_dict(self.users)
-            messagebox.showinfo("Success", f"Account '{username}' created as {role_choice}")
             dialog.destroy()
 
         ttk.Button(dialog, text="Create", command=create_account).grid(row=5, column=0, columnspan=2, pady=10)
@@ -311,15 +3535,19 @@ class BankApp:
         username = simpledialog.askstring("Recover", f"Enter username for {kind}:")
         if not username:
             return
-        if username not in self.users or self.users[username]["user_type"] != ("admin" if kind=="admin" else "client"):
+        user_type = "admin" if kind=="admin" else "client"
+        if username not in self.users or self.users[username]["user_type"] != user_type:
             messagebox.showerror("Error", "No matching account found.")
             return
         newpw = simpledialog.askstring("New Password", "Enter new password:", show="*")
         if not newpw:
             return
-        self.users[username]["password_hash"] = hash_password(newpw)
-        write_users_from_dict(self.users)
-        messagebox.showinfo("Success", "Password updated. You can now login.")
+        try:
+            self.service.reset_password_async(username, user_type, newpw,
+                on_done=lambda: messagebox.showinfo("Success", "Password updated. You can now login."),
+                on_error=lambda e: messagebox.showerror("Error", str(e)))
+        except ValidationError as e:
+            messagebox.showerror("Error", str(e))
 
     # -------------------------
     # Client Dashboard
@@ -355,10 +3583,9 @@ class BankApp:
         summary_frame = ttk.LabelFrame(main, text="Account Summary", padding=10)
         summary_frame.pack(fill=tk.BOTH, expand=True, pady=10)
         # We'll show last 5 loans
-        loans = load_loans()
-        user_loans = [l for l in loans if l.get("username")==self.current_user]
-        ttk.Label(summary_frame, text=f"Loans (last {min(5,len(user_loans))}):").pack(anchor=tk.W)
-        for l in user_loans[-5:]:
+        user_loans = self.loans.for_user(self.current_user, last=5)
+        ttk.Label(summary_frame, text=f"Loans (last {len(user_loans)}):").pack(anchor=tk.W)
+        for l in user_loans:
             ttk.Label(summary_frame, text=f"{l['loan_type']} ${l['amount']:.2f} - {l['status']} - ${l['monthly_payment']:.2f}/mo").pack(anchor=tk.W)
 
         # Big Take Loan section
@@ -398,44 +3625,30 @@ class BankApp:
             except:
                 messagebox.showerror("Error", "Please enter valid numeric values.")
                 return
-            opt = LOAN_OPTIONS[loan_type]
-            if term <= 0 or term > opt["max_term"]:
-                messagebox.showerror("Error", f"Term must be >0 and <= {opt['max_term']} years for {loan_type}.")
-                return
-            if amount <= 0:
-                messagebox.showerror("Error", "Amount must be positive.")
-                return
-
-            monthly = calculate_monthly_payment(amount, opt["rate"], term)
-            if monthly is None or not isfinite(monthly):
-                messagebox.showerror("Error", "Could not compute monthly payment.")
+            try:
+                quote = self.service.quote(loan_type, amount, term, income, self.current_user)
+            except ValidationError as e:
+                messagebox.showerror("Error", str(e))
                 return
-            tot_interest = total_interest_paid(monthly, amount, term)
+            monthly = quote["monthly_payment"]
+            tot_interest = quote["total_interest"]
             # Debt ratio check
-            if monthly > 0.5 * income:
+            if quote["over_debt_ratio"]:
                 # suggest increasing term if possible
+                existing = quote["existing_monthly"]
+                payments = (f"Monthly payment ${monthly:.2f} plus ${existing:.2f} on your approved loans"
+                            if existing else f"Monthly payment ${monthly:.2f}")
                 allow = messagebox.askyesno("Debt ratio exceeded", 
-                    f"Monthly payment ${monthly:.2f} exceeds 50% of income (${0.5*income:.2f}).\nWould you like to increase term (if possible) or reduce amount?")
+                    f"{payments} exceeds 50% of income (${0.5*income:.2f}).\nWould you like to increase term (if possible) or reduce amount?")
                 if not allow:
                     return
             # Show summary and ask to submit (this will become PENDING)
             summary = (f"Loan Type: {loan_type}\nAmount: ${amount:.2f}\nTerm: {term} years\n"
-                       f"Rate: {opt['rate']}%\nMonthly payment: ${monthly:.2f}\nTotal interest: ${tot_interest:.2f}\n\n"
+                       f"Rate: {quote['rate']}%\nMonthly payment: ${monthly:.2f}\nTotal interest: ${tot_interest:.2f}\n\n"
                        "Proceed to submit application? (It will be pending until admin approval)")
             if messagebox.askyesno("Confirm Loan Application", summary):
-                rec = {
-                    "id": next_loan_id(),
-                    "username": self.current_user,
-                    "loan_type": loan_type,
-                    "amount": amount,
-                    "interest_rate": opt["rate"],
-                    "term_years": term,
-                    "monthly_payment": round(monthly,2),
-                    "total_interest": round(tot_interest,2),
-                    "status": "pending"
-                }
-                append_loan_record(rec)
-                messagebox.showinfo("Submitted", "Loan application submitted and is pending approval.")
+                self.service.submit(self.current_user, quote,
+                    on_done=lambda: messagebox.showinfo("Submitted", "Loan application submitted and is pending approval."))
                 dialog.destroy()
 
         ttk.Button(dialog, text="Preview & Submit", command=preview_and_submit).grid(row=4, column=0, columnspan=2, pady=10)
@@ -453,102 +3666,981 @@ class BankApp:
         topbar.pack(fill=tk.X)
         ttk.Label(topbar, text=f"Admin Dashboard - {self.current_user}", font=("Helvetica", 14)).pack(side=tk.LEFT)
         ttk.Button(topbar, text="Logout", command=self.logout).pack(side=tk.RIGHT)
+        summary_lbl = ttk.Label(main)
+        summary_lbl.pack(anchor=tk.W, pady=(6,0))
 
-        # Loans table
+        def update_summary():
+            # O(1): read from the repository's running aggregates
+            totals = self.service.portfolio_summary()
+            summary_lbl.config(text="   ".join(f"{status.capitalize()}: {t['count']} (${t['amount']:,.2f})"
+                                               for status, t in totals.items()))
+
+        # Filters (applied by the service, not the widget)
+        filter_frame = ttk.Frame(main)
+        filter_frame.pack(fill=tk.X, pady=(10,0))
+        ttk.Label(filter_frame, text="Type:").pack(side=tk.LEFT)
+        type_cb = ttk.Combobox(filter_frame, values=["All"] + list(LOAN_OPTIONS.keys()), state="readonly", width=14)
+        type_cb.current(0)
+        type_cb.pack(side=tk.LEFT, padx=(2,8))
+        ttk.Label(filter_frame, text="Username:").pack(side=tk.LEFT)
+        user_e = ttk.Entry(filter_frame, width=12)
+        user_e.pack(side=tk.LEFT, padx=(2,8))
+        ttk.Label(filter_frame, text="Amount from:").pack(side=tk.LEFT)
+        min_e = ttk.Entry(filter_frame, width=10)
+        min_e.pack(side=tk.LEFT, padx=2)
+        ttk.Label(filter_frame, text="to:").pack(side=tk.LEFT)
+        max_e = ttk.Entry(filter_frame, width=10)
+        max_e.pack(side=tk.LEFT, padx=(2,8))
+
+        # Loans table: only the current page is ever inserted into the Treeview
         loans_frame = ttk.LabelFrame(main, text="Loan Applications (Pending)", padding=10)
         loans_frame.pack(fill=tk.BOTH, expand=True, pady=10)
 
-        tree = ttk.Treeview(loans_frame, columns=("id","username","type","amount","term","monthly","status"), show="headings")
-        for c, heading in [("id","ID"),("username","Username"),("type","Type"),("amount","Amount"),("term","Term (yrs)"),("monthly","Monthly"),("status","Status")]:
-            tree.heading(c, text=heading)
+        columns = [("id","ID"),("username","Username"),("loan_type","Type"),("amount","Amount"),("term_years","Term (yrs)"),("monthly_payment","Monthly"),("status","Status")]
+        tree = ttk.Treeview(loans_frame, columns=[c for c, _ in columns], show="headings", selectmode="extended")
+        for c, heading in columns:
+            tree.heading(c, text=heading, command=lambda c=c: sort_by(c))
             tree.column(c, width=100)
         tree.pack(fill=tk.BOTH, expand=True)
 
-        # populate
-        loans = load_loans()
-        pending = [l for l in loans if l["status"].lower()=="pending"]
-        for l in pending:
-            tree.insert("", tk.END, values=(l["id"], l["username"], l["loan_type"], f"${l['amount']:.2f}", l["term_years"], f"${l['monthly_payment']:.2f}", l["status"]))
+        # rows: the filtered, sorted pending loans; the tree shows rows[offset:offset+ADMIN_PAGE_SIZE]
+        view = {"rows": [], "offset": 0, "sort": "id", "descending": False}
 
-        # Approve / Reject buttons
-        def approve_selected():
-            sel = tree.selection()
-            if not sel:
-                messagebox.showerror("Error", "Select a pending loan first")
+        def insert_row(l):
+            tree.insert("", tk.END, iid=l["id"], values=(l["id"], l["username"], l["loan_type"], f"${l['amount']:.2f}", l["term_years"], f"${l['monthly_payment']:.2f}", l["status"]))
+
+        def update_page_label():
+            total = len(view["rows"])
+            pages = max(1, -(-total // ADMIN_PAGE_SIZE))
+            page_lbl.config(text=f"Page {view['offset'] // ADMIN_PAGE_SIZE + 1} of {pages} ({total} pending)")
+
+        def show_page():
+            with METRICS.span("BankApp.admin_show_page"):
+                tree.delete(*tree.get_children())
+                for l in view["rows"][view["offset"]:view["offset"] + ADMIN_PAGE_SIZE]:
+                    insert_row(l)
+                update_page_label()
+
+        def refresh():
+            try:
+                min_amount = float(min_e.get()) if min_e.get().strip() else None
+                max_amount = float(max_e.get()) if max_e.get().strip() else None
+            except ValueError:
+                messagebox.showerror("Error", "Please enter valid numeric amounts.")
                 return
-            item = tree.item(sel[0])["values"]
-            loan_id = str(item[0])
-            # load file, update status
-            loans_all = load_loans()
-            modified = False
-            for row in loans_all:
-                if row["id"] == loan_id:
-                    row["status"] = "approved"
-                    # credit user balance
-                    username = row["username"]
-                    # load users dict (in-memory)
-                    self.users = load_users_to_dict()
-                    if username in self.users:
-                        # Add funds to balance
-                        self.users[username]["balance"] = float(self.users[username].get("balance",0.0)) + float(row["amount"])
-                        write_users_from_dict(self.users)
-                    modified = True
-            if modified:
-                # overwrite loans file with updated statuses
-                # simple rewrite approach:
-                with open(LOANS_FILE, "w", newline="") as f:
-                    fieldnames = ["id","username","loan_type","amount","interest_rate","term_years","monthly_payment","total_interest","status"]
-                    writer = csv.DictWriter(f, fieldnames=fieldnames)
-                    writer.writeheader()
-                    for r in loans_all:
-                        writer.writerow({k: r[k] for k in fieldnames})
-                messagebox.showinfo("Approved", f"Loan {loan_id} approved and funds credited to user.")
-                self.open_admin_dashboard()
+
+            def synced():
+                update_summary()
+                view["rows"] = self.service.find_loans(
+                    "pending",
+                    username=user_e.get().strip() or None,
+                    loan_type=None if type_cb.get() == "All" else type_cb.get(),
+                    min_amount=min_amount,
+                    max_amount=max_amount,
+                    sort_by=view["sort"],
+                    descending=view["descending"],
+                )
+                view["offset"] = 0
+                show_page()
+            self.service.sync_async(on_done=synced)  # loans submitted or decided by other processes
+
+        def sort_by(column):
+            if view["sort"] == column:
+                view["descending"] = not view["descending"]
             else:
-                messagebox.showerror("Error", "Loan not found.")
+                view["sort"], view["descending"] = column, False
+            refresh()
 
-        def reject_selected():
+        def turn_page(step):
+            offset = view["offset"] + step * ADMIN_PAGE_SIZE
+            if 0 <= offset < max(1, len(view["rows"])):
+                view["offset"] = offset
+                show_page()
+
+        # Approve / Reject buttons (the tree allows extended multi-select)
+        def decide_selected(status):
             sel = tree.selection()
             if not sel:
                 messagebox.showerror("Error", "Select a pending loan first")
                 return
-            item = tree.item(sel[0])["values"]
-            loan_id = str(item[0])
-            loans_all = load_loans()
-            modified = False
-            for row in loans_all:
-                if row["id"] == loan_id:
-                    row["status"] = "rejected"
-                    modified = True
-            if modified:
-                with open(LOANS_FILE, "w", newline="") as f:
-                    fieldnames = ["id","username","loan_type","amount","interest_rate","term_years","monthly_payment","total_interest","status"]
-                    writer = csv.DictWriter(f, fieldnames=fieldnames)
-                    writer.writeheader()
-                    for r in loans_all:
-                        writer.writerow({k: r[k] for k in fieldnames})
-                messagebox.showinfo("Rejected", f"Loan {loan_id} rejected.")
-                self.open_admin_dashboard()
-            else:
-                messagebox.showerror("Error", "Loan not found.")
+            # item ids are the loan ids; credit balances and commit the whole batch at once
+            def saved():
+                if status == "approved":
+                    messagebox.showinfo("Approved", f"{len(changed)} loan(s) approved and funds credited to users.")
+                else:
+                    messagebox.showinfo("Rejected", f"{len(changed)} loan(s) rejected.")
+
+            changed = self.service.decide(list(sel), status, on_done=saved)
+            if not changed:
+                messagebox.showerror("Error", "Loan not found, or already decided elsewhere.")
+                refresh()
+                return
+            # drop just the decided rows and top the page back up from the rows after it
+            changed_ids = {l["id"] for l in changed}
+            view["rows"] = [l for l in view["rows"] if l["id"] not in changed_ids]
+            tree.delete(*[i for i in changed_ids if tree.exists(i)])
+            shown = len(tree.get_children())
+            start = view["offset"] + shown
+            for l in view["rows"][start:view["offset"] + ADMIN_PAGE_SIZE]:
+                insert_row(l)
+            if not tree.get_children() and view["offset"] > 0:
+                turn_page(-1)
+            update_page_label()
+            update_summary()
+
+        def auto_screen():
+            # the list is taken here, where the repository changes; the rules run on their own thread
+            pending = self.loans.with_status("pending")
+            screen_btn.state(["disabled"])
+
+            def run():
+                try:
+                    self.dispatch(screened, self.service.screen_pending(pending=pending), None)
+                except ImportError as e:
+                    self.dispatch(screened, None, e)
+            threading.Thread(target=run, name="auto-screen", daemon=True).start()
+
+        def screened(preview, error):
+            if not screen_btn.winfo_exists():
+                return  # the admin left this screen meanwhile
+            screen_btn.state(["!disabled"])
+            if error is not None:
+                messagebox.showerror("Error", str(error))
+                return
+            if not messagebox.askyesno("Auto-screen pending loans",
+                    f"{preview['approve']} to approve, {preview['reject']} to reject, "
+                    f"{preview['manual']} left for manual review.\nApply these decisions?"):
+                return
+
+            def saved():
+                messagebox.showinfo("Auto-screen", f"{applied} loan(s) decided; see {SCREENING_AUDIT_FILE}.")
+            try:
+                applied = self.service.apply_screening(preview, on_done=saved)
+            except StaleWriteError:
+                messagebox.showerror("Auto-screen", "Pending loans changed since the preview; run Auto-screen again.")
+            refresh()
+
+        def approve_selected():
+            decide_selected("approved")
+
+        def reject_selected():
+            decide_selected("rejected")
+
+        ttk.Button(filter_frame, text="Apply", command=refresh).pack(side=tk.LEFT)
 
         btn_frame = ttk.Frame(main)
         btn_frame.pack(pady=8)
+        ttk.Button(btn_frame, text="< Prev", command=lambda: turn_page(-1)).pack(side=tk.LEFT, padx=5)
+        page_lbl = ttk.Label(btn_frame)
+        page_lbl.pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Next >", command=lambda: turn_page(1)).pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_frame, text="Select Page", command=lambda: tree.selection_set(tree.get_children())).pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_frame, text="Approve Selected", command=approve_selected).pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_frame, text="Reject Selected", command=reject_selected).pack(side=tk.LEFT, padx=5)
+        screen_btn = ttk.Button(btn_frame, text="Auto-screen", command=auto_screen)
+        screen_btn.pack(side=tk.LEFT, padx=5)
+
+        refresh()
+
+    def dispatch(self, fn, *args):
+        """Have the Tk thread run fn(*args); safe from any thread, unlike root.after."""
+        self._callbacks.put((fn, args))
+
+    def _run_callbacks(self):
+        try:
+            while True:
+                try:
+                    fn, args = self._callbacks.get_nowait()
+                except queue.Empty:
+                    break
+                fn(*args)
+        finally:
+            self.root.after(GUI_POLL_MS, self._run_callbacks)
 
     def logout(self):
+        self.writer.flush()
         self.current_user = None
         self.create_welcome_screen()
 
+    def on_close(self):
+        self.writer.flush()
+        get_storage().wait_for_compaction()
+        self.root.destroy()
+
+    def show_write_error(self, error):
+        if isinstance(error, StaleWriteError):
+            # another process got there first; the screen showed our change optimistically, so start over from disk
+            self.service.reload()
+            messagebox.showwarning("Changed elsewhere", f"{error}.\n\nThe data has been reloaded; please check and try again.")
+            user = self.users.get(self.current_user) if self.current_user else None
+            if user is not None:
+                self.open_admin_dashboard() if user["user_type"] == "admin" else self.open_client_dashboard()
+            return
+        messagebox.showerror("Save failed", f"A change could not be written to disk:\n{error}\n\n"
+                             "The screen may not match the saved data; please restart the app.")
+
+# -----------------------------
+# Instrumentation (opt-in)
+# -----------------------------
+class Metrics:
+    """Timing spans, row counters and gauges, thread-safe (the writer thread records too)."""
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.spans = {}     # name -> [calls, total seconds, slowest call]
+        self.counters = {}  # (counter, table) -> value
+        self.gauges = {}    # name -> read(), returning {stat: number} at export time
+
+    @contextmanager
+    def span(self, name):
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started)
+
+    def observe(self, name, seconds):
+        with self._lock:
+            span = self.spans.get(name)
+            if span is None:
+                self.spans[name] = [1, seconds, seconds]
+            else:
+                span[0] += 1
+                span[1] += seconds
+                if seconds > span[2]:
+                    span[2] = seconds
+
+    def count(self, counter, table, n=1):
+        with self._lock:
+            key = (counter, table)
+            self.counters[key] = self.counters.get(key, 0) + n
+
+    def add_gauges(self, name, read):
+        """Report read() (e.g. ANNUITY_FACTORS.stats) under `name` in every export."""
+        with self._lock:
+            self.gauges[name] = read
+
+    def reset(self):
+        with self._lock:
+            self.spans.clear()
+            self.counters.clear()
+
+    def to_dict(self):
+        with self._lock:
+            counters = {}
+            for (counter, table), n in sorted(self.counters.items()):
+                counters.setdefault(counter, {})[table] = n
+            data = {
+                "spans": {name: {"calls": c, "total_s": total, "mean_s": total / c, "max_s": slowest}
+                          for name, (c, total, slowest) in sorted(self.spans.items())},
+                "counters": counters,
+            }
+            gauges = sorted(self.gauges.items())
+        data["gauges"] = {name: read() for name, read in gauges}  # read() may take its own lock
+        return data
+
+    def to_prometheus(self):
+        data = self.to_dict()
+        lines = ["# HELP bank_span_seconds Time spent in instrumented calls.",
+                 "# TYPE bank_span_seconds summary"]
+        for name, span in data["spans"].items():
+            lines.append(f'bank_span_seconds_sum{{span="{name}"}} {span["total_s"]:.6f}')
+            lines.append(f'bank_span_seconds_count{{span="{name}"}} {span["calls"]}')
+        lines += ["# HELP bank_span_max_seconds Slowest single instrumented call.",
+                  "# TYPE bank_span_max_seconds gauge"]
+        for name, span in data["spans"].items():
+            lines.append(f'bank_span_max_seconds{{span="{name}"}} {span["max_s"]:.6f}')
+        for counter, tables in data["counters"].items():
+            lines += [f"# HELP bank_{counter}_total {counter.replace('_', ' ').capitalize()} (storage rows).",
+                      f"# TYPE bank_{counter}_total counter"]
+            for table, n in tables.items():
+                lines.append(f'bank_{counter}_total{{table="{table}"}} {n}')
+        for name, stats in data["gauges"].items():
+            lines += [f"# HELP bank_{name} {name.replace('_', ' ').capitalize()} statistics.",
+                      f"# TYPE bank_{name} gauge"]
+            for stat, value in stats.items():
+                lines.append(f'bank_{name}{{stat="{stat}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def export(self, path):
+        """Write JSON if path ends in .json, otherwise Prometheus text format."""
+        if path.endswith(".json"):
+            import json
+            text = json.dumps(self.to_dict(), indent=2)
+        else:
+            text = self.to_prometheus()
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(text)
+        os.replace(tmp, path)
+
+METRICS = Metrics()
+
+def _rows_read(table):
+    return (("rows_read", table, lambda args, result: len(result)),)
+
+def _rows_written(table, arg=1):
+    return (("rows_written", table, lambda args, result: len(args[arg])),)
+
+_ONE_LOAN_WRITTEN = (("rows_written", "loans", lambda args, result: 1),)
+
+# Storage methods carry the row counters; the module-level wrappers and service
+# calls above them only get spans, so rows are counted once.
+_STORAGE_SPANS = {
+    "load_users": _rows_read("users"),
+    "write_users": _rows_written("users"),
+    "record_user_changes": _rows_written("users"),
+    "commit_decisions": _rows_written("loans") + _rows_written("users", 2),
+    "append_loan": _ONE_LOAN_WRITTEN,
+    "load_loans": _rows_read("loans"),
+    "update_loan_status": _ONE_LOAN_WRITTEN,
+    "compact": (),
+    "reserve_loan_ids": (),
+    "open_snapshot": (),
+    "write_snapshot": (),
+}
+_INSTRUMENTED_FUNCTIONS = ["load_users_to_dict", "write_users_from_dict", "append_loan_record",
+                           "append_loan_records", "load_loans",
+                           "update_loan_status", "compact_loans", "reserve_loan_ids", "next_loan_id",
+                           "import_csv_to_sqlite", "hash_password", "verify_password"]
+_INSTRUMENTED_METHODS = [
+    (CsvStorage, _STORAGE_SPANS), (SqliteStorage, _STORAGE_SPANS),
+    # returns the rows it wrote (0 if the snapshot was stale)
+    (CsvStorage, {"_compact_users": (("rows_written", "users", lambda args, result: result),)}),
+    (UserStore, {"reload": ()}), (LoanRepository, {"reload": (), "decide": ()}),
+    (LoanService, {name: () for name in ("create_account", "check_login", "reset_password", "quote", "submit",
+                                         "import_applications", "find_loans", "decide", "screen_pending",
+                                         "apply_screening")}),
+    (BankApp, {name: () for name in ("create_welcome_screen", "open_client_dashboard", "open_loan_application",
+                                     "open_admin_dashboard")}),
+]
+
+def _timed(name, fn, rows=()):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            METRICS.observe(name, time.perf_counter() - started)
+        for counter, table, n in rows:
+            METRICS.count(counter, table, n(args, result))
+        return result
+    return wrapper
+
+def enable_metrics(export_path=None):
+    """Start recording spans and row counters; export to export_path at exit.
+
+    Instrumentation is installed by wrapping the functions and methods listed
+    above in place, so with metrics off nothing is wrapped and the hot paths
+    run exactly as written.
+    """
+    if not METRICS.enabled:
+        METRICS.enabled = True
+        METRICS.add_gauges("annuity_factors", ANNUITY_FACTORS.stats)
+        module = globals()
+        for name in _INSTRUMENTED_FUNCTIONS:
+            module[name] = _timed(name, module[name])
+        for cls, methods in _INSTRUMENTED_METHODS:
+            for name, rows in methods.items():
+                setattr(cls, name, _timed(f"{cls.__name__}.{name}", getattr(cls, name), rows))
+    if export_path:
+        import atexit
+        atexit.register(METRICS.export, export_path)
+    return METRICS
+
+@contextmanager
+def profile_session(path):
+    """Run the block under cProfile and dump pstats to path (no-op when path is None).
+
+    Inspect with `python -m pstats <path>`.
+    """
+    if not path:
+        yield
+        return
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield profiler
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+# -----------------------------
+# Local HTTP/JSON API (asyncio)
+# -----------------------------
+class ApiError(Exception):
+    """An error response: HTTP status plus a message for the JSON body."""
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class LoanApiServer:
+    """asyncio HTTP/JSON front end to one LoanService, for local clients.
+
+    Routes (JSON in and out; after login send "Authorization: Bearer <token>"):
+
+      POST /accounts        {username, password, email?, income?} -> new client
+      POST /login           {username, password, user_type?}      -> {token}
+      POST /quote           {loan_type, amount, term_years, income?}
+      POST /loans           as /quote, plus accept_over_ratio?    -> pending loan
+      GET  /loans/pending   ?type&user&min_amount&max_amount&sort&descending&offset&limit (admin)
+      POST /loans/approve   {ids: [...]} (admin); /loans/reject likewise
+
+    The checks are the ones the GUI dialogs use (LoanService.quote and
+    friends). Reads run on the event loop against the in-memory state.
+    Every mutation goes through one writer task, which applies everything
+    queued as a group and persists it through a StorageWriter: one batch()
+    and one fsync per group. Responses go out once their group is on disk.
+    A request whose write failed gets a 503, and memory is reloaded from
+    the files. Password hashing, the idle sync's reads and reloads run on
+    other threads, so the event loop never waits on the disk or a KDF.
+    """
+    def __init__(self, host=API_HOST, port=API_PORT, service=None):
+        self.host = host
+        self.port = port
+        self.service = service  # loaded by serve() when not given
+        self.writer = None
+        self.sessions = OrderedDict()  # token -> (username, user_type, last used), least recent first
+        self.groups = 0
+        self.mutations = 0
+        self._queue = None
+        self._routes = {
+            ("POST", "/accounts"): self.create_account,
+            ("POST", "/login"): self.login,
+            ("POST", "/quote"): self.quote,
+            ("POST", "/loans"): self.apply,
+            ("GET", "/loans/pending"): self.list_pending,
+            ("POST", "/loans/approve"): lambda headers, body, query: self.decide(headers, body, "approved"),
+            ("POST", "/loans/reject"): lambda headers, body, query: self.decide(headers, body, "rejected"),
+        }
+
+    async def serve(self, ready=None):
+        """Serve until cancelled; ready(server) is called once listening."""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        self.writer = StorageWriter(on_error=lambda e: print(f"storage write failed: {e!r}", file=sys.stderr))
+        if self.service is None:
+            self.service = LoanService()
+        self.service.users.writer = self.service.loans.writer = self.writer
+        self.service.hasher = PasswordHasher(dispatch=loop.call_soon_threadsafe)
+        self._queue = asyncio.Queue()
+        writer_task = asyncio.create_task(self._write_loop())
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        if ready is not None:
+            ready(server)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            writer_task.cancel()
+            self.writer.flush()
+            self.service.hasher.shutdown()
+            get_storage().wait_for_compaction()
+
+    # --- single writer ---
+    async def _mutate(self, apply):
+        """Queue apply(on_done) for the writer task; returns its result once persisted."""
+        future = _loop_future()
+        await self._queue.put((apply, future))
+        return await future
+
+    def _mutate_later(self, apply):
+        """Queue apply(on_done) for the writer task without waiting for it; a failure is only logged."""
+        future = _loop_future()
+        future.add_done_callback(lambda f: f.exception() is None or print(
+            f"background write failed: {f.exception()!r}", file=sys.stderr))
+        self._queue.put_nowait((apply, future))
+
+    async def _hash(self, fn, *args):
+        """fn(*args) (hash_password / verify_password) on the service's hasher threads."""
+        future = _loop_future()
+        self.service.hasher.submit(fn, *args, on_done=lambda result: future.done() or future.set_result(result),
+                                   on_error=lambda e: future.done() or future.set_exception(e))
+        return await future
+
+    async def _write_loop(self):
+        import asyncio
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                group = [await asyncio.wait_for(self._queue.get(), API_SYNC_SECONDS)]
+            except asyncio.TimeoutError:
+                try:
+                    await self._sync()  # idle: pick up other processes' writes
+                except OSError as e:
+                    print(f"sync failed: {e!r}", file=sys.stderr)
+                continue
+            while len(group) < API_MAX_BATCH and not self._queue.empty():
+                group.append(self._queue.get_nowait())
+            applied = []
+            for apply, future in group:
+                if future.done():
+                    continue  # the request was cancelled (client gone) while queued
+                persisted = []
+                try:
+                    # applied here on the event loop; the StorageWriter thread does the disk write
+                    result = apply(functools.partial(persisted.append, True))
+                except Exception as e:
+                    future.set_exception(e)
+                else:
+                    applied.append((future, result, persisted))
+            if not applied:
+                continue
+            # FIFO: this runs after every write above, and after their on_done callbacks
+            flushed = loop.create_future()
+            self.writer.submit(lambda: None, on_done=lambda: loop.call_soon_threadsafe(
+                lambda: flushed.done() or flushed.set_result(None)))
+            await flushed
+            self.groups += 1
+            self.mutations += len(applied)
+            failed = False
+            for future, result, persisted in applied:
+                if future.done():
+                    failed = failed or not persisted
+                elif persisted:
+                    future.set_result(result)
+                else:
+                    failed = True
+                    future.set_exception(ApiError(503, "The change could not be saved; please retry."))
+            if failed:
+                await self._reload()  # memory ran ahead of the failed write
+
+    async def _sync(self):
+        """LoanService.sync() with the store read on an executor thread; applied here, on the loop."""
+        import asyncio
+        read = await asyncio.get_running_loop().run_in_executor(None, self.service.read_changes)
+        if read[2]["reload"]:
+            await self._reload()  # another process compacted
+        else:
+            self.service.apply_read(read)
+
+    async def _reload(self):
+        """Load a fresh LoanService on an executor thread and swap it in; reads keep using the old one meanwhile."""
+        import asyncio
+        old = self.service
+        self.service = await asyncio.get_running_loop().run_in_executor(
+            None, lambda: LoanService(writer=self.writer, hasher=old.hasher))
+        self.service.conflicts = old.conflicts
+
+    # --- handlers ---
+    def _session(self, headers, user_type=None):
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        session = self.sessions.get(token) if scheme.lower() == "bearer" else None
+        now = time.monotonic()
+        if session is not None and now - session[2] > API_SESSION_SECONDS:
+            del self.sessions[token]
+            session = None
+        if session is None:
+            raise ApiError(401, "Log in first.")
+        if user_type is not None and session[1] != user_type:
+            raise ApiError(403, f"Only {user_type} accounts can do that.")
+        self.sessions[token] = session[:2] + (now,)
+        self.sessions.move_to_end(token)
+        return session[:2]
+
+    def _add_session(self, token, username, user_type):
+        """Remember a login, dropping expired tokens and then the least recently used past API_MAX_SESSIONS."""
+        now = time.monotonic()
+        self.sessions[token] = (username, user_type, now)
+        while self.sessions:
+            oldest, (_, _, used) = next(iter(self.sessions.items()))
+            if now - used <= API_SESSION_SECONDS and len(self.sessions) <= API_MAX_SESSIONS:
+                break
+            del self.sessions[oldest]
+
+    async def create_account(self, headers, body, query):
+        username, password = str(body["username"]), str(body["password"])
+        email, income = str(body.get("email", "")), float(body.get("income", 0.0))
+        self.service._check_new_account(username, password, "client")
+        password_hash = await self._hash(hash_password, password)
+        await self._mutate(lambda on_done: self.service.create_hashed_account(
+            username, password_hash, email, income, "client", on_done))
+        return 201, {"username": username}
+
+    async def login(self, headers, body, query):
+        import secrets
+        username, password = str(body["username"]), str(body["password"])
+        user_type = body.get("user_type", "client")
+        future = _loop_future()
+        # a rehash on login is a write too, so it goes through the writer task
+        self.service.check_login_async(
+            username, password, user_type, on_done=lambda: future.set_result(None), on_error=future.set_exception,
+            upgrade=lambda password_hash: self._mutate_later(
+                lambda on_done: self.service.set_password_hash(username, password_hash, on_done)))
+        await future
+        token = secrets.token_urlsafe(24)
+        self._add_session(token, username, user_type)
+        return 200, {"token": token, "username": username, "user_type": user_type}
+
+    def _quote(self, username, body):
+        income = body.get("income")
+        income = float(self.service.users[username]["income"] if income is None else income)
+        return self.service.quote(body["loan_type"], float(body["amount"]), float(body["term_years"]), income,
+                                  username)
+
+    async def quote(self, headers, body, query):
+        username, _ = self._session(headers, "client")
+        return 200, self._quote(username, body)
+
+    async def apply(self, headers, body, query):
+        username, _ = self._session(headers, "client")
+        self._quote(username, body)  # reject bad input before queueing
+
+        def submit(on_done):
+            # quoted again by the writer, so the debt check sees loans approved meanwhile
+            quote = self._quote(username, body)
+            if quote["over_debt_ratio"] and not body.get("accept_over_ratio"):
+                raise ApiError(422, "Monthly payments (with existing approved loans) exceed 50% of income; "
+                                    "send accept_over_ratio to apply anyway.")
+            return dict(self.service.submit(username, quote, on_done=on_done))
+        return 201, await self._mutate(submit)
+
+    async def list_pending(self, headers, body, query):
+        self._session(headers, "admin")
+        get = lambda name: query.get(name, [None])[0]
+        sort = get("sort") or "id"
+        if sort not in LOAN_FIELDS:
+            raise ValidationError(f"Can't sort by {sort!r}.")
+        offset, limit = int(get("offset") or 0), int(get("limit") or ADMIN_PAGE_SIZE)
+        rows = self.service.find_loans(
+            "pending", username=get("user"), loan_type=get("type"),
+            min_amount=float(get("min_amount")) if get("min_amount") else None,
+            max_amount=float(get("max_amount")) if get("max_amount") else None,
+            sort_by=sort, descending=get("descending") in ("1", "true"))
+        return 200, {"total": len(rows), "offset": offset, "loans": [dict(l) for l in rows[offset:offset + limit]],
+                     "summary": self.service.portfolio_summary()}
+
+    async def decide(self, headers, body, status):
+        self._session(headers, "admin")
+        ids = [str(i) for i in body["ids"]]
+
+        def decide(on_done):
+            changed = self.service.decide(ids, status, on_done=on_done)
+            if not changed:
+                raise ApiError(409, "Loan not found, or already decided elsewhere.")
+            return [l["id"] for l in changed]
+        return 200, {status: await self._mutate(decide)}
+
+    # --- HTTP ---
+    async def _respond(self, method, target, headers, body):
+        import json
+        from urllib.parse import parse_qs, urlsplit
+        url = urlsplit(target)
+        handler = self._routes.get((method, url.path))
+        try:
+            if handler is None:
+                known = any(path == url.path for _, path in self._routes)
+                raise ApiError(405 if known else 404, f"No route for {method} {url.path}.")
+            payload = json.loads(body) if body else {}
+            if not isinstance(payload, dict):
+                raise ApiError(400, "Expected a JSON object.")
+            return await handler(headers, payload, parse_qs(url.query))
+        except ApiError as e:
+            return e.status, {"error": str(e)}
+        except ValidationError as e:
+            return 400, {"error": str(e)}
+        except StaleWriteError as e:
+            return 409, {"error": str(e)}
+        except KeyError as e:
+            return 400, {"error": f"Missing field {e}."}
+        except (TypeError, ValueError) as e:
+            return 400, {"error": str(e)}
+
+    async def _handle(self, reader, writer):
+        """One keep-alive connection: read requests (Content-Length bodies) and answer in order."""
+        import asyncio
+        import json
+        from http import HTTPStatus
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length") or 0))
+                status, payload = await self._respond(method, target, headers, body)
+                data = json.dumps(payload).encode()
+                keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                head = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}", "Content-Type: application/json",
+                        f"Content-Length: {len(data)}"]
+                if not keep_alive:
+                    head.append("Connection: close")
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass  # client went away or sent something that isn't HTTP
+        finally:
+            writer.close()
+
+def _loop_future():
+    import asyncio
+    return asyncio.get_running_loop().create_future()
+
+def serve_api(host=API_HOST, port=API_PORT, service=None):
+    """Run a LoanApiServer until interrupted."""
+    import asyncio
+    server = LoanApiServer(host, port, service)
+    try:
+        asyncio.run(server.serve(lambda s: print(f"serving on http://{host}:{port}", file=sys.stderr)))
+    except KeyboardInterrupt:
+        pass
+    return server
+
+# -----------------------------
+# Command line (headless)
+# -----------------------------
+def _add_loan_filters(parser):
+    parser.add_argument("--user", dest="username")
+    parser.add_argument("--type", dest="loan_type", choices=list(LOAN_OPTIONS))
+    parser.add_argument("--min-amount", type=float)
+    parser.add_argument("--max-amount", type=float)
+
+def _cmd_create_account(service, args):
+    password = args.password
+    if password is None:
+        import getpass
+        password = getpass.getpass("Password: ")
+    service.create_account(args.username, password, args.email, args.income, args.user_type)
+    print(f"Account '{args.username}' created as {args.user_type}")
+
+def _cmd_import_applications(service, args):
+    """Stream applications (CSV or JSONL with IMPORT_FIELDS) in; rejects go to a CSV with the reason."""
+    rejects_path = args.rejects or args.file + ".rejects.csv"
+    with open(rejects_path, "w", newline="") as out:
+        writer = csv.writer(out)
+        writer.writerow(["line", "reason"] + IMPORT_FIELDS)
+
+        def reject(line_no, record, reason):
+            fields = record if isinstance(record, dict) else {}
+            writer.writerow([line_no, reason] + [fields.get(k, "") for k in IMPORT_FIELDS])
+
+        stats = service.import_applications(read_applications(args.file), args.allow_over_ratio, reject,
+                                            args.chunk_size, index=False)
+    print(f"{stats['imported']} application(s) submitted, {stats['rejected']} rejected ({rejects_path}); "
+          f"{stats['read']} rows in {stats['seconds']:.2f}s, {stats['rows_per_s']:,.0f} rows/s")
+
+def _cmd_decide(service, args):
+    matched = service.find_loans("pending", args.username, args.loan_type, args.min_amount, args.max_amount)
+    if args.dry_run:
+        print(f"{len(matched)} pending loan(s) would be {args.decision}")
+        return
+    changed = service.decide([l["id"] for l in matched], args.decision)
+    print(f"{len(changed)} loan(s) {args.decision}")
+
+def _cmd_export(service, args):
+    loans = service.find_loans(args.status, args.username, args.loan_type, args.min_amount, args.max_amount)
+    out = sys.stdout if args.file == "-" else open(args.file, "w", newline="")
+    try:
+        writer = csv.DictWriter(out, fieldnames=LOAN_FIELDS)
+        writer.writeheader()
+        for l in loans:
+            writer.writerow({k: l[k] for k in LOAN_FIELDS})
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if out is not sys.stdout:
+        print(f"{len(loans)} loan(s) exported to {args.file}")
+
+def _cmd_report(service, args):
+    """Print counts and totals per status and loan type (from the running aggregates)."""
+    print(f"{'status':<10} {'loan type':<15} {'count':>8} {'amount':>16} {'monthly':>14}")
+    for (status, loan_type), t in sorted(service.loans.aggregates.summary().items()):
+        print(f"{status:<10} {loan_type:<15} {t['count']:>8} {t['amount']:>16,.2f} {t['monthly']:>14,.2f}")
+    if args.verify:
+        mismatched = service.loans.verify_aggregates(from_storage=True)
+        for table, key in mismatched:
+            print(f"aggregate mismatch: {table} {key}", file=sys.stderr)
+        print("aggregates consistent with storage" if not mismatched else f"{len(mismatched)} aggregate mismatch(es)")
+
+def _cmd_bench_password(service, args):
+    costs = [int(c) for c in args.costs.split(",")] if args.costs else [DEFAULT_PASSWORD_COSTS[args.scheme] // 4,
+                                                                          DEFAULT_PASSWORD_COSTS[args.scheme],
+                                                                          DEFAULT_PASSWORD_COSTS[args.scheme] * 2]
+    print(f"{'scheme':<14} {'cost':>10} {'logins/s':>10} {'logins/s x' + str(args.workers):>14}")
+    for r in benchmark_password_costs(costs, args.scheme, args.seconds, args.workers):
+        print(f"{r['scheme']:<14} {r['cost']:>10} {r['logins_per_sec']:>10.1f} {r['logins_per_sec_pool']:>14.1f}")
+
+def _cmd_screen(service, args):
+    """Run the screening rules over the pending queue and commit the auto decisions."""
+    rules = DEFAULT_SCREENING_RULES
+    if args.rules:
+        import json
+        with open(args.rules) as f:
+            try:
+                rules = json.load(f)
+            except ValueError as e:
+                raise ValidationError(f"{args.rules} is not valid JSON: {e}") from None
+    result = service.screen_pending(compile_rules(rules), apply=not args.dry_run, audit_path=args.audit)
+    print(f"{'rule':<28} {'loans':>10}")
+    for name, count in result["by_rule"].items():
+        print(f"{name:<28} {count:>10,}")
+    print(f"{'(no rule fired)':<28} {result['screened'] - sum(result['by_rule'].values()):>10,}")
+    print(f"{result['approve']:,} auto-approve, {result['reject']:,} auto-reject, {result['manual']:,} manual review "
+          f"of {result['screened']:,} pending; rules evaluated in {result['evaluate_s']:.2f}s")
+    if args.dry_run:
+        print("dry run: nothing committed")
+    else:
+        audit = args.audit if get_storage().name == "csv" else "the screening_audit table"
+        print(f"{result['applied']:,} decision(s) committed in {result['seconds']:.2f}s; audit trail in {audit}")
+
+def _cmd_stress(service, args):
+    """Reprice the loan book under rate/term shocks; per-loan and flagged-borrower CSVs go to --out."""
+    scenarios = [parse_scenario(spec) for spec in args.scenarios or DEFAULT_STRESS_SCENARIOS]
+    result = stress_test(scenarios, args.out, service.loans, service.users, args.workers, args.chunk_size)
+    print(f"{'scenario':<16} {'loan type':<15} {'approved':>9} {'monthly':>14} {'change':>8} "
+          f"{'total interest':>16} {'change':>8}")
+    current = result["current"]
+    for scenario in result["scenarios"]:
+        for loan_type, t in sorted(scenario["by_type"].items()):
+            base = current[loan_type]
+            print(f"{scenario['name']:<16} {loan_type:<15} {t['count']:>9} {t['monthly']:>14,.2f} "
+                  f"{_percent_change(t['monthly'], base['monthly']):>8} {t['total_interest']:>16,.2f} "
+                  f"{_percent_change(t['total_interest'], base['total_interest']):>8}")
+        print(f"{scenario['name']:<16} {scenario['borrowers_over']} borrower(s) over 50% of income, "
+              f"{scenario['borrowers_pushed_over']} pushed over; {scenario['unpriced']} loan(s) unpriced")
+    print(f"{result['loans']:,} loans x {len(scenarios)} scenario(s) in {result['seconds']:.2f}s "
+          f"({result['loans_per_s']:,.0f} loans/s, {result['workers']} worker(s)) -> {args.out}")
+
+def _percent_change(new, old):
+    return f"{(new - old) / old:+.1%}" if old else "n/a"
+
+def _cmd_serve(service, args):
+    server = serve_api(args.host, args.port, service)
+    print(f"{server.mutations} change(s) saved in {server.groups} group commit(s)", file=sys.stderr)
+
+def _cmd_migrate_sqlite(service, args):
+    users, loans = import_csv_to_sqlite(args.db)
+    print(f"Imported {users} user(s) and {loans} loan(s) into {args.db or SQLITE_FILE}")
+
+def build_cli_parser():
+    import argparse  # only the CLI pays for argparse (and the re/enum imports behind it)
+    parser = argparse.ArgumentParser(prog="bank_app.py",
+                                     description="Headless bank loan operations. Run without arguments for the GUI.")
+    parser.add_argument("--timing", action="store_true", help="report cold-start timings on stderr")
+    parser.add_argument("--metrics", metavar="FILE", default=METRICS_FILE,
+                        help="record spans/row counters and write them here on exit (.json or Prometheus text)")
+    parser.add_argument("--profile", metavar="FILE", default=PROFILE_FILE, help="dump cProfile stats for the run")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("create-account", help="create a client or admin account")
+    p.add_argument("username")
+    p.add_argument("--email", default="")
+    p.add_argument("--income", type=float, default=0.0)
+    p.add_argument("--admin", dest="user_type", action="store_const", const="admin", default="client")
+    p.add_argument("--password", help="prompted for when omitted")
+    p.set_defaults(func=_cmd_create_account)
+
+    p = sub.add_parser("import-applications", help="submit loan applications from a CSV or JSONL file")
+    p.add_argument("file")
+    p.add_argument("--allow-over-ratio", action="store_true",
+                   help="accept applications whose payment exceeds 50%% of income")
+    p.add_argument("--rejects", metavar="FILE", help="where to write rejected rows (default: <file>.rejects.csv)")
+    p.add_argument("--chunk-size", type=int, default=IMPORT_CHUNK_SIZE)
+    p.set_defaults(func=_cmd_import_applications)
+
+    for name, decision in (("approve", "approved"), ("reject", "rejected")):
+        p = sub.add_parser(name, help=f"{name} every pending loan matching the filters")
+        _add_loan_filters(p)
+        p.add_argument("--dry-run", action="store_true")
+        p.set_defaults(func=_cmd_decide, decision=decision)
+
+    p = sub.add_parser("export", help="write matching loans as CSV ('-' for stdout)")
+    p.add_argument("file")
+    p.add_argument("--status")
+    _add_loan_filters(p)
+    p.set_defaults(func=_cmd_export)
+
+    p = sub.add_parser("report", help="loan counts and totals by status and type")
+    p.add_argument("--verify", action="store_true", help="rebuild the totals from storage and compare")
+    p.set_defaults(func=_cmd_report)
+
+    p = sub.add_parser("bench-password", help="logins per second at several KDF cost settings")
+    p.add_argument("--scheme", default=PASSWORD_SCHEME, choices=sorted(DEFAULT_PASSWORD_COSTS))
+    p.add_argument("--costs", help="comma-separated costs (iterations, or N for scrypt)")
+    p.add_argument("--seconds", type=float, default=1.0)
+    p.add_argument("--workers", type=int, default=HASH_WORKERS)
+    p.set_defaults(func=_cmd_bench_password)
+
+    p = sub.add_parser("screen", help="auto-approve/reject pending loans by rules; the rest stay for review")
+    p.add_argument("--rules", metavar="FILE", help="JSON list of rules (default: DEFAULT_SCREENING_RULES)")
+    p.add_argument("--audit", metavar="FILE", default=SCREENING_AUDIT_FILE, help="audit trail CSV to append to")
+    p.add_argument("--dry-run", action="store_true")
+    p.set_defaults(func=_cmd_screen)
+
+    p = sub.add_parser("stress", help="reprice every loan under rate/term shock scenarios")
+    p.add_argument("--scenario", dest="scenarios", action="append", metavar="SPEC",
+                   help='e.g. "+200bp", "housing=Housing Loan:+200bp" or "longer=term+5" (repeatable; '
+                        f'default: {" ".join(DEFAULT_STRESS_SCENARIOS)})')
+    p.add_argument("--out", default="stress", help="directory for loans.csv and borrowers.csv")
+    p.add_argument("--workers", type=int, help="processes (default: one per CPU)")
+    p.add_argument("--chunk-size", type=int, default=STRESS_CHUNK_SIZE)
+    p.set_defaults(func=_cmd_stress)
+
+    p = sub.add_parser("serve", help="local HTTP/JSON API (see LoanApiServer)")
+    p.add_argument("--host", default=API_HOST)
+    p.add_argument("--port", type=int, default=API_PORT)
+    p.set_defaults(func=_cmd_serve)
+
+    p = sub.add_parser("migrate-sqlite", help="copy the CSV data into a SQLite database")
+    p.add_argument("db", nargs="?")
+    p.set_defaults(func=_cmd_migrate_sqlite)
+    return parser
+
+def run_cli(argv):
+    args = build_cli_parser().parse_args(argv)
+    if args.metrics:
+        enable_metrics(args.metrics)
+    with profile_session(args.profile):
+        started = time.perf_counter()
+        ensure_files_exist(prompt_admin=False)
+        service = LoanService()
+        ready = time.perf_counter()
+        if args.timing:
+            print(f"cold start: import {(_IMPORT_DONE - _IMPORT_STARTED) * 1000:.1f} ms, "
+                  f"load {(ready - started) * 1000:.1f} ms ({len(service.users)} users, {len(service.loans)} loans)",
+                  file=sys.stderr)
+        try:
+            args.func(service, args)
+        except ValidationError as e:
+            print(f"error: {e}", file=sys.stderr)
+            return 1
+        finally:
+            get_storage().wait_for_compaction()
+    return 0
+
 # -----------------------------
 # App entrypoint
 # -----------------------------
-def main():
-    root = tk.Tk()
-    root.geometry("800x600")
-    app = BankApp(root)
-    root.mainloop()
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv:
+        return run_cli(argv)
+    if METRICS_FILE:
+        enable_metrics(METRICS_FILE)
+    with profile_session(PROFILE_FILE):
+        _load_tk()
+        root = tk.Tk()
+        root.geometry("800x600")
+        app = BankApp(root)
+        root.mainloop()
+    return 0
+
+_IMPORT_DONE = time.perf_counter()
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,674 @@
+# benchmark.py
+"""Synthetic data generator and benchmark suite for bank_app's data layer and quoting engine.
+
+    python benchmark.py generate --rows 1000000 --dir bench_data
+    python benchmark.py run --rows 1000000 --dir bench_data --output results.json
+    python benchmark.py run --dir bench_data --compare results.json
+    python benchmark.py memory --rows 1000000 --dir bench_data
+    python benchmark.py startup --rows 1000000 --dir bench_data
+    python benchmark.py stress --rows 1000000 --dir bench_data --workers 1,4,8
+    python benchmark.py hammer --processes 8 --seconds 10
+    python benchmark.py api --concurrency 64 --seconds 10
+
+`run` generates the dataset first if the directory has none. Results are
+written as JSON (throughput, p50/p99 latency, peak traced memory per
+operation) so runs from different versions can be compared. `hammer` runs
+several processes against one store and checks that no update was lost;
+`api` load-tests a `bank_app.py serve` instance over localhost.
+"""
+import argparse
+import asyncio
+import csv
+import json
+import multiprocessing
+import os
+import platform
+import random
+import signal
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import bank_app
+
+# -----------------------------
+# Synthetic data
+# -----------------------------
+DEFAULT_STATUS_MIX = {"pending": 0.2, "approved": 0.65, "rejected": 0.15}
+
+def parse_mix(text):
+    """"pending=0.2,approved=0.7" -> {"pending": 0.2, "approved": 0.7}"""
+    mix = {}
+    for part in text.split(","):
+        status, _, weight = part.partition("=")
+        mix[status.strip()] = float(weight)
+    return mix
+
+def generate_dataset(directory, rows, users=None, status_mix=None, seed=1):
+    """Write users.csv and loan_records.csv with `rows` loans, streaming in constant memory.
+
+    Every synthetic user shares one precomputed password hash (password
+    "password") so generating millions of users doesn't run the KDF per row.
+    """
+    rng = random.Random(seed)
+    users = users or max(1, rows // 10)
+    status_mix = status_mix or DEFAULT_STATUS_MIX
+    statuses, weights = list(status_mix), list(status_mix.values())
+    products = list(bank_app.LOAN_OPTIONS.items())
+    password_hash = bank_app.hash_password("password")
+    os.makedirs(directory, exist_ok=True)
+
+    with open(os.path.join(directory, bank_app.USERS_FILE), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(bank_app.USER_FIELDS)
+        writer.writerow(["admin", password_hash, "admin@example.com", "0", "admin", "0.0"])
+        for i in range(users):
+            income = round(rng.uniform(1500, 20000), 2)
+            writer.writerow([f"user{i}", password_hash, f"user{i}@example.com", income, "client", "0.0"])
+
+    with open(os.path.join(directory, bank_app.LOANS_FILE), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(bank_app.LOAN_FIELDS)
+        for loan_id in range(1, rows + 1):
+            loan_type, opt = rng.choice(products)
+            term = rng.randint(1, opt["max_term"])
+            amount = round(rng.uniform(1000, 500000 if loan_type == "Housing Loan" else 60000), 2)
+            monthly = bank_app.calculate_monthly_payment(amount, opt["rate"], term)
+            writer.writerow([loan_id, f"user{rng.randrange(users)}", loan_type, amount, opt["rate"], float(term),
+                             round(monthly, 2), round(bank_app.total_interest_paid(monthly, amount, term), 2),
+                             rng.choices(statuses, weights)[0]])
+
+    # start the id sequence after the generated loans; drop leftovers from earlier runs
+    with open(os.path.join(directory, bank_app.LOAN_ID_SEQ_FILE), "w") as f:
+        f.write(str(rows))
+    for name in (bank_app.LOAN_STATUS_LOG_FILE, bank_app.USER_JOURNAL_FILE, bank_app.USER_JOURNAL_FILE + ".1",
+                 bank_app.STORE_EPOCH_FILE, bank_app.LOAN_SNAPSHOT_FILE, bank_app.USER_SNAPSHOT_FILE):
+        path = os.path.join(directory, name)
+        if os.path.exists(path):
+            os.remove(path)
+    return {"rows": rows, "users": users + 1, "status_mix": status_mix, "seed": seed}
+
+# -----------------------------
+# Measurement
+# -----------------------------
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(q * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+def measure(name, fn, repeat, ops_per_call=1, trace_memory=True):
+    """Time `repeat` calls of fn(); a separate traced call reports peak memory.
+
+    fn may return how many operations it actually did (e.g. once the pending
+    queue runs dry); calls that did nothing are left out of the latencies.
+    """
+    latencies = []
+    ops = 0
+    for _ in range(repeat):
+        started = time.perf_counter()
+        done = fn()
+        elapsed = time.perf_counter() - started
+        done = done if type(done) is int else ops_per_call
+        if done:
+            ops += done
+            latencies.append(elapsed)
+    peak = None
+    if trace_memory:
+        tracemalloc.start()
+        fn()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    latencies.sort()
+    total = sum(latencies)
+    return {
+        "name": name,
+        "calls": len(latencies),
+        "ops": ops,
+        "total_s": total,
+        "throughput_ops_s": ops / total if total else None,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "peak_mem_mb": peak / 2**20 if peak is not None else None,
+    }
+
+def run_benchmarks(repeat=3, calls=1000):
+    """Benchmark the data layer and quoting engine against the files in the current directory."""
+    results = []
+    results.append(measure("load_users_to_dict", bank_app.load_users_to_dict, repeat))
+    results.append(measure("load_loans", bank_app.load_loans, repeat))
+    results.append(measure("LoanRepository()", bank_app.LoanRepository, repeat))
+    results.append(measure("next_loan_id", bank_app.next_loan_id, calls, trace_memory=False))
+
+    rng = random.Random(2)
+    products = list(bank_app.LOAN_OPTIONS.values())
+    quotes = []
+    for _ in range(calls):
+        opt = rng.choice(products)
+        quotes.append((rng.uniform(1000, 500000), opt["rate"], rng.randint(1, opt["max_term"])))
+    it = iter(quotes * 100)
+    results.append(measure("calculate_monthly_payment", lambda: bank_app.calculate_monthly_payment(*next(it)),
+                           calls * 100, trace_memory=False))
+    try:
+        bank_app._require_numpy()
+    except ImportError:
+        pass
+    else:
+        np = bank_app.np
+        P = np.array([q[0] for q in quotes] * 1000)
+        R = np.array([q[1] for q in quotes] * 1000)
+        T = np.array([q[2] for q in quotes] * 1000, dtype=float)
+        results.append(measure("batch_quote", lambda: bank_app.batch_quote(P, R, T), repeat, ops_per_call=len(P)))
+
+    service = bank_app.LoanService()
+    pending = iter([l["id"] for l in service.loans.with_status("pending")])
+    def decide_one():
+        loan_id = next(pending, None)
+        if loan_id is None:
+            return 0
+        service.decide([loan_id], rng.choice(["approved", "rejected"]))
+        return 1
+    results.append(measure("approve/reject (one loan)", decide_one, min(calls, 200), trace_memory=False))
+    def decide_batch():
+        batch = [loan_id for _, loan_id in zip(range(1000), pending)]
+        if batch:
+            service.decide(batch, "approved")
+        return len(batch)
+    results.append(measure("approve (batch of 1000)", decide_batch, repeat))
+    if not results[-1]["ops"]:
+        print("no pending loans left to decide; rerun with --regenerate", file=sys.stderr)
+    return results
+
+def _dict_loans():
+    """load_loans() as it was before LoanRecord: one dict per row, every string separate."""
+    loans = []
+    with open(bank_app.LOANS_FILE, newline="") as f:
+        for r in csv.DictReader(f):
+            for k in ("amount", "interest_rate", "term_years", "monthly_payment", "total_interest"):
+                r[k] = float(r[k])
+            loans.append(r)
+    return loans
+
+def _dict_users():
+    users = {}
+    with open(bank_app.USERS_FILE, newline="") as f:
+        for r in csv.DictReader(f):
+            users[r["username"]] = {"password_hash": r["password_hash"], "email": r["email"],
+                                    "income": float(r["income"] or 0.0), "user_type": r["user_type"],
+                                    "balance": float(r["balance"] or 0.0)}
+    return users
+
+def _retained(load):
+    """Bytes still allocated once load() has returned (what the result keeps alive)."""
+    tracemalloc.start()
+    result = load()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return len(result), retained
+
+def compare_memory():
+    """Resident size of loans and users as plain dicts vs LoanRecord/UserRecord."""
+    results = []
+    for name, old, new, path in (("loans", _dict_loans, bank_app.load_loans, bank_app.LOANS_FILE),
+                                 ("users", _dict_users, bank_app.load_users_to_dict, bank_app.USERS_FILE)):
+        rows, dict_bytes = _retained(old)
+        _, record_bytes = _retained(new)
+        results.append({"name": name, "rows": rows, "file_mb": os.path.getsize(path) / 2**20,
+                        "dict_mb": dict_bytes / 2**20, "record_mb": record_bytes / 2**20,
+                        "dict_bytes_per_row": dict_bytes / max(rows, 1),
+                        "record_bytes_per_row": record_bytes / max(rows, 1)})
+    return results
+
+# -----------------------------
+# Cold start
+# -----------------------------
+# run in a fresh interpreter: what BankApp.__init__ waits for, then the admin dashboard's first page
+_STARTUP_PROBE = """
+import json, time
+started = time.perf_counter()
+import bank_app
+service = bank_app.LoanService()
+ready = time.perf_counter()
+service.find_loans("pending", sort_by="id")[:bank_app.ADMIN_PAGE_SIZE]
+print(json.dumps({"ready_s": ready - started, "first_page_s": time.perf_counter() - ready}))
+"""
+
+def _startup(snapshot):
+    env = dict(os.environ, BANK_SNAPSHOT="1" if snapshot else "0",
+               PYTHONPATH=os.pathsep.join(filter(None, [os.path.dirname(os.path.abspath(bank_app.__file__)),
+                                                        os.environ.get("PYTHONPATH")])))
+    out = subprocess.run([sys.executable, "-c", _STARTUP_PROBE], env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout)
+
+def compare_startup(repeat=5):
+    """Cold-start times (new process each run; the OS file cache stays warm) from the CSVs vs the snapshot."""
+    for name in (bank_app.LOAN_SNAPSHOT_FILE, bank_app.USER_SNAPSHOT_FILE):
+        if os.path.exists(name):
+            os.remove(name)
+    results = []
+    for name, snapshot in (("csv", False), ("csv + write snapshot", True), ("snapshot", True)):
+        runs = [_startup(snapshot) for _ in range(1 if name == "csv + write snapshot" else repeat)]
+        results.append({"name": name, "runs": len(runs),
+                        "ready_s": _percentile(sorted(r["ready_s"] for r in runs), 0.5),
+                        "first_page_s": _percentile(sorted(r["first_page_s"] for r in runs), 0.5)})
+    return results
+
+# -----------------------------
+# Stress test scaling
+# -----------------------------
+def compare_stress(worker_counts, scenarios=None):
+    """stress_test throughput over the dataset at each pool size (loans loaded once up front)."""
+    scenarios = [bank_app.parse_scenario(s) for s in scenarios or bank_app.DEFAULT_STRESS_SCENARIOS]
+    loans = bank_app.load_loans()
+    users = bank_app.load_users_to_dict()
+    results = []
+    for workers in worker_counts:
+        r = bank_app.stress_test(scenarios, os.path.join("stress", str(workers)), loans, users, workers)
+        results.append({"workers": workers, "loans": r["loans"], "scenarios": len(scenarios),
+                        "seconds": r["seconds"], "loans_per_s": r["loans_per_s"]})
+    return results
+
+# -----------------------------
+# Multi-process hammer
+# -----------------------------
+def _hammer_worker(directory, seed, seconds, results):
+    """One `hammer` process: submit loans and approve/reject pending ones the others also see."""
+    os.chdir(directory)
+    rng = random.Random(seed)
+    service = bank_app.LoanService()
+    usernames = [u for u in service.users if u != "admin"]
+    log = {"submitted": [], "approved": [], "rejected": [], "latencies": [], "failed": 0}
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            pending = service.loans.with_status("pending")
+            if rng.random() < 0.3 or not pending:
+                quote = service.quote("Auto Loan", float(rng.randint(1000, 5000)), 3, 1e9)
+                log["submitted"].append(service.submit(rng.choice(usernames), quote)["id"])
+            else:
+                # a few loans at once, so commits also contend on the borrowers' balances
+                picks = [rng.choice(pending)["id"] for _ in range(rng.randint(1, 3))]
+                status = "approved" if rng.random() < 0.7 else "rejected"
+                log[status].extend(rec["id"] for rec in service.decide(picks, status))
+        except bank_app.StaleWriteError:
+            log["failed"] += 1  # still conflicting after CONFLICT_RETRIES; nothing was written
+        log["latencies"].append(time.perf_counter() - started)
+        if rng.random() < 0.05:
+            service.sync()
+    log["conflicts"] = service.conflicts
+    results.put(log)
+
+def verify_hammer(logs, initial_loans):
+    """Check the store against what the workers say they did; returns a list of problems."""
+    bank_app._storage = None  # read the store fresh
+    loans = {rec.id: rec for rec in bank_app.load_loans()}
+    users = bank_app.load_users_to_dict()
+    problems = []
+    submitted = [str(i) for log in logs for i in log["submitted"]]
+    if len(set(submitted)) != len(submitted):
+        problems.append(f"{len(submitted) - len(set(submitted))} loan id(s) handed out twice")
+    if len(loans) != initial_loans + len(submitted):
+        problems.append(f"expected {initial_loans + len(submitted)} loans, found {len(loans)}")
+    decided = {}
+    credited = {}
+    for log in logs:
+        for status in ("approved", "rejected"):
+            for loan_id in log[status]:
+                if loan_id in decided:
+                    problems.append(f"loan {loan_id} decided twice")
+                decided[loan_id] = status
+    for loan_id, rec in loans.items():
+        expected = decided.get(loan_id, "pending")
+        if rec.status != expected:
+            problems.append(f"loan {loan_id} is {rec.status}, expected {expected}")
+        if expected == "approved":
+            credited[rec.username] = credited.get(rec.username, 0.0) + rec.amount
+    for username, meta in users.items():
+        if abs(meta["balance"] - credited.get(username, 0.0)) > 0.005:
+            problems.append(f"{username} balance {meta['balance']:.2f}, approved loans sum to "
+                            f"{credited.get(username, 0.0):.2f}")
+    return problems
+
+def run_hammer(directory, processes, seconds, seed=1):
+    """Run `processes` workers for `seconds` against the dataset in `directory` and verify the result."""
+    initial_loans = sum(1 for _ in open(bank_app.LOANS_FILE)) - 1
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    workers = [context.Process(target=_hammer_worker, args=(directory, seed + i, seconds, results))
+               for i in range(processes)]
+    started = time.perf_counter()
+    for w in workers:
+        w.start()
+    logs = [results.get() for _ in workers]
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - started
+    latencies = sorted(t for log in logs for t in log["latencies"])
+    return {
+        "processes": processes,
+        "seconds": elapsed,
+        "ops": len(latencies),
+        "throughput_ops_s": len(latencies) / elapsed,
+        "p50_ms": _percentile(latencies, 0.50) * 1000,
+        "p99_ms": _percentile(latencies, 0.99) * 1000,
+        "submitted": sum(len(log["submitted"]) for log in logs),
+        "decided": sum(len(log["approved"]) + len(log["rejected"]) for log in logs),
+        "conflicts_retried": sum(log["conflicts"] for log in logs),
+        "failed_after_retries": sum(log["failed"] for log in logs),
+        "problems": verify_hammer(logs, initial_loans),
+    }
+
+# -----------------------------
+# HTTP API load test
+# -----------------------------
+class _ApiClient:
+    """One keep-alive HTTP/1.1 connection to the API (just enough HTTP for bank_app's server)."""
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.token = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def call(self, method, path, body=None):
+        data = json.dumps(body).encode() if body is not None else b""
+        head = [f"{method} {path} HTTP/1.1", f"Host: {self.host}", f"Content-Length: {len(data)}"]
+        if self.token:
+            head.append(f"Authorization: Bearer {self.token}")
+        self.writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + data)
+        status = int((await self.reader.readline()).split()[1])
+        length = 0
+        while True:
+            line = await self.reader.readline()
+            if not line.strip():
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            if name.lower() == "content-length":
+                length = int(value)
+        return status, json.loads(await self.reader.readexactly(length))
+
+    async def login(self, username, user_type="client"):
+        status, reply = await self.call("POST", "/login", {"username": username, "password": "password",
+                                                           "user_type": user_type})
+        if status != 200:
+            raise RuntimeError(f"login as {username} failed: {reply}")
+        self.token = reply["token"]
+
+async def _api_client(client, rng, deadline, samples):
+    """A borrower: mostly quotes, some applications."""
+    while time.perf_counter() < deadline:
+        loan_type, opt = rng.choice(list(bank_app.LOAN_OPTIONS.items()))
+        body = {"loan_type": loan_type, "amount": round(rng.uniform(1000, 50000), 2),
+                "term_years": rng.randint(1, opt["max_term"])}
+        route = ("POST", "/loans") if rng.random() < 0.3 else ("POST", "/quote")
+        if route[1] == "/loans":
+            body["accept_over_ratio"] = True
+        started = time.perf_counter()
+        status, _ = await client.call(*route, body)
+        samples.append((" ".join(route), status, time.perf_counter() - started))
+    client.writer.close()
+
+async def _api_admin(client, rng, deadline, samples):
+    """The admin: page through pending loans and approve or reject a few from each page."""
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        status, page = await client.call("GET", "/loans/pending?limit=50&sort=amount&descending=1")
+        samples.append(("GET /loans/pending", status, time.perf_counter() - started))
+        ids = [l["id"] for l in page.get("loans", [])[:5]]
+        if ids:
+            route = ("POST", "/loans/approve") if rng.random() < 0.7 else ("POST", "/loans/reject")
+            started = time.perf_counter()
+            status, _ = await client.call(*route, {"ids": ids})
+            samples.append((" ".join(route), status, time.perf_counter() - started))
+    client.writer.close()
+
+def _summarize(latencies, seconds):
+    latencies.sort()
+    return {"requests": len(latencies), "rps": len(latencies) / seconds,
+            "p50_ms": _percentile(latencies, 0.50) * 1000, "p95_ms": _percentile(latencies, 0.95) * 1000,
+            "p99_ms": _percentile(latencies, 0.99) * 1000}
+
+def run_api_load(host, port, concurrency, seconds, users, seed=1):
+    """`concurrency` borrower connections plus one admin for `seconds`; throughput and latency per route."""
+    async def connect(username, user_type="client"):
+        client = _ApiClient(host, port)
+        await client.connect()
+        await client.login(username, user_type)
+        return client
+
+    async def main():
+        rng = random.Random(seed)
+        samples = []
+        # log everyone in (one KDF each) before the clock starts
+        clients = await asyncio.gather(*[connect(f"user{rng.randrange(users)}") for _ in range(concurrency)])
+        admin = await connect("admin", "admin")
+        started = time.perf_counter()
+        deadline = started + seconds
+        await asyncio.gather(*[_api_client(c, random.Random(rng.random()), deadline, samples) for c in clients],
+                             _api_admin(admin, random.Random(rng.random()), deadline, samples))
+        return samples, time.perf_counter() - started
+
+    samples, elapsed = asyncio.run(main())
+    routes = {}
+    for route, status, latency in samples:
+        routes.setdefault(route, []).append(latency)
+    errors = {}
+    for route, status, _ in samples:
+        if status >= 400:
+            errors[f"{route} {status}"] = errors.get(f"{route} {status}", 0) + 1
+    result = {"concurrency": concurrency, "seconds": elapsed,
+              "total": _summarize([latency for _, _, latency in samples], elapsed),
+              "routes": {route: _summarize(latencies, elapsed) for route, latencies in sorted(routes.items())},
+              "errors": errors}
+    return result
+
+def _wait_for_port(host, port, proc, timeout=120.0):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError(f"server exited: {proc.stderr.read()}")
+        try:
+            socket.create_connection((host, port), timeout=1.0).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("server did not start listening")
+
+def run_api_benchmark(directory, port, concurrency, seconds, users, seed=1):
+    """Start `bank_app.py serve` on the dataset in `directory`, load-test it, then stop it."""
+    host = "127.0.0.1"
+    proc = subprocess.Popen([sys.executable, os.path.abspath(bank_app.__file__), "serve", "--host", host,
+                             "--port", str(port)], cwd=directory, stderr=subprocess.PIPE, text=True)
+    try:
+        _wait_for_port(host, port, proc)
+        result = run_api_load(host, port, concurrency, seconds, users, seed)
+    finally:
+        proc.send_signal(signal.SIGINT)
+        _, server_log = proc.communicate(timeout=60)
+    result["server"] = server_log.strip().splitlines()[-1] if server_log.strip() else ""
+    return result
+
+# -----------------------------
+# Reporting
+# -----------------------------
+def print_results(results, baseline=None):
+    base = {r["name"]: r for r in (baseline or {}).get("results", [])}
+    header = f"{'operation':<28} {'ops/s':>14} {'p50 ms':>10} {'p99 ms':>10} {'peak MB':>9}"
+    print(header + ("  vs baseline" if base else ""))
+    for r in results:
+        peak = f"{r['peak_mem_mb']:.1f}" if r["peak_mem_mb"] is not None else "-"
+        line = f"{r['name']:<28} {r['throughput_ops_s'] or 0:>14,.0f} {r['p50_ms']:>10.3f} {r['p99_ms']:>10.3f} {peak:>9}"
+        old = base.get(r["name"])
+        if old and old.get("throughput_ops_s") and r["throughput_ops_s"]:
+            line += f"  {r['throughput_ops_s'] / old['throughput_ops_s']:.2f}x"
+        print(line)
+
+def print_memory(results):
+    print(f"{'table':<8} {'rows':>10} {'file MB':>9} {'dicts MB':>9} {'records MB':>11} {'B/row':>13} {'saving':>7}")
+    for r in results:
+        print(f"{r['name']:<8} {r['rows']:>10,} {r['file_mb']:>9.1f} {r['dict_mb']:>9.1f} {r['record_mb']:>11.1f} "
+              f"{r['dict_bytes_per_row']:>6.0f}->{r['record_bytes_per_row']:<6.0f} "
+              f"{1 - r['record_mb'] / r['dict_mb']:>7.0%}")
+
+def print_startup(results):
+    base = results[0]["ready_s"] + results[0]["first_page_s"]
+    print(f"{'start from':<22} {'ready s':>9} {'first page s':>13} {'speedup':>8}")
+    for r in results:
+        total = r["ready_s"] + r["first_page_s"]
+        print(f"{r['name']:<22} {r['ready_s']:>9.3f} {r['first_page_s']:>13.3f} {base / total:>7.1f}x")
+
+def print_stress(results):
+    base = results[0]["loans_per_s"]
+    print(f"{'workers':>7} {'loans':>10} {'seconds':>9} {'loans/s':>12} {'speedup':>8}")
+    for r in results:
+        print(f"{r['workers']:>7} {r['loans']:>10,} {r['seconds']:>9.2f} {r['loans_per_s']:>12,.0f} "
+              f"{r['loans_per_s'] / base:>7.2f}x")
+
+def print_api(result):
+    print(f"{'route':<22} {'requests':>9} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, r in list(result["routes"].items()) + [("all", result["total"])]:
+        print(f"{route:<22} {r['requests']:>9,} {r['rps']:>9,.0f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} "
+              f"{r['p99_ms']:>8.2f}")
+    for key, count in sorted(result["errors"].items()):
+        print(f"error responses: {key}: {count}")
+    print(f"{result['concurrency']} connections + 1 admin for {result['seconds']:.1f}s; server: {result['server']}")
+
+def print_hammer(result):
+    print(f"{result['processes']} processes, {result['seconds']:.1f}s: {result['ops']:,} ops "
+          f"({result['throughput_ops_s']:,.0f} ops/s, p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms)")
+    print(f"submitted {result['submitted']:,}, decided {result['decided']:,}, "
+          f"conflicts retried {result['conflicts_retried']:,}, failed after retries {result['failed_after_retries']:,}")
+    for problem in result["problems"][:20]:
+        print("LOST UPDATE:", problem)
+    print(f"lost updates: {len(result['problems'])}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+    for name in ("generate", "run", "memory", "startup", "stress"):
+        p = sub.add_parser(name)
+        p.add_argument("--dir", default="bench_data", help="dataset directory (default: bench_data)")
+        p.add_argument("--rows", type=int, default=10000, help="number of loans to generate")
+        p.add_argument("--users", type=int, help="number of users (default: rows / 10)")
+        p.add_argument("--status-mix", type=parse_mix, help="e.g. pending=0.2,approved=0.7,rejected=0.1")
+        p.add_argument("--seed", type=int, default=1)
+    sub.choices["memory"].add_argument("--output", help="write results as JSON here")
+    sub.choices["startup"].add_argument("--repeat", type=int, default=5, help="cold starts per variant")
+    sub.choices["startup"].add_argument("--output", help="write results as JSON here")
+    sub.choices["stress"].add_argument("--workers", default=f"1,2,{os.cpu_count() or 1}",
+                                       help="comma-separated pool sizes to compare")
+    sub.choices["stress"].add_argument("--scenario", dest="scenarios", action="append",
+                                       help="bank_app.py stress scenario (repeatable)")
+    sub.choices["stress"].add_argument("--output", help="write results as JSON here")
+    run = sub.choices["run"]
+    run.add_argument("--regenerate", action="store_true", help="rebuild the dataset even if one exists")
+    run.add_argument("--repeat", type=int, default=3, help="timed calls for whole-file operations")
+    run.add_argument("--calls", type=int, default=1000, help="timed calls for per-request operations")
+    run.add_argument("--output", help="write results as JSON here")
+    run.add_argument("--compare", help="JSON from an earlier run to compare throughput against")
+    hammer = sub.add_parser("hammer", help="concurrent processes on one store; checks for lost updates")
+    hammer.add_argument("--dir", default=os.path.join("bench_data", "hammer"), help="scratch directory (regenerated)")
+    hammer.add_argument("--rows", type=int, default=2000, help="pending loans to start with")
+    hammer.add_argument("--users", type=int, default=20, help="borrowers (few, so balances contend)")
+    hammer.add_argument("--processes", type=int, default=4)
+    hammer.add_argument("--seconds", type=float, default=5.0)
+    hammer.add_argument("--seed", type=int, default=1)
+    hammer.add_argument("--output", help="write results as JSON here")
+    api = sub.add_parser("api", help="load-test `bank_app.py serve` over localhost")
+    api.add_argument("--dir", default=os.path.join("bench_data", "api"), help="scratch directory (regenerated)")
+    api.add_argument("--rows", type=int, default=20000, help="loans to start with")
+    api.add_argument("--users", type=int, default=1000)
+    api.add_argument("--port", type=int, default=8765)
+    api.add_argument("--concurrency", type=int, default=32, help="borrower connections")
+    api.add_argument("--seconds", type=float, default=10.0)
+    api.add_argument("--seed", type=int, default=1)
+    api.add_argument("--output", help="write results as JSON here")
+    args = parser.parse_args(argv)
+
+    directory = os.path.abspath(args.dir)
+    output = os.path.abspath(args.output) if getattr(args, "output", None) else None
+    compare = os.path.abspath(args.compare) if getattr(args, "compare", None) else None
+    dataset = None
+    if args.command == "hammer":
+        generate_dataset(directory, args.rows, args.users, {"pending": 1.0}, args.seed)
+        os.chdir(directory)
+        if bank_app.STORAGE_BACKEND == "sqlite":
+            if os.path.exists(bank_app.SQLITE_FILE):
+                os.remove(bank_app.SQLITE_FILE)
+            bank_app.import_csv_to_sqlite()
+        result = run_hammer(directory, args.processes, args.seconds, args.seed)
+        result["storage"] = bank_app.STORAGE_BACKEND
+        print_hammer(result)
+        if output:
+            with open(output, "w") as f:
+                json.dump(result, f, indent=2)
+        return 1 if result["problems"] else 0
+    if args.command == "api":
+        generate_dataset(directory, args.rows, args.users, None, args.seed)
+        result = run_api_benchmark(directory, args.port, args.concurrency, args.seconds, args.users, args.seed)
+        result["storage"] = bank_app.STORAGE_BACKEND
+        print_api(result)
+        if output:
+            with open(output, "w") as f:
+                json.dump(result, f, indent=2)
+        return 0
+    if args.command == "generate" or getattr(args, "regenerate", False) or not os.path.exists(os.path.join(directory, bank_app.LOANS_FILE)):
+        started = time.perf_counter()
+        dataset = generate_dataset(directory, args.rows, args.users, args.status_mix, args.seed)
+        print(f"generated {args.rows:,} loans / {dataset['users']:,} users in {time.perf_counter() - started:.1f}s "
+              f"-> {directory}", file=sys.stderr)
+    if args.command == "generate":
+        return 0
+
+    # the data layer resolves its file names against the working directory
+    os.chdir(directory)
+    if args.command in ("memory", "startup", "stress"):
+        if args.command == "memory":
+            results = compare_memory()
+            print_memory(results)
+        elif args.command == "startup":
+            results = compare_startup(args.repeat)
+            print_startup(results)
+        else:
+            results = compare_stress([int(w) for w in args.workers.split(",")], args.scenarios)
+            print_stress(results)
+        if output:
+            with open(output, "w") as f:
+                json.dump({"meta": {"python": platform.python_version()}, "results": results}, f, indent=2)
+        return 0
+    if bank_app.STORAGE_BACKEND == "sqlite" and (dataset or not os.path.exists(bank_app.SQLITE_FILE)):
+        if os.path.exists(bank_app.SQLITE_FILE):
+            os.remove(bank_app.SQLITE_FILE)
+        bank_app.import_csv_to_sqlite()
+    results = run_benchmarks(args.repeat, args.calls)
+    factors = bank_app.ANNUITY_FACTORS.stats()
+    report = {
+        "meta": {
+            "dataset": dataset or {"rows": sum(1 for _ in open(bank_app.LOANS_FILE)) - 1},
+            "storage": bank_app.STORAGE_BACKEND,
+            "fsync": bank_app.FSYNC_POLICY,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+        "annuity_factors": factors,
+    }
+    baseline = None
+    if compare:
+        with open(compare) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    print(f"annuity factor cache: {factors['hits']:,} hits, {factors['misses']:,} misses "
+          f"({factors['hit_rate']:.1%} hit rate), {factors['evictions']:,} evictions, "
+          f"{factors['lru_entries']:,} LRU entries beside {factors['precomputed']:,} precomputed")
+    if output:
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+import math
+import os
+import random
+import sys
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bank_app
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _random_loans(rng, count):
+    """(principal, annual rate, term years) triples, edge cases included at random."""
+    loans = []
+    for _ in range(count):
+        principal = rng.choice([0.0, -500.0, 0.01, round(rng.uniform(1, 1e6), 2)])
+        rate = rng.choice([0.0, 0.001, round(rng.uniform(0, 30), 3)])
+        term = rng.choice([0, -1, 0.5, rng.randint(1, 40), round(rng.uniform(0.1, 40), 2)])
+        loans.append((principal, rate, term))
+    return loans
+
+
+@unittest.skipIf(numpy is None, "needs NumPy")
+class BatchParityTest(unittest.TestCase):
+
+    def setUp(self):
+        self.loans = _random_loans(random.Random(5), 2000)
+        self.principals, self.rates, self.terms = map(list, zip(*self.loans))
+
+    def test_payments_and_interest_match_the_scalar_functions_within_a_cent(self):
+        payments, interest = bank_app.batch_quote(self.principals, self.rates, self.terms)
+        for (principal, rate, term), batch_m, batch_i in zip(self.loans, payments.tolist(), interest.tolist()):
+            scalar = bank_app.calculate_monthly_payment(principal, rate, term)
+            if scalar is None:
+                self.assertTrue(math.isnan(batch_m), (principal, rate, term))
+                continue
+            self.assertAlmostEqual(batch_m, scalar, delta=0.01, msg=(principal, rate, term))
+            self.assertAlmostEqual(batch_i, bank_app.total_interest_paid(scalar, principal, term), delta=0.01,
+                                   msg=(principal, rate, term))
+
+    def test_schedules_pay_off_the_principal(self):
+        schedule = bank_app.batch_amortization_schedule(self.principals[:300], self.rates[:300], self.terms[:300])
+        payments = bank_app.batch_monthly_payment(self.principals[:300], self.rates[:300], self.terms[:300])
+        for i, (principal, rate, term) in enumerate(self.loans[:300]):
+            if math.isnan(payments[i]):
+                self.assertTrue(numpy.isnan(schedule["payment"][i]).all())
+                continue
+            self.assertAlmostEqual(schedule["principal"][i].sum(), principal, delta=0.01)
+            self.assertAlmostEqual(schedule["balance"][i][math.ceil(term * 12 - 1e-9) - 1], 0.0, delta=0.01)
+            if term == int(term):  # whole months: the last payment is the regular one
+                self.assertAlmostEqual(schedule["interest"][i].sum(),
+                                       bank_app.total_interest_paid(payments[i], principal, term), delta=0.01)
+
+
+class AnnuityFactorCacheTest(unittest.TestCase):
+
+    def test_hits_from_many_threads_are_all_counted(self):
+        cache = bank_app.AnnuityFactorCache()
+
+        def look_up():
+            for _ in range(20000):
+                cache.get(7.5, 5)
+        threads = [threading.Thread(target=look_up) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        cache.get(7.25, 5)
+        cache.get(7.25, 5)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["lru_entries"]), (80001, 1, 1))
+        self.assertAlmostEqual(stats["hit_rate"], 80001 / 80002)
+
+    def test_stats_are_exported_as_gauges(self):
+        cache = bank_app.AnnuityFactorCache()
+        cache.get(7.5, 5)
+        metrics = bank_app.Metrics()
+        metrics.add_gauges("annuity_factors", cache.stats)
+        self.assertEqual(metrics.to_dict()["gauges"]["annuity_factors"]["hits"], 1)
+        self.assertIn('bank_annuity_factors{stat="hits"} 1\n', metrics.to_prometheus())
+
+
+if __name__ == "__main__":
+    unittest.main()
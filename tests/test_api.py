@@ -0,0 +1,94 @@
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bank_app
+
+
+def _loan(loan_id, username="bob"):
+    return bank_app.LoanRecord(str(loan_id), username, "Auto Loan", 1000.0, 5.0, 1, 85.61, 27.32, "pending")
+
+
+class ApiTestCase(unittest.TestCase):
+    """A LoanApiServer (not listening) over a fresh CSV store in a temporary directory."""
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+        self._saved = bank_app._storage
+        self.storage = bank_app._storage = bank_app.CsvStorage()
+        self.storage.create_if_missing()
+        self.storage.write_users({"bob": bank_app.UserRecord("x", "bob@example.com", 1000.0, "client", 0.0, 1)})
+        self.storage.append_loan(_loan(1))
+        self.server = bank_app.LoanApiServer(service=bank_app.LoanService())
+        self.server.writer = bank_app.StorageWriter()
+        self.server.service.users.writer = self.server.service.loans.writer = self.server.writer
+
+    def tearDown(self):
+        self.server.writer.flush()
+        self.storage.wait_for_compaction()
+        bank_app._storage = self._saved
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+
+class IdleSyncTest(ApiTestCase):
+
+    def test_store_is_read_off_the_event_loop(self):
+        threads = []
+        read_changes = self.server.service.read_changes
+        self.server.service.read_changes = lambda: threads.append(threading.current_thread()) or read_changes()
+        bank_app.CsvStorage().append_loan(_loan(2))  # as another process would
+        asyncio.run(self.server._sync())
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.main_thread())
+        self.assertIsNotNone(self.server.service.loans.get("2"))
+
+    def test_compaction_elsewhere_swaps_in_a_reloaded_service(self):
+        service = self.server.service
+        other = bank_app.CsvStorage()
+        other.update_loan_status("1", "approved", 1)
+        other.compact()
+        asyncio.run(self.server._sync())
+        self.assertIsNot(self.server.service, service)
+        self.assertEqual(self.server.service.loans.get("1").status, "approved")
+        self.assertIs(self.server.service.loans.writer, self.server.writer)
+
+
+class SessionTest(ApiTestCase):
+
+    @staticmethod
+    def bearer(token):
+        return {"authorization": f"Bearer {token}"}
+
+    def test_unused_token_expires(self):
+        self.server._add_session("a", "bob", "client")
+        self.assertEqual(self.server._session(self.bearer("a")), ("bob", "client"))
+        self.server.sessions["a"] = ("bob", "client", time.monotonic() - bank_app.API_SESSION_SECONDS - 1)
+        with self.assertRaises(bank_app.ApiError) as raised:
+            self.server._session(self.bearer("a"))
+        self.assertEqual(raised.exception.status, 401)
+        self.assertEqual(len(self.server.sessions), 0)
+
+    def test_least_recently_used_tokens_go_first(self):
+        max_sessions = bank_app.API_MAX_SESSIONS
+        bank_app.API_MAX_SESSIONS = 2
+        try:
+            self.server._add_session("a", "bob", "client")
+            self.server._add_session("b", "bob", "client")
+            self.server._session(self.bearer("a"))
+            self.server._add_session("c", "bob", "client")
+        finally:
+            bank_app.API_MAX_SESSIONS = max_sessions
+        self.assertEqual(list(self.server.sessions), ["a", "c"])
+
+
+if __name__ == "__main__":
+    unittest.main()
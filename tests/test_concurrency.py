@@ -0,0 +1,167 @@
+import glob
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _ROOT)
+
+import bank_app
+
+
+def _loan(loan_id, username="bob", amount=1000.0):
+    return bank_app.LoanRecord(str(loan_id), username, "Auto Loan", amount, 5.0, 1, 85.61, 27.32, "pending")
+
+
+def _python(script, *args):
+    """Command line running `script` in another process, with bank_app importable (the store is the cwd)."""
+    return [sys.executable, "-c", f"import sys; sys.path.insert(0, {_ROOT!r})\n" + script, *args]
+
+
+# holds bank.lock in another process until its stdin closes (or for 5s at most)
+_HOLD_LOCK = """
+import fcntl, os, select, sys
+fd = os.open("bank.lock", os.O_RDWR | os.O_CREAT)
+fcntl.flock(fd, fcntl.LOCK_EX)
+print("held", flush=True)
+select.select([sys.stdin], [], [], 5)
+"""
+
+
+class CsvProcessTestCase(unittest.TestCase):
+    """A CSV store in a temporary directory that other processes share through the cwd."""
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+        self._saved = bank_app._storage
+        self.storage = bank_app._storage = bank_app.CsvStorage()
+        self.storage.create_if_missing()
+        self.storage.write_users({"bob": bank_app.UserRecord("x", "bob@example.com", 1000.0, "client", 0.0, 1)})
+
+    def tearDown(self):
+        self.storage.wait_for_compaction()
+        bank_app._storage = self._saved
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+
+@unittest.skipIf(bank_app.fcntl is None, "needs flock()")
+class LockWaitTest(CsvProcessTestCase):
+
+    def test_queued_decide_does_not_wait_for_the_lock(self):
+        self.storage.append_loan(_loan(1))
+        writer = bank_app.StorageWriter()
+        service = bank_app.LoanService(writer=writer)
+        writer.flush()
+        holder = subprocess.Popen([sys.executable, "-c", _HOLD_LOCK], stdin=subprocess.PIPE,
+                                  stdout=subprocess.PIPE, text=True)
+        try:
+            self.assertEqual(holder.stdout.readline().strip(), "held")
+            started = time.perf_counter()
+            changed = service.decide(["1"], "approved")
+            self.assertLess(time.perf_counter() - started, 0.5)
+            self.assertEqual([rec.id for rec in changed], ["1"])
+            self.assertFalse(writer.flush(timeout=0.2))  # still waiting for the other process
+        finally:
+            holder.stdin.close()
+            holder.wait()
+        self.assertTrue(writer.flush(timeout=10))
+        self.assertEqual(self.storage.load_loans()[0].status, "approved")
+        self.assertEqual(self.storage.load_users()["bob"]["balance"], 1000.0)
+
+
+# approves random handfuls of the same 40 loans as the other workers; prints the ids it decided
+_APPROVE_SOME = """
+import random
+import bank_app
+service = bank_app.LoanService()
+rng = random.Random(int(sys.argv[1]))
+decided = []
+for _ in range(25):
+    try:
+        decided += [rec.id for rec in service.decide(rng.sample(range(1, 41), 3), "approved")]
+    except bank_app.StaleWriteError:
+        pass  # still conflicting after CONFLICT_RETRIES; nothing was written
+print(" ".join(decided))
+"""
+
+
+class LostUpdateTest(CsvProcessTestCase):
+
+    def test_concurrent_decisions_credit_each_loan_once(self):
+        with self.storage.batch():
+            for loan_id in range(1, 41):
+                self.storage.append_loan(_loan(loan_id, amount=loan_id))
+        workers = [subprocess.Popen(_python(_APPROVE_SOME, str(seed)), stdout=subprocess.PIPE, text=True)
+                   for seed in range(3)]
+        decided = [loan_id for worker in workers for loan_id in worker.communicate()[0].split()]
+        self.assertTrue(all(worker.returncode == 0 for worker in workers))
+
+        self.assertEqual(len(decided), len(set(decided)))  # nobody approved a loan another already had
+        approved = {rec.id for rec in self.storage.load_loans() if rec.status == "approved"}
+        self.assertEqual(approved, set(decided))
+        self.assertEqual(self.storage.load_users()["bob"]["balance"], sum(map(float, approved)))
+
+
+# commits one decision, then "crashes" before finishing it (recover() is what would)
+_CRASH_AFTER_MANIFEST = """
+import os
+import bank_app
+storage = bank_app.CsvStorage()
+storage.recover = lambda: None
+storage.commit_decisions([("1", "approved", 1)], [("balance", "bob", 1000.0, 1000.0, 2)])
+os._exit(0)
+"""
+
+
+class ManifestRecoveryTest(CsvProcessTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.storage.append_loan(_loan(1))
+
+    def state(self):
+        storage = bank_app.CsvStorage()  # as a process starting now would see it
+        return storage.load_loans()[0].status, storage.load_users()["bob"]["balance"]
+
+    def test_commit_interrupted_before_the_manifest_changes_nothing(self):
+        def crash(steps):
+            raise OSError("crashed")
+
+        self.storage._commit_manifest = crash
+        self.assertRaises(OSError, self.storage.commit_decisions, [("1", "approved", 1)],
+                          [("balance", "bob", 1000.0, 1000.0, 2)])
+        del self.storage._commit_manifest
+        self.assertTrue(glob.glob("*.tmp"))  # written, never committed
+        self.assertEqual(self.state(), ("pending", 0.0))
+
+        self.storage.commit_decisions([("1", "rejected", 1)], [])
+        self.assertEqual(self.state(), ("rejected", 0.0))
+
+    def test_commit_interrupted_after_the_manifest_is_finished_by_the_next_process(self):
+        subprocess.run(_python(_CRASH_AFTER_MANIFEST), check=True)
+        self.assertTrue(os.path.exists(bank_app.COMMIT_MANIFEST_FILE))
+        self.assertEqual(self.state(), ("approved", 1000.0))
+        self.assertFalse(os.path.exists(bank_app.COMMIT_MANIFEST_FILE))
+        self.assertEqual(glob.glob("*.tmp"), [])
+
+    def test_recover_replays_a_manifest_only_once(self):
+        subprocess.run(_python(_CRASH_AFTER_MANIFEST), check=True)
+        with open(bank_app.COMMIT_MANIFEST_FILE) as f:
+            manifest = f.read()
+        self.storage.recover()
+        with open(bank_app.COMMIT_MANIFEST_FILE, "w") as f:
+            f.write(manifest)  # as if recover() died just before removing it; its temps are gone
+        self.storage.recover()
+        self.assertEqual(self.state(), ("approved", 1000.0))
+        with open(bank_app.LOAN_STATUS_LOG_FILE) as f:
+            self.assertEqual(f.read(), "1,approved,1\n")
+
+
+if __name__ == "__main__":
+    unittest.main()
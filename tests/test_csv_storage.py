@@ -0,0 +1,277 @@
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bank_app
+
+
+def _loan(loan_id, username="bob", amount=1000.0):
+    return bank_app.LoanRecord(str(loan_id), username, "Auto Loan", amount, 5.0, 1, 85.61, 27.32, "pending")
+
+
+class CsvStoreTestCase(unittest.TestCase):
+    """A fresh CSV store in a temporary directory, installed as the process-wide backend."""
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+        self._saved = bank_app._storage
+        self.storage = bank_app._storage = bank_app.CsvStorage()
+        self.storage.create_if_missing()
+        self.storage.write_users({"bob": bank_app.UserRecord("x", "bob@example.com", 1000.0, "client", 0.0, 1)})
+
+    def tearDown(self):
+        self.storage.wait_for_compaction()
+        bank_app._storage = self._saved
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def statuses(self):
+        return {rec.id: (rec.status, rec.version) for rec in self.storage.load_loans()}
+
+
+class TwoLoansTestCase(CsvStoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        with self.storage.batch():
+            for loan_id in (12, 13):
+                self.storage.append_loan(_loan(loan_id))
+
+
+class StatusLogTest(TwoLoansTestCase):
+    def test_status_changes_load_back(self):
+        self.storage.update_loan_status("12", "approved", 1)
+        self.storage.update_loan_status("13", "rejected", 1)
+        self.assertEqual(self.statuses(), {"12": ("approved", 1), "13": ("rejected", 1)})
+
+    def test_torn_row_is_ignored_and_not_glued_to_the_next(self):
+        with open(bank_app.LOAN_STATUS_LOG_FILE, "a", newline="") as f:
+            f.write("12,rej")  # a crash mid-append
+        self.assertEqual(self.statuses(), {"12": ("pending", 0), "13": ("pending", 0)})
+
+        self.storage.update_loan_status("13", "rejected", 1)
+        self.assertEqual(self.statuses(), {"12": ("pending", 0), "13": ("rejected", 1)})
+        with open(bank_app.LOAN_STATUS_LOG_FILE, newline="") as f:
+            self.assertEqual(f.read(), "13,rejected,1\r\n")
+
+
+class CompactionTest(TwoLoansTestCase):
+
+    def test_log_past_the_threshold_is_folded_in_the_background(self):
+        compact_bytes = bank_app.STATUS_LOG_COMPACT_BYTES
+        bank_app.STATUS_LOG_COMPACT_BYTES = 1
+        try:
+            self.storage.update_loan_status("12", "approved", 1)
+        finally:
+            bank_app.STATUS_LOG_COMPACT_BYTES = compact_bytes
+        self.storage.wait_for_compaction()
+        self.assertFalse(os.path.exists(bank_app.LOAN_STATUS_LOG_FILE))
+        self.assertEqual(self.statuses(), {"12": ("approved", 1), "13": ("pending", 0)})
+
+    def test_writes_made_while_compacting_are_kept(self):
+        load = self.storage._load_status_log
+
+        def load_then_write(end=None):
+            self.storage.update_loan_status("13", "rejected", 1)
+            self.storage.append_loan(_loan(14))
+            return load(end)
+
+        self.storage.update_loan_status("12", "approved", 1)
+        self.storage._load_status_log = load_then_write
+        self.storage.compact()
+        del self.storage._load_status_log
+        with open(bank_app.LOAN_STATUS_LOG_FILE, newline="") as f:
+            self.assertEqual(f.read(), "13,rejected,1\r\n")
+        self.assertEqual(self.statuses(), {"12": ("approved", 1), "13": ("rejected", 1), "14": ("pending", 0)})
+
+    def test_crash_before_the_commit_leaves_both_files(self):
+        self.storage.update_loan_status("12", "approved", 1)
+
+        def crash(steps):
+            raise OSError("crashed")
+
+        self.storage._commit_manifest = crash
+        self.assertRaises(OSError, self.storage.compact)
+        del self.storage._commit_manifest
+        self.assertTrue(os.path.exists(bank_app.LOAN_STATUS_LOG_FILE))
+        self.assertEqual(self.statuses(), {"12": ("approved", 1), "13": ("pending", 0)})
+
+
+class LoanIdSequenceTest(CsvStoreTestCase):
+
+    def test_reservations_continue_after_a_reload(self):
+        self.assertEqual(list(self.storage.reserve_loan_ids(3)), [1, 2, 3])
+        self.assertEqual(list(bank_app.CsvStorage().reserve_loan_ids(2)), [4, 5])
+        self.assertEqual(bank_app.next_loan_id(), "6")
+
+    def test_lost_sidecar_is_recovered_from_the_loans(self):
+        self.storage.reserve_loan_ids(1)
+        with self.storage.batch():
+            for loan_id in (1, 7, 3):
+                self.storage.append_loan(_loan(loan_id))
+        os.remove(bank_app.LOAN_ID_SEQ_FILE)
+        self.assertEqual(list(self.storage.reserve_loan_ids(1)), [8])
+
+    def test_torn_sidecar_is_recovered_and_never_moves_back(self):
+        self.storage.reserve_loan_ids(10)
+        self.storage.append_loan(_loan(4))
+        with open(bank_app.LOAN_ID_SEQ_FILE, "w") as f:
+            f.write("1x")  # corrupt
+        self.assertEqual(list(self.storage.reserve_loan_ids(1)), [5])
+        with open(bank_app.LOAN_ID_SEQ_FILE, "w") as f:
+            f.write("9")
+        self.assertEqual(self.storage.recover_loan_id_sequence(), 9)  # ahead of the loans: kept
+
+
+class UserJournalTest(CsvStoreTestCase):
+
+    def balance(self):
+        bob = self.storage.load_users()["bob"]
+        return bob["balance"], bob.version
+
+    def test_entries_replay_over_the_snapshot(self):
+        self.storage.record_user_changes([("balance", "bob", 100.0, 100.0, 2)])
+        self.storage.record_user_changes([("password", "bob", "y", 3)])
+        self.assertEqual(self.balance(), (100.0, 3))
+        self.assertEqual(self.storage.load_users()["bob"]["password_hash"], "y")
+
+    def test_torn_entry_is_ignored_and_not_glued_to_the_next(self):
+        with open(bank_app.USER_JOURNAL_FILE, "a", newline="") as f:
+            f.write("balance,bob,100.0,2")  # torn before its version: looks like an unversioned entry
+        self.assertEqual(self.balance(), (0.0, 1))
+
+        self.storage.record_user_changes([("balance", "bob", 50.0, 50.0, 2)])
+        self.assertEqual(self.balance(), (50.0, 2))
+        with open(bank_app.USER_JOURNAL_FILE, newline="") as f:
+            self.assertEqual(f.read(), "balance,bob,50.0,50.0,2\r\n")
+
+
+class SnapshotRefreshTest(CsvStoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._refresh_rows = bank_app.SNAPSHOT_REFRESH_ROWS
+        bank_app.SNAPSHOT_REFRESH_ROWS = 5
+        with self.storage.batch():
+            for loan_id in range(1, 4):
+                self.storage.append_loan(_loan(loan_id))
+        bank_app.LoanRepository()  # writes the snapshot
+
+    def tearDown(self):
+        bank_app.SNAPSHOT_REFRESH_ROWS = self._refresh_rows
+        super().tearDown()
+
+    def loaded(self):
+        repo = bank_app.LoanRepository()
+        return [(dict(rec), rec.version) for rec in repo], repo.aggregates.state()
+
+    def test_long_tail_is_folded_into_a_new_snapshot(self):
+        with self.storage.batch():
+            for loan_id in range(4, 10):
+                self.storage.append_loan(_loan(loan_id))
+        self.storage.update_loan_status("2", "approved", 1)
+        before = os.stat(bank_app.LOAN_SNAPSHOT_FILE).st_mtime_ns
+        replayed = self.loaded()
+        self.assertNotEqual(os.stat(bank_app.LOAN_SNAPSHOT_FILE).st_mtime_ns, before)
+        snapshot, (loans, statuses) = self.storage.open_snapshot("loans")
+        self.assertEqual((snapshot.rows, loans, statuses), (9, [], []))
+        self.assertEqual(self.loaded(), replayed)
+        self.assertEqual(replayed[0][1], ({**dict(_loan(2)), "status": "approved"}, 1))
+
+    def test_short_tail_keeps_the_snapshot(self):
+        self.storage.append_loan(_loan(4))
+        before = os.stat(bank_app.LOAN_SNAPSHOT_FILE).st_mtime_ns
+        self.assertEqual(len(self.loaded()[0]), 4)
+        self.assertEqual(os.stat(bank_app.LOAN_SNAPSHOT_FILE).st_mtime_ns, before)
+
+
+class SnapshotValidityTest(CsvStoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        with self.storage.batch():
+            for loan_id in range(1, 4):
+                self.storage.append_loan(_loan(loan_id))
+        self.storage.update_loan_status("2", "approved", 1)
+        self.expected = [(dict(rec), rec.version) for rec in self.storage.load_loans()]
+        bank_app.LoanRepository()  # writes the snapshot
+
+    def loaded(self):
+        return [(dict(rec), rec.version) for rec in bank_app.LoanRepository()]
+
+    def test_snapshot_loads_back_the_same_loans(self):
+        self.assertIsNotNone(self.storage.open_snapshot("loans"))
+        self.assertEqual(self.loaded(), self.expected)
+
+    def test_torn_snapshot_is_ignored(self):
+        size = os.path.getsize(bank_app.LOAN_SNAPSHOT_FILE)
+        for torn in (size // 2, 10, 0):
+            os.truncate(bank_app.LOAN_SNAPSHOT_FILE, torn)
+            self.assertIsNone(self.storage.open_snapshot("loans"), torn)
+            self.assertEqual(self.loaded(), self.expected)  # from the CSVs, writing a good snapshot again
+            self.assertIsNotNone(self.storage.open_snapshot("loans"))
+
+    def test_snapshot_of_rewritten_files_is_ignored(self):
+        self.storage.compact()
+        self.assertIsNone(self.storage.open_snapshot("loans"))
+        self.assertEqual(self.loaded(), self.expected)
+
+
+class DecisionCommitTest(CsvStoreTestCase):
+
+    def setUp(self):
+        super().setUp()
+        with self.storage.batch():
+            for loan_id in (1, 2):
+                self.storage.append_loan(_loan(loan_id))
+
+    @staticmethod
+    def audit(loan_id):
+        return "audit.csv", [("2026-01-01T00:00:00", loan_id, "bob", "affordable", "approve", 1)]
+
+    @staticmethod
+    def audited():
+        with open("audit.csv", newline="") as f:
+            return [row[1] for row in csv.reader(f)]
+
+    def test_audit_is_appended_in_place(self):
+        self.storage.commit_decisions([("1", "approved", 1)], [("balance", "bob", 1000.0, 1000.0, 2)],
+                                      self.audit("1"))
+        inode = os.stat("audit.csv").st_ino
+        self.storage.commit_decisions([("2", "rejected", 1)], [], self.audit("2"))
+        self.assertEqual(os.stat("audit.csv").st_ino, inode)
+        self.assertEqual(self.audited(), ["loan_id", "1", "2"])
+        self.assertEqual(self.statuses(), {"1": ("approved", 1), "2": ("rejected", 1)})
+
+    def test_replaying_a_committed_append_does_not_repeat_it(self):
+        self.storage.commit_decisions([("1", "approved", 1)], [], self.audit("1"))
+        self.storage.recover = lambda: None  # "crash" right after writing the manifest
+        self.storage.commit_decisions([("2", "approved", 1)], [("balance", "bob", 1000.0, 1000.0, 2)],
+                                      self.audit("2"))
+        del self.storage.recover
+        with open(bank_app.COMMIT_MANIFEST_FILE) as f:
+            saved = [bank_app.COMMIT_MANIFEST_FILE] + [line.split("\t")[0] for line in f]
+        for path in saved:
+            shutil.copy(path, path + ".saved")
+
+        self.assertEqual(self.statuses(), {"1": ("approved", 1), "2": ("approved", 1)})  # rolled forward
+        # as if that recovery died after its appends (one half-written), before dropping the manifest
+        for path in saved:
+            os.replace(path + ".saved", path)
+        with open("audit.csv", "a", newline="") as f:
+            f.write("2026-01-01T00:00:00,2,bo")
+        self.assertEqual(self.statuses(), {"1": ("approved", 1), "2": ("approved", 1)})
+        self.assertEqual(self.audited(), ["loan_id", "1", "2"])
+        self.assertEqual(self.storage.load_users()["bob"]["balance"], 1000.0)
+        self.assertFalse(os.path.exists(bank_app.COMMIT_MANIFEST_FILE))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+import csv
+import os
+import random
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bank_app
+
+
+def _loan(loan_id, username="bob", amount=1000.0):
+    return bank_app.LoanRecord(str(loan_id), username, "Auto Loan", amount, 5.0, 1, 85.61, 27.32, "pending")
+
+
+class ServiceTestCase(unittest.TestCase):
+    """A LoanService over a fresh CSV store in a temporary directory."""
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+        self._saved = bank_app._storage
+        self.storage = bank_app._storage = bank_app.CsvStorage()
+        self.storage.create_if_missing()
+        self.storage.write_users({"bob": bank_app.UserRecord("x", "bob@example.com", 1000.0, "client", 0.0, 1)})
+        with self.storage.batch():
+            for loan_id in (1, 2):
+                self.storage.append_loan(_loan(loan_id))
+        self.service = bank_app.LoanService()
+
+    def tearDown(self):
+        self.storage.wait_for_compaction()
+        bank_app._storage = self._saved
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def statuses(self):
+        return {rec.id: rec.status for rec in self.storage.load_loans()}
+
+
+class ScreeningConflictTest(ServiceTestCase):
+
+    rules = bank_app.compile_rules([{"name": "everything", "when": [["amount", ">", 0]], "outcome": "reject"}])
+
+    def test_loan_decided_here_since_screening_is_not_retried(self):
+        screening = self.service.screen_pending(self.rules)
+        self.service.decide(["1"], "approved")
+        self.assertRaises(bank_app.StaleWriteError, self.service.apply_screening, screening, "audit.csv")
+        self.assertEqual(self.service.conflicts, 0)
+        self.assertEqual(self.statuses(), {"1": "approved", "2": "pending"})
+        self.assertFalse(os.path.exists("audit.csv"))
+
+    def test_loan_decided_by_another_process_is_synced_for_the_next_screening(self):
+        screening = self.service.screen_pending(self.rules)
+        bank_app.CsvStorage().update_loan_status("1", "approved", 1)
+        self.assertRaises(bank_app.StaleWriteError, self.service.apply_screening, screening, "audit.csv")
+        self.assertEqual(self.service.conflicts, 0)
+        self.assertEqual(self.service.loans.get("1").status, "approved")
+
+        self.assertEqual(self.service.screen_pending(self.rules, apply=True, audit_path="audit.csv")["applied"], 1)
+        self.assertEqual(self.statuses(), {"1": "approved", "2": "rejected"})
+
+
+class ScreeningCommitTest(ServiceTestCase):
+
+    rules = bank_app.compile_rules([{"name": "small", "when": [["amount", "<", 5000]], "outcome": "approve"}])
+
+    def test_applied_screening_loads_back(self):
+        self.assertEqual(self.service.screen_pending(self.rules, apply=True, audit_path="audit.csv")["applied"], 2)
+        fresh = bank_app.LoanService()
+        self.assertEqual([rec.status for rec in fresh.loans], ["approved", "approved"])
+        self.assertEqual(fresh.users.get("bob")["balance"], 2000.0)
+        self.assertEqual(fresh.loans.aggregates.user("bob")["count"], 2)
+        with open("audit.csv", newline="") as f:
+            rows = list(csv.reader(f))
+        self.assertEqual(rows[0], bank_app.SCREENING_AUDIT_FIELDS)
+        self.assertEqual([row[1:] for row in rows[1:]], [["1", "bob", "small", "approve", "1"],
+                                                         ["2", "bob", "small", "approve", "1"]])
+
+    def test_screening_that_crashes_before_its_commit_leaves_nothing(self):
+        def crash(steps):
+            raise OSError("crashed")
+
+        screening = self.service.screen_pending(self.rules)
+        self.storage._commit_manifest = crash
+        self.assertRaises(OSError, self.service.apply_screening, screening, "audit.csv")
+        del self.storage._commit_manifest
+        fresh = bank_app.LoanService()
+        self.assertEqual([rec.status for rec in fresh.loans], ["pending", "pending"])
+        self.assertEqual(fresh.users.get("bob")["balance"], 0.0)
+        self.assertFalse(os.path.exists("audit.csv"))
+        self.assertEqual(self.service.apply_screening(screening, "audit.csv"), 2)  # nothing in memory moved either
+
+
+class AggregatesTest(ServiceTestCase):
+
+    def test_random_operations_keep_the_running_totals_exact(self):
+        rng = random.Random(17)
+        for username in ("amy", "cal"):
+            self.service.create_hashed_account(username, "x", income=5000.0)
+        for step in range(300):
+            pending = [rec.id for rec in self.service.loans.with_status("pending")]
+            action = rng.random()
+            if action < 0.5 or not pending:
+                loan_type = rng.choice(sorted(bank_app.LOAN_OPTIONS))
+                quote = self.service.quote(loan_type, round(rng.uniform(100, 50000), 2),
+                                           rng.randint(1, bank_app.LOAN_OPTIONS[loan_type]["max_term"]), 1e9)
+                self.service.submit(rng.choice(["bob", "amy", "cal"]), quote)
+            elif action < 0.9:
+                self.service.decide(rng.sample(pending, min(len(pending), rng.randint(1, 5))),
+                                    rng.choice(["approved", "rejected"]))
+            else:
+                self.service.loans.set_status(rng.choice(pending), rng.choice(["approved", "Rejected", "pending"]))
+            self.assertEqual(self.service.loans.verify_aggregates(), [], f"step {step}")
+        self.assertEqual(self.service.loans.verify_aggregates(from_storage=True), [])
+        self.assertEqual(bank_app.LoanService().loans.aggregates.state(), self.service.loans.aggregates.state())
+
+    def test_a_batch_move_matches_one_by_one_updates(self):
+        rng = random.Random(3)
+        loans = [_loan(i, rng.choice(["bob", "amy"]), round(rng.uniform(1, 1000), 2)) for i in range(200)]
+        batched, single = bank_app.PortfolioAggregates(loans), bank_app.PortfolioAggregates(loans)
+        moved = rng.sample(loans, 120)
+        batched.move(moved, "pending", "approved")
+        for rec in moved:
+            single.remove(rec)
+            rec.status = "approved"
+            single.add(rec)
+        self.assertEqual(batched.state(), single.state())
+
+
+if __name__ == "__main__":
+    unittest.main()
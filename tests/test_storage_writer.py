@@ -0,0 +1,78 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bank_app
+
+
+def _loan(loan_id, username="bob"):
+    return bank_app.LoanRecord(str(loan_id), username, "Auto Loan", 1000.0, 5.0, 1, 85.61, 27.32, "pending")
+
+
+class SqliteWriterBatchTest(unittest.TestCase):
+    """StorageWriter batches over a SQLite store."""
+
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+        self._saved = bank_app._storage
+        self.storage = bank_app._storage = bank_app.SqliteStorage("bank.db")
+        self.storage.write_users({"bob": bank_app.UserRecord("x", "bob@example.com", 1000.0, "client", 0.0, 1),
+                                  "amy": bank_app.UserRecord("x", "amy@example.com", 1000.0, "client", 0.0, 1)})
+        with self.storage.batch():
+            for loan_id, username in ((1, "bob"), (2, "bob"), (3, "amy")):
+                self.storage.append_loan(_loan(loan_id, username))
+
+    def tearDown(self):
+        self.storage.close()
+        bank_app._storage = self._saved
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def test_failed_job_rolls_back_alone(self):
+        # a job that fails inside a coalesced batch must not commit any of its writes
+        writer = bank_app.StorageWriter()
+        errors, done = [], []
+        gate = threading.Event()
+        # holds the writer so the next two jobs are coalesced into one batch
+        writer.submit(gate.wait)
+        # bob is at version 1, so an entry claiming version 5 is stale
+        writer.submit(self.storage.commit_decisions, [("1", "approved", 1), ("2", "approved", 1)],
+                      [("balance", "bob", 2000.0, 2000.0, 5)], on_error=errors.append)
+        writer.submit(self.storage.commit_decisions, [("3", "approved", 1)],
+                      [("balance", "amy", 1000.0, 1000.0, 2)], on_done=lambda: done.append(True))
+        gate.set()
+        self.assertTrue(writer.flush(timeout=10))
+
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], bank_app.StaleWriteError)
+        self.assertEqual(done, [True])
+        statuses = {rec.id: rec.status for rec in self.storage.load_loans()}
+        self.assertEqual(statuses, {"1": "pending", "2": "pending", "3": "approved"})
+        users = self.storage.load_users()
+        self.assertEqual((users["bob"]["balance"], users["bob"].version), (0.0, 1))
+        self.assertEqual((users["amy"]["balance"], users["amy"].version), (1000.0, 2))
+
+
+    def test_flush_returns_after_the_callbacks_are_dispatched(self):
+        dispatched = []
+
+        def slow_dispatch(fn, *args):
+            time.sleep(0.1)  # e.g. waiting for the GUI's queue
+            dispatched.append(fn)
+
+        writer = bank_app.StorageWriter(dispatch=slow_dispatch)
+        done = lambda: None
+        writer.submit(self.storage.update_loan_status, "1", "rejected", 1, on_done=done)
+        self.assertTrue(writer.flush(timeout=10))
+        self.assertEqual(dispatched, [done])
+
+
+if __name__ == "__main__":
+    unittest.main()